@@ -11,12 +11,14 @@ from eth_utils import is_same_address, to_checksum_address
 
 from microraiden.config import NETWORK_CFG
 from microraiden.constants import PROXY_BALANCE_LIMIT
-from microraiden.utils import get_logs
+from microraiden.utils import get_event_logs, address_to_topic
 
 
 class Blockchain(gevent.Greenlet):
     """Class that watches the blockchain and relays events to the channel manager."""
     poll_interval = 2
+    # all have the receiver address as their second indexed argument
+    events = ('ChannelCreated', 'ChannelToppedUp', 'ChannelSettled', 'ChannelCloseRequested')
 
     def __init__(
             self,
@@ -111,36 +113,31 @@ class Blockchain(gevent.Greenlet):
                 self.cm.state.unconfirmed_head_number >= new_unconfirmed_head_number):
             return
 
-        # filter for events after block_number
-        filters_confirmed = {
-            'from_block': self.cm.state.confirmed_head_number + 1,
-            'to_block': new_confirmed_head_number,
-            'argument_filters': {
-                '_receiver_address': self.cm.state.receiver
-            }
-        }
-        filters_unconfirmed = {
-            'from_block': self.cm.state.unconfirmed_head_number + 1,
-            'to_block': new_unconfirmed_head_number,
-            'argument_filters': {
-                '_receiver_address': self.cm.state.receiver
-            }
-        }
+        # block ranges of events after the synced heads
+        confirmed_range = (self.cm.state.confirmed_head_number + 1, new_confirmed_head_number)
+        unconfirmed_range = (
+            self.cm.state.unconfirmed_head_number + 1,
+            new_unconfirmed_head_number
+        )
         self.log.debug(
             'filtering for events u:%s-%s c:%s-%s @%d',
-            filters_unconfirmed['from_block'],
-            filters_unconfirmed['to_block'],
-            filters_confirmed['from_block'],
-            filters_confirmed['to_block'],
+            unconfirmed_range[0],
+            unconfirmed_range[1],
+            confirmed_range[0],
+            confirmed_range[1],
             current_block
         )
+        events = self.get_events(
+            min(confirmed_range[0], unconfirmed_range[0]),
+            new_unconfirmed_head_number
+        )
+
+        def select_logs(event_name, block_range):
+            return [log for log in events[event_name]
+                    if block_range[0] <= log['blockNumber'] <= block_range[1]]
 
         # unconfirmed channel created
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelCreated',
-            **filters_unconfirmed
-        )
+        logs = select_logs('ChannelCreated', unconfirmed_range)
         for log in logs:
             assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
             sender = log['args']['_sender_address']
@@ -155,11 +152,7 @@ class Blockchain(gevent.Greenlet):
             self.cm.unconfirmed_event_channel_opened(sender, open_block_number, deposit)
 
         # channel created
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelCreated',
-            **filters_confirmed
-        )
+        logs = select_logs('ChannelCreated', confirmed_range)
         for log in logs:
             assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
             sender = log['args']['_sender_address']
@@ -171,11 +164,7 @@ class Blockchain(gevent.Greenlet):
             self.cm.event_channel_opened(sender, open_block_number, deposit)
 
         # unconfirmed channel top ups
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelToppedUp',
-            **filters_unconfirmed
-        )
+        logs = select_logs('ChannelToppedUp', unconfirmed_range)
         for log in logs:
             assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
             txhash = log['transactionHash']
@@ -197,11 +186,7 @@ class Blockchain(gevent.Greenlet):
             )
 
         # confirmed channel top ups
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelToppedUp',
-            **filters_confirmed
-        )
+        logs = select_logs('ChannelToppedUp', confirmed_range)
         for log in logs:
             assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
             txhash = log['transactionHash']
@@ -218,11 +203,7 @@ class Blockchain(gevent.Greenlet):
             self.cm.event_channel_topup(sender, open_block_number, txhash, added_deposit)
 
         # channel settled event
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelSettled',
-            **filters_confirmed
-        )
+        logs = select_logs('ChannelSettled', confirmed_range)
         for log in logs:
             assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
             sender = log['args']['_sender_address']
@@ -233,17 +214,13 @@ class Blockchain(gevent.Greenlet):
             self.cm.event_channel_settled(sender, open_block_number)
 
         # channel close requested
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelCloseRequested',
-            **filters_confirmed
-        )
+        logs = select_logs('ChannelCloseRequested', confirmed_range)
         for log in logs:
             assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
             sender = log['args']['_sender_address']
             sender = to_checksum_address(sender)
             open_block_number = log['args']['_open_block_number']
-            if (sender, open_block_number) not in self.cm.channels:
+            if self.cm.get_channel(sender, open_block_number) is None:
                 continue
             balance = log['args']['_balance']
             try:
@@ -290,6 +267,26 @@ class Blockchain(gevent.Greenlet):
         if not self.wait_sync_event.is_set() and new_unconfirmed_head_number == current_block:
             self.wait_sync_event.set()
 
+    def get_events(self, from_block: int, to_block: int):
+        """Fetch all channel events of the receiver in a block range with a single request.
+
+        Returns:
+            dict: event name => list of logs in chain order
+        """
+        events = {event_name: [] for event_name in self.events}
+        if from_block > to_block:
+            return events
+        logs = get_event_logs(
+            self.channel_manager_contract,
+            self.events,
+            from_block=from_block,
+            to_block=to_block,
+            topics=[None, address_to_topic(self.cm.state.receiver)]
+        )
+        for log in logs:
+            events[log['event']].append(log)
+        return events
+
     def insufficient_balance_recover(self):
         """Recover from an insufficient balance state by closing
         all pending channels if possible."""
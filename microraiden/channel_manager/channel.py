@@ -1,6 +1,7 @@
+import sys
 import time
 from enum import IntEnum
-from eth_utils import is_address
+from eth_utils import is_address, decode_hex, encode_hex
 
 
 class ChannelState(IntEnum):
@@ -11,6 +12,24 @@ class ChannelState(IntEnum):
 
 
 class Channel(object):
+    # A receiver may have hundreds of thousands of channels, so instances don't have a __dict__.
+    # The balance signature is kept as 65 bytes and converted to hex only when it is read.
+    # The sender is kept as the string used in the channel index key, so it isn't duplicated.
+    __slots__ = (
+        'receiver',
+        'sender',
+        'deposit',
+        'open_block_number',
+        'balance',
+        'state',
+        '_last_signature',
+        'settle_timeout',
+        'ctime',
+        'mtime',
+        'confirmed',
+        '_unconfirmed_topups'
+    )
+
     def __init__(self,
                  receiver: str,
                  sender: str,
@@ -30,21 +49,60 @@ class Channel(object):
         assert is_address(sender)
         assert deposit >= 0
         assert open_block_number >= 0
-        self.receiver = receiver
+        # all channels share the same receiver string
+        self.receiver = sys.intern(receiver)
         self.sender = sender  # sender address
         self.deposit = deposit  # deposit is maximum funds that can be used
         self.open_block_number = open_block_number
 
         self.balance = 0  # how much of the deposit has been spent
         self.state = ChannelState.UNDEFINED
-        self.last_signature = None
+        self._last_signature = None
         # if set, this is the absolute block_number the channel can be settled
         self.settle_timeout = -1
         self.ctime = time.time()  # channel creation time
         self.mtime = self.ctime
         self.confirmed = False
 
-        self.unconfirmed_topups = {}  # txhash to added deposit
+        # txhash to added deposit, allocated when the first topup is added
+        self._unconfirmed_topups = None
+
+    @property
+    def last_signature(self) -> str:
+        """
+        Returns:
+            str: hex encoded signature of the last balance proof or None
+        """
+        if self._last_signature is None:
+            return None
+        return encode_hex(self._last_signature)
+
+    @last_signature.setter
+    def last_signature(self, value) -> None:
+        if isinstance(value, str):
+            value = decode_hex(value)
+        self._last_signature = value
+
+    @property
+    def unconfirmed_topups(self) -> dict:
+        """
+        Returns:
+            dict: txhash => added deposit of unconfirmed topups
+        """
+        if self._unconfirmed_topups is None:
+            self._unconfirmed_topups = {}
+        return self._unconfirmed_topups
+
+    @unconfirmed_topups.setter
+    def unconfirmed_topups(self, value: dict) -> None:
+        self._unconfirmed_topups = value or None
+
+    def unconfirmed_topups_items(self):
+        """Like `unconfirmed_topups.items()`, but doesn't allocate a dict for a channel
+        without topups."""
+        if self._unconfirmed_topups is None:
+            return ()
+        return self._unconfirmed_topups.items()
 
     @property
     def is_closed(self) -> bool:
@@ -65,20 +123,32 @@ class Channel(object):
         Returns:
             int: sum of all deposits, including unconfirmed ones
         """
-        return self.deposit + sum(self.unconfirmed_topups.values())
+        return self.deposit + sum(v for _, v in self.unconfirmed_topups_items())
 
     def to_dict(self) -> dict:
         """
         Returns:
             dict: Channel object serialized as a dict
         """
-        return self.__dict__
+        return {
+            'receiver': self.receiver,
+            'sender': self.sender,
+            'deposit': self.deposit,
+            'open_block_number': self.open_block_number,
+            'balance': self.balance,
+            'state': self.state,
+            'last_signature': self.last_signature,
+            'settle_timeout': self.settle_timeout,
+            'ctime': self.ctime,
+            'mtime': self.mtime,
+            'confirmed': self.confirmed,
+            'unconfirmed_topups': dict(self.unconfirmed_topups_items())
+        }
 
     @classmethod
     def from_dict(cls, state: dict):
-        ret = cls(None, None, None, None)
-        assert (set(state) - set(ret.__dict__)) == set()
+        ret = cls(state['receiver'], state['sender'], state['deposit'], state['open_block_number'])
+        assert (set(state) - set(ret.to_dict())) == set()
         for k, v in state.items():
-            if k in ret.__dict__.keys():
-                setattr(ret, k, v)
+            setattr(ret, k, v)
         return ret
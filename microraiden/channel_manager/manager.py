@@ -1,4 +1,5 @@
 """Channel manager handles channel state changes on a low (blockchain) level."""
+import json
 import time
 
 import gevent
@@ -17,9 +18,9 @@ from web3.contract import Contract
 
 from microraiden.utils import (
     verify_balance_proof,
-    privkey_to_addr,
+    Signer,
     sign_close,
-    create_signed_contract_transaction
+    TransactionBuilder
 )
 from microraiden.exceptions import (
     NetworkIdMismatch,
@@ -37,6 +38,7 @@ from microraiden.constants import CHANNEL_MANAGER_CONTRACT_VERSION
 from .state import ChannelManagerState
 from .blockchain import Blockchain
 from .channel import Channel, ChannelState
+from .verifier import SignatureVerifier
 
 log = logging.getLogger(__name__)
 
@@ -51,31 +53,109 @@ class ChannelManager(gevent.Greenlet):
             token_contract: Contract,
             private_key: str,
             state_filename: str = None,
-            n_confirmations=1
+            n_confirmations=1,
+            payment_flush_interval: float = None,
+            payment_flush_size: int = None,
+            state_wal: bool = False,
+            state_synchronous: str = None,
+            state_threaded: bool = False,
+            state_backend: str = 'sqlite',
+            state_balance_log: bool = False,
+            state_compact_interval: float = None,
+            balance_refresh_interval: float = 15,
+            balance_max_age: float = 60,
+            balance_recheck_interval: float = 5,
+            verify_workers: int = None,
+            verify_max_pending: int = 1000
     ) -> None:
+        """
+        Args:
+            payment_flush_interval (float, optional): commit payments in batches at least
+                every `payment_flush_interval` seconds instead of committing every payment
+            payment_flush_size (int, optional): commit payments in batches of at most
+                `payment_flush_size` payments
+            state_wal (bool, optional): run the state database in write-ahead log mode and
+                serve admin/stats queries from a separate read-only connection
+            state_synchronous (str, optional): `PRAGMA synchronous` of the state database
+            state_threaded (bool, optional): run state database I/O on a dedicated thread
+                instead of blocking the gevent hub
+            state_backend (str, optional): storage backend of the state, 'sqlite' (default),
+                'log' (append-only log file) or 'memory' (not persisted). The `state_wal`,
+                `state_synchronous`, `state_threaded` and `state_balance_log` options apply
+                to 'sqlite' only.
+            state_balance_log (bool, optional): append payments to a memory-mapped log that is
+                merged into the state database periodically and on stop
+            state_compact_interval (float, optional): compact the state storage, e.g. merge the
+                balance log, every `state_compact_interval` seconds
+            balance_refresh_interval (float, optional): refresh the cached token and ETH
+                balances of the receiver every `balance_refresh_interval` seconds and after
+                channel events that change them. Default is 15.
+            balance_max_age (float, optional): cached balances older than `balance_max_age`
+                seconds, e.g. because the node doesn't respond, are fetched again on access.
+                Default is 60.
+            balance_recheck_interval (float, optional): min. number of seconds between two
+                fetches of the balances by `recheck_balances()`. Default is 5.
+            verify_workers (int, optional): recover signers of balance proofs on a pool of
+                `verify_workers` threads instead of the gevent hub
+            verify_max_pending (int, optional): max. number of balance proofs queued for or
+                in verification by the worker pool
+        """
         gevent.Greenlet.__init__(self)
+        self.state = None
+        self.payment_flusher = None
+        self.state_compactor = None
+        self.state_compact_interval = state_compact_interval
+        self.balance_refresher = None
+        self.balance_refresh_interval = balance_refresh_interval
+        self.balance_max_age = balance_max_age
+        self.balance_recheck_interval = balance_recheck_interval
+        # set to refresh the balances before `balance_refresh_interval` elapsed
+        self.balance_refresh_event = gevent.event.Event()
+        # token and ETH balance of the receiver, refreshed by `balance_refresher`
+        self.liquid_balance = None
+        self.eth_balance = None
+        self.balances_mtime = 0
+        self.verifier = None
+        if verify_workers is not None:
+            self.verifier = SignatureVerifier(verify_workers, verify_max_pending)
         self.blockchain = Blockchain(
             web3,
             channel_manager_contract,
             self,
             n_confirmations=n_confirmations
         )
-        self.receiver = privkey_to_addr(private_key)
         self.private_key = private_key
+        self.signer = Signer(private_key)
+        self.receiver = self.signer.address
         self.channel_manager_contract = channel_manager_contract
         self.token_contract = token_contract
         self.n_confirmations = n_confirmations
         self.log = logging.getLogger('channel_manager')
         network_id = int(web3.version.network)
-        assert is_same_address(privkey_to_addr(self.private_key), self.receiver)
+        self.transactions = TransactionBuilder(
+            self.signer, channel_manager_contract, network_id=network_id
+        )
 
         # check contract version
         self.check_contract_version()
 
-        if state_filename not in (None, ':memory:') and os.path.isfile(state_filename):
-            self.state = ChannelManagerState.load(state_filename)
+        state_kwargs = dict(
+            payment_flush_interval=payment_flush_interval,
+            payment_flush_size=payment_flush_size,
+            backend=state_backend
+        )
+        if state_backend == 'sqlite':
+            state_kwargs.update(
+                wal=state_wal,
+                synchronous=state_synchronous,
+                threaded=state_threaded,
+                balance_log=state_balance_log
+            )
+        if (state_backend != 'memory' and state_filename not in (None, ':memory:') and
+                os.path.isfile(state_filename)):
+            self.state = ChannelManagerState.load(state_filename, **state_kwargs)
         else:
-            self.state = ChannelManagerState(state_filename)
+            self.state = ChannelManagerState(state_filename, **state_kwargs)
             self.state.setup_db(
                 network_id,
                 channel_manager_contract.address,
@@ -109,12 +189,90 @@ class ChannelManager(gevent.Greenlet):
         self.stop()
 
     def _run(self):
+        if self.state.payment_flush_interval is not None:
+            self.payment_flusher = gevent.spawn(self._flush_payments)
+        if self.state_compact_interval is not None:
+            self.state_compactor = gevent.spawn(self._compact_state)
+        self.balance_refresher = gevent.spawn(self._refresh_balances)
         self.blockchain.start()
 
     def stop(self):
         if self.blockchain.running:
             self.blockchain.stop()
             self.blockchain.join()
+        for greenlet in (self.payment_flusher, self.state_compactor, self.balance_refresher):
+            if greenlet is not None:
+                greenlet.kill()
+        self.payment_flusher = None
+        self.state_compactor = None
+        self.balance_refresher = None
+        if self.verifier is not None:
+            self.verifier.close()
+            self.verifier = None
+        if self.state is not None and not self.state.closed:
+            self.state.compact()
+            self.state.close()
+
+    def _flush_payments(self):
+        """Periodically commit queued payments."""
+        while True:
+            wait = self.state.last_payment_flush + self.state.payment_flush_interval - time.time()
+            if wait > 0:
+                gevent.sleep(wait)
+                continue
+            try:
+                self.state.flush_payments()
+            except Exception as e:
+                # keep flushing, payments would only be committed on stop otherwise. The
+                # payments stay queued and are written by the next flush.
+                self.log.warning('failed to commit queued payments: %r', e)
+
+    def _compact_state(self):
+        """Periodically compact the state storage."""
+        while True:
+            gevent.sleep(self.state_compact_interval)
+            try:
+                self.state.compact()
+            except Exception as e:
+                # keep compacting, the balance log would fill up otherwise
+                self.log.warning('failed to compact the state: %r', e)
+
+    def _refresh_balances(self):
+        """Periodically refresh the cached balances of the receiver."""
+        while True:
+            self.balance_refresh_event.clear()
+            try:
+                self.update_balances()
+            except Exception as e:
+                # keep refreshing, the cached balances would go stale otherwise
+                self.log.warning('failed to refresh the receiver balances: %r', e)
+            self.balance_refresh_event.wait(self.balance_refresh_interval)
+
+    def update_balances(self):
+        """Fetch the token and ETH balances of the receiver and cache them."""
+        self.liquid_balance = self.get_liquid_balance()
+        self.eth_balance = self.get_eth_balance()
+        self.balances_mtime = time.time()
+
+    def refresh_balances(self):
+        """Make the background refresh update the cached balances now."""
+        self.balance_refresh_event.set()
+
+    def recheck_balances(self):
+        """Fetch the balances of the receiver unless they have been fetched in the last
+        `balance_recheck_interval` seconds.
+
+        Used to notice a refill of a receiver that is out of ETH without querying the node on
+        every request.
+        """
+        if time.time() - self.balances_mtime >= self.balance_recheck_interval:
+            self.update_balances()
+
+    def balances_stale(self):
+        """Returns:
+            bool: True if the cached balances are older than `balance_max_age`
+        """
+        return time.time() - self.balances_mtime > self.balance_max_age
 
     def set_head(self,
                  unconfirmed_head_number: int,
@@ -135,7 +293,7 @@ class ChannelManager(gevent.Greenlet):
     def event_channel_opened(self, sender: str, open_block_number: int, deposit: int):
         """Notify the channel manager of a new confirmed channel opening."""
         assert is_checksum_address(sender)
-        if (sender, open_block_number) in self.channels:
+        if self.get_channel(sender, open_block_number) is not None:
             return  # ignore event if already provessed
         c = Channel(self.state.receiver, sender, deposit, open_block_number)
         c.confirmed = True
@@ -148,9 +306,8 @@ class ChannelManager(gevent.Greenlet):
         assert is_checksum_address(sender)
         assert deposit >= 0
         assert open_block_number > 0
-        event_already_processed = (sender, open_block_number) in self.unconfirmed_channels
-        channel_already_confirmed = (sender, open_block_number) in self.channels
-        if event_already_processed or channel_already_confirmed:
+        # ignore event if already processed or if the channel is already confirmed
+        if self.get_channel(sender, open_block_number, confirmed=None) is not None:
             return
         c = Channel(self.state.receiver, sender, deposit, open_block_number)
         c.confirmed = False
@@ -171,14 +328,14 @@ class ChannelManager(gevent.Greenlet):
             settle_timeout (int):   settle timeout in blocks"""
         assert is_checksum_address(sender)
         assert settle_timeout >= 0
-        if (sender, open_block_number) not in self.channels:
+        c = self.get_channel(sender, open_block_number)
+        if c is None:
             self.log.warning(
                 'attempt to close a non existing channel (sender %ss, block_number %ss)',
                 sender,
                 open_block_number
             )
             return
-        c = self.channels[sender, open_block_number]
         if c.balance > balance:
             self.log.warning('sender tried to cheat, sending challenge '
                              '(sender %s, block number %s)',
@@ -200,14 +357,17 @@ class ChannelManager(gevent.Greenlet):
         self.log.info('Forgetting settled channel (sender %s, block number %s)',
                       sender, open_block_number)
         self.state.del_channel(sender, open_block_number)
+        # the settlement transferred tokens to the receiver
+        self.refresh_balances()
 
     def unconfirmed_event_channel_topup(
             self, sender, open_block_number, txhash, added_deposit
     ):
         """Notify the channel manager of a topup with not enough confirmations yet."""
         assert is_checksum_address(sender)
-        if (sender, open_block_number) not in self.channels:
-            assert (sender, open_block_number) in self.unconfirmed_channels
+        c = self.get_channel(sender, open_block_number)
+        if c is None:
+            assert self.get_channel(sender, open_block_number, confirmed=False) is not None
             self.log.info('Ignoring unconfirmed topup of unconfirmed channel '
                           '(sender %s, block number %s, added %s)',
                           sender, open_block_number, added_deposit)
@@ -215,7 +375,6 @@ class ChannelManager(gevent.Greenlet):
         self.log.info('Registering unconfirmed deposit top up '
                       '(sender %s, block number %s, added %s)',
                       sender, open_block_number, added_deposit)
-        c = self.channels[sender, open_block_number]
         c.unconfirmed_topups[txhash] = added_deposit
         self.state.set_channel(c)
 
@@ -226,8 +385,8 @@ class ChannelManager(gevent.Greenlet):
             'Registering deposit top up (sender %s, block number %s, added deposit %s)',
             sender, open_block_number, added_deposit
         )
-        assert (sender, open_block_number) in self.channels
-        c = self.channels[sender, open_block_number]
+        c = self.get_channel(sender, open_block_number)
+        assert c is not None
         if c.is_closed is True:
             self.log.warning(
                 "Topup of an already closed channel (sender=%s open_block=%d)" %
@@ -248,50 +407,57 @@ class ChannelManager(gevent.Greenlet):
             open_block_number (int):    block the channel was open in
         """
         assert is_checksum_address(sender)
-        if not (sender, open_block_number) in self.channels:
+        c = self.get_channel(sender, open_block_number)
+        if c is None:
             self.log.warning(
                 "attempt to close a non-registered channel (sender=%s open_block=%s" %
                 (sender, open_block_number)
             )
             return
-        c = self.channels[sender, open_block_number]
         if c.last_signature is None:
             raise NoBalanceProofReceived('Cannot close a channel without a balance proof.')
         # send closing tx
         closing_sig = sign_close(
-            self.private_key,
+            self.signer,
             sender,
             open_block_number,
             c.balance,
             self.channel_manager_contract.address
         )
 
-        raw_tx = create_signed_contract_transaction(
-            self.private_key,
-            self.channel_manager_contract,
-            'cooperativeClose',
-            [
-                self.state.receiver,
-                open_block_number,
-                c.balance,
-                decode_hex(c.last_signature),
-                closing_sig
-            ]
-        )
+        close_args = [
+            self.state.receiver,
+            open_block_number,
+            c.balance,
+            decode_hex(c.last_signature),
+            closing_sig
+        ]
+        raw_tx = self.transactions.create('cooperativeClose', close_args)
 
-        # update local state
-        c.is_closed = True
-        c.mtime = time.time()
-        self.state.set_channel(c)
+        try:
+            # update local state
+            c.is_closed = True
+            c.mtime = time.time()
+            self.state.set_channel(c)
+        except Exception:
+            # the transaction is not sent, so its nonce has to be handed out again
+            self.transactions.nonces.resync()
+            raise
 
         try:
-            txid = self.blockchain.web3.eth.sendRawTransaction(raw_tx)
+            txid = self.transactions.send(
+                raw_tx,
+                retry=lambda: self.transactions.create('cooperativeClose', close_args)
+            )
             self.log.info('sent channel close(sender %s, block number %s, tx %s)',
                           sender, open_block_number, txid)
         except InsufficientBalance:
             c.state = ChannelState.CLOSE_PENDING
             self.state.set_channel(c)
             raise
+        finally:
+            # sending the transaction costs gas
+            self.refresh_balances()
 
     def force_close_channel(self, sender: str, open_block_number: int):
         """Forcibly remove a channel from our channel state"""
@@ -300,7 +466,7 @@ class ChannelManager(gevent.Greenlet):
             self.close_channel(sender, open_block_number)
             return
         except NoBalanceProofReceived:
-            c = self.channels[sender, open_block_number]
+            c = self.get_channel(sender, open_block_number)
             c.is_closed = True
             self.state.set_channel(c)
 
@@ -311,10 +477,10 @@ class ChannelManager(gevent.Greenlet):
             the channel by directly calling contract's close method on-chain.
         """
         assert is_checksum_address(sender)
-        if (sender, open_block_number) not in self.channels:
+        c = self.get_channel(sender, open_block_number)
+        if c is None:
             raise NoOpenChannel('Channel does not exist or has been closed'
                                 '(sender=%s, open_block_number=%d)' % (sender, open_block_number))
-        c = self.channels[sender, open_block_number]
         if c.is_closed:
             raise NoOpenChannel('Channel closing has been requested already.')
         assert balance is not None
@@ -325,7 +491,7 @@ class ChannelManager(gevent.Greenlet):
         c.is_closed = True
         c.mtime = time.time()
         receiver_sig = sign_close(
-            self.private_key,
+            self.signer,
             sender,
             open_block_number,
             c.balance,
@@ -338,39 +504,73 @@ class ChannelManager(gevent.Greenlet):
 
     def get_locked_balance(self):
         """Get the balance in all channels combined."""
-        return sum([c.balance for c in self.channels.values()])
+        return self.state.stats.balance_sum
 
     def get_liquid_balance(self):
         """Get the balance of the receiver in the token contract (not locked in channels)."""
         balance = self.token_contract.call().balanceOf(self.receiver)
         return balance
 
+    def get_cached_liquid_balance(self):
+        """Get the token balance of the receiver as of the last background refresh.
+
+        The balances are fetched if they are stale, see `balance_max_age`.
+        """
+        if self.balances_stale():
+            self.update_balances()
+        return self.liquid_balance
+
+    def get_cached_eth_balance(self):
+        """Get the ETH balance of the receiver as of the last background refresh.
+
+        The balances are fetched if they are stale, see `balance_max_age`.
+        """
+        if self.balances_stale():
+            self.update_balances()
+        return self.eth_balance
+
     def get_eth_balance(self):
         """Get eth balance of the receiver"""
         return self.channel_manager_contract.web3.eth.getBalance(self.receiver)
 
-    def verify_balance_proof(self, sender, open_block_number, balance, signature):
-        """Verify that a balance proof is valid and return the sender.
+    def get_open_channel(self, sender: str, open_block_number: int):
+        """Get a confirmed channel that accepts payments.
 
-        This method just verifies if the balance proof is valid - no state update is performed.
+        This only checks the channel state and is cheap compared to verifying a balance proof,
+        so it should run first.
 
-        :returns: Channel, if it exists
+        Returns:
+            Channel: the channel
+        Raises:
+            NoOpenChannel: the channel doesn't exist or is closed
+            InsufficientConfirmations: the channel isn't confirmed yet
         """
         assert is_checksum_address(sender)
-        if (sender, open_block_number) in self.unconfirmed_channels:
+        c = self.get_channel(sender, open_block_number, confirmed=None)
+        if c is None:
+            raise NoOpenChannel('Channel does not exist or has been closed'
+                                '(sender=%s, open_block_number=%s)' % (sender, open_block_number))
+        if not c.confirmed:
             raise InsufficientConfirmations(
                 'Insufficient confirmations for the channel '
                 '(sender=%s, open_block_number=%d)' % (sender, open_block_number))
-        try:
-            c = self.channels[sender, open_block_number]
-        except KeyError:
-            raise NoOpenChannel('Channel does not exist or has been closed'
-                                '(sender=%s, open_block_number=%s)' % (sender, open_block_number))
         if c.is_closed:
             raise NoOpenChannel('Channel closing has been requested already.')
+        return c
 
+    def verify_signature(self, sender: str, open_block_number: int, balance: int, signature: str):
+        """Verify that a balance proof has been signed by the sender.
+
+        The signer is recovered by the worker pool if `verify_workers` is set.
+
+        Raises:
+            InvalidBalanceProof: the recovered signer isn't the sender
+        """
+        recover = verify_balance_proof
+        if self.verifier is not None:
+            recover = self.verifier.recover_balance_proof
         if not is_same_address(
-                verify_balance_proof(
+                recover(
                     self.receiver,
                     open_block_number,
                     balance,
@@ -380,6 +580,16 @@ class ChannelManager(gevent.Greenlet):
                 sender
         ):
             raise InvalidBalanceProof('Recovered signer does not match the sender')
+
+    def verify_balance_proof(self, sender, open_block_number, balance, signature):
+        """Verify that a balance proof is valid and return the sender.
+
+        This method just verifies if the balance proof is valid - no state update is performed.
+
+        :returns: Channel, if it exists
+        """
+        c = self.get_open_channel(sender, open_block_number)
+        self.verify_signature(sender, open_block_number, balance, signature)
         return c
 
     def register_payment(self, sender: str, open_block_number: int, balance: int, signature: str):
@@ -387,14 +597,25 @@ class ChannelManager(gevent.Greenlet):
         Method will try to reconstruct (verify) balance update data
         with a signature sent by the client.
         If verification is succesfull, an internal payment state is updated.
+        The channel state, balance and deposit are checked before the signature, so that
+        stale, replayed or over-deposit balance proofs are rejected without recovering the
+        signer.
         Parameters:
             sender (str):               sender of the balance proof
             open_block_number (int):    block the channel was opened in
             balance (int):              updated balance
             signature(str):             balance proof to verify
         """
-        assert is_checksum_address(sender)
-        c = self.verify_balance_proof(sender, open_block_number, balance, signature)
+        c = self.get_open_channel(sender, open_block_number)
+        if balance <= c.balance:
+            raise InvalidBalanceAmount('The balance must not decrease.')
+        if balance > c.deposit:
+            raise InvalidBalanceProof('Balance must not be greater than deposit')
+        self.verify_signature(sender, open_block_number, balance, signature)
+        # verification yields to the worker pool, so other payments of the channel may have
+        # been registered (or the channel closed) in the meantime
+        if c.is_closed:
+            raise NoOpenChannel('Channel closing has been requested already.')
         if balance <= c.balance:
             raise InvalidBalanceAmount('The balance must not decrease.')
         if balance > c.deposit:
@@ -403,7 +624,7 @@ class ChannelManager(gevent.Greenlet):
         c.balance = balance
         c.last_signature = signature
         c.mtime = time.time()
-        self.state.set_channel(c)
+        self.state.set_channel_balance(c)
         self.log.debug('registered payment (sender %s, block number %s, new balance %s)',
                        c.sender, open_block_number, balance)
         return c.sender, received
@@ -412,10 +633,29 @@ class ChannelManager(gevent.Greenlet):
         """Forget all unconfirmed channels and topups to allow for a clean resync."""
         self.state.del_unconfirmed_channels()
         for channel in self.channels.values():
-            channel.unconfirmed_topups.clear()
+            channel.unconfirmed_topups = {}
             self.state.set_channel(channel)
-        self.state.unconfirmed_head_number = self.state.confirmed_head_number
-        self.state.unconfirmed_head_hash = self.state.confirmed_head_hash
+        self.state.update_sync_state(
+            unconfirmed_head_number=self.state.confirmed_head_number,
+            unconfirmed_head_hash=self.state.confirmed_head_hash
+        )
+
+    def get_channel(self, sender: str, open_block_number: int, confirmed=True):
+        """Look up a single channel by its primary key.
+
+        Args:
+            sender (str): sender address
+            open_block_number (int): block the channel was created in
+            confirmed (bool, optional): if True (default), return only a confirmed channel,
+                if False only an unconfirmed one. If None, return the channel regardless of
+                its confirmation status.
+        Returns:
+            Channel: the channel or None if no matching channel exists
+        """
+        c = self.state.get_channel(sender, open_block_number)
+        if c is None or confirmed is None or bool(c.confirmed) == confirmed:
+            return c
+        return None
 
     @property
     def channels(self):
@@ -432,9 +672,8 @@ class ChannelManager(gevent.Greenlet):
     def channels_to_dict(self):
         """Export all channels as a dictionary."""
         d = {}
-        for sender, block_number in self.channels:
-            channel = self.channels[sender, block_number]
-            channel_dict = {
+        for (sender, block_number), channel in self.channels.items():
+            d.setdefault(sender, {})[block_number] = {
                 'deposit': channel.deposit,
                 'balance': channel.balance,
                 'mtime': channel.mtime,
@@ -443,29 +682,41 @@ class ChannelManager(gevent.Greenlet):
                 'last_signature': channel.last_signature,
                 'is_closed': channel.is_closed
             }
-            if sender not in d:
-                d[sender] = {}
-            d[sender][block_number] = channel_dict
         return d
 
     def unconfirmed_channels_to_dict(self):
         """Export all unconfirmed channels as a dictionary."""
         d = {}
-        for sender, block_number in self.unconfirmed_channels:
-            channel = self.unconfirmed_channels[sender, block_number]
-            channel_dict = {
+        for (sender, block_number), channel in self.unconfirmed_channels.items():
+            d.setdefault(sender, {})[block_number] = {
                 'deposit': channel.deposit,
                 'ctime': channel.ctime
             }
-            if sender not in d:
-                d[sender] = {}
-            d[sender][block_number] = channel_dict
         return d
 
+    def export_channels(self, confirmed=True, batch_size: int = 1000):
+        """Export channels as newline delimited JSON.
+
+        Channels are streamed from the state storage in batches of `batch_size`, so the export
+        runs in constant memory.
+
+        Args:
+            confirmed (bool, optional): export confirmed (default) or unconfirmed channels
+            batch_size (int, optional): number of channels read from the storage at once
+        Yields:
+            str: one line per channel, a JSON object with the columns of the `channels` table
+        """
+        for row in self.state.iter_rows(confirmed, batch_size):
+            yield json.dumps(row) + '\n'
+
     def wait_sync(self):
         self.blockchain.wait_sync()
 
     def node_online(self):
+        """Returns:
+            bool: True if the last poll of the ethereum node succeeded. This doesn't make an RPC
+                call.
+        """
         return self.blockchain.is_connected.is_set()
 
     def get_token_address(self):
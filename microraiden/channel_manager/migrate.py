@@ -0,0 +1,193 @@
+"""Migrate a state file to the current sqlite schema.
+
+Run as `python -m microraiden.channel_manager.migrate --state-file <path>`. The original file
+is kept as `<path>.v1`.
+"""
+import os
+import sqlite3
+import logging
+
+import click
+
+from .storage import (
+    DB_CREATION_SQL,
+    SCHEMA_VERSION,
+    dict_factory,
+    encode_uint,
+    encode_signature
+)
+
+log = logging.getLogger(__name__)
+
+# schema of state files created before schema versioning, i.e. version 1
+DB_CREATION_SQL_V1 = """
+CREATE TABLE `metadata` (
+    `network_id`       INTEGER,
+    `contract_address` CHAR(42),
+    `receiver`         CHAR(42)
+);
+CREATE TABLE `syncstate` (
+    `confirmed_head_number`   INTEGER,
+    `confirmed_head_hash`     CHAR(66),
+    `unconfirmed_head_number` INTEGER,
+    `unconfirmed_head_hash`   CHAR(66)
+);
+-- deposit and balance have length of 78 to fit uint256
+CREATE TABLE `channels` (
+    `sender`            CHAR(42)        NOT NULL,
+    `open_block_number` INTEGER         NOT NULL,
+    `deposit`           DECIMAL(78,0)   NOT NULL,
+    `balance`           DECIMAL(78,0)   NOT NULL,
+    `last_signature`    CHAR(132),
+    `settle_timeout`    INTEGER         NOT NULL,
+    `mtime`             INTEGER         NOT NULL,
+    `ctime`             INTEGER         NOT NULL,
+    `state`             INTEGER         NOT NULL,
+    `confirmed`         BOOL            NOT NULL,
+    PRIMARY KEY (`sender`, `open_block_number`)
+);
+CREATE TABLE `topups` (
+    `channel_rowid`     INTEGER,
+    `txhash`            CHAR(66)        NOT NULL,
+    `deposit`           DECIMAL(78,0)   NOT NULL,
+    PRIMARY KEY (`channel_rowid`, `txhash`),
+    FOREIGN KEY (`channel_rowid`) REFERENCES channels (rowid)
+        ON DELETE CASCADE
+);
+"""
+
+
+def decode_v1_uint(value) -> int:
+    """Decode a DECIMAL(78,0) value. sqlite returns it as int, or as str if it doesn't fit."""
+    return int(value)
+
+
+def copy_rows(src: sqlite3.Connection, dst: sqlite3.Connection, sql: str, insert_sql: str,
+              convert, batch_size: int):
+    """Copy the result of a query in batches of `batch_size` rows.
+
+    Returns:
+        int: number of copied rows
+    """
+    n_rows = 0
+    cursor = src.execute(sql)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return n_rows
+        dst.executemany(insert_sql, [convert(row) for row in rows])
+        n_rows += len(rows)
+
+
+def migrate_v1(src: sqlite3.Connection, dst: sqlite3.Connection, batch_size: int):
+    """Copy a v1 database into an empty database with the current schema.
+
+    Channels keep their rowid, so topups can be copied without a lookup table.
+
+    Returns:
+        int: number of migrated channels
+    """
+    dst.execute('DELETE FROM `metadata`')
+    dst.execute('DELETE FROM `syncstate`')
+    copy_rows(src, dst, 'SELECT * FROM `metadata`', 'INSERT INTO `metadata` VALUES (?, ?, ?)',
+              lambda row: (row['network_id'], row['contract_address'], row['receiver']),
+              batch_size)
+    copy_rows(
+        src, dst,
+        'SELECT * FROM `syncstate`',
+        'INSERT INTO `syncstate` VALUES (?, ?, ?, ?)',
+        lambda row: (row['confirmed_head_number'], row['confirmed_head_hash'],
+                     row['unconfirmed_head_number'], row['unconfirmed_head_hash']),
+        batch_size
+    )
+    n_channels = copy_rows(
+        src, dst,
+        'SELECT rowid, * FROM `channels`',
+        'INSERT INTO `channels` (`rowid`, `sender`, `open_block_number`, `deposit`, `balance`, '
+        '`last_signature`, `settle_timeout`, `mtime`, `ctime`, `state`, `confirmed`) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        lambda row: (
+            row['rowid'],
+            bytes.fromhex(row['sender'][2:]),
+            row['open_block_number'],
+            encode_uint(decode_v1_uint(row['deposit'])),
+            encode_uint(decode_v1_uint(row['balance'])),
+            encode_signature(row['last_signature']),
+            row['settle_timeout'],
+            row['mtime'],
+            row['ctime'],
+            row['state'],
+            bool(row['confirmed'])
+        ),
+        batch_size
+    )
+    copy_rows(
+        src, dst,
+        'SELECT * FROM `topups`',
+        'INSERT INTO `topups` VALUES (?, ?, ?)',
+        lambda row: (
+            row['channel_rowid'],
+            row['txhash'],
+            encode_uint(decode_v1_uint(row['deposit']))
+        ),
+        batch_size
+    )
+    return n_channels
+
+
+def migrate_state(filename: str, batch_size: int = 10000) -> int:
+    """Migrate a state file to the current schema version in place.
+
+    Rows are streamed in batches of `batch_size`, so memory use doesn't depend on the size of
+    the state file. The migrated database is written to a temporary file that replaces the
+    original once it is complete; the original is kept as `<filename>.v1`.
+
+    Returns:
+        int: number of migrated channels
+    """
+    src = sqlite3.connect(filename)
+    src.row_factory = dict_factory
+    version = src.execute('PRAGMA user_version;').fetchone()['user_version'] or 1
+    if version == SCHEMA_VERSION:
+        log.info('%s is up to date (version %d)', filename, version)
+        src.close()
+        return 0
+    assert version == 1, 'unknown schema version %d' % version
+
+    tmp_filename = filename + '.migrating'
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+    dst = sqlite3.connect(tmp_filename, isolation_level="EXCLUSIVE")
+    os.chmod(tmp_filename, 0o600)
+    dst.executescript(DB_CREATION_SQL)
+    n_channels = migrate_v1(src, dst, batch_size)
+    dst.commit()
+    dst.close()
+    src.close()
+
+    os.replace(filename, filename + '.v1')
+    os.replace(tmp_filename, filename)
+    log.info('migrated %d channels of %s from version %d to %d',
+             n_channels, filename, version, SCHEMA_VERSION)
+    return n_channels
+
+
+@click.command()
+@click.option(
+    '--state-file',
+    required=True,
+    help='State file of the proxy',
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True)
+)
+@click.option(
+    '--batch-size',
+    default=10000,
+    help='Number of rows copied at once'
+)
+def main(state_file: str, batch_size: int):
+    logging.basicConfig(level=logging.INFO)
+    migrate_state(state_file, batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,177 +1,202 @@
-"""Off-chain state is saved in a sqlite database."""
+"""Off-chain state is kept in memory and saved by a storage backend, by default sqlite."""
 # import json
 # import shutil
-import sqlite3
 import os
 import logging
+import time
+from collections import Counter
 from eth_utils import is_address
 
 from microraiden.utils import check_permission_safety
 
 from microraiden.exceptions import (
-    InsecureStateFile
+    InsecureStateFile,
+    StateFileVersionMismatch
 )
 from .channel import Channel, ChannelState
+from .storage import STORAGE_BACKENDS
 
 log = logging.getLogger(__name__)
 
 
-def dict_factory(cursor, row):
-    """make sqlite result a dict with keys being column names"""
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
-
-
-DB_CREATION_SQL = """
-CREATE TABLE `metadata` (
-    `network_id`       INTEGER,
-    `contract_address` CHAR(42),
-    `receiver`         CHAR(42)
-);
-CREATE TABLE `syncstate` (
-    `confirmed_head_number`   INTEGER,
-    `confirmed_head_hash`     CHAR(66),
-    `unconfirmed_head_number` INTEGER,
-    `unconfirmed_head_hash`   CHAR(66)
-);
--- deposit and balance have length of 78 to fit uint256
-CREATE TABLE `channels` (
-    `sender`            CHAR(42)        NOT NULL,
-    `open_block_number` INTEGER         NOT NULL,
-    `deposit`           DECIMAL(78,0)   NOT NULL,
-    `balance`           DECIMAL(78,0)   NOT NULL,
-    `last_signature`    CHAR(132),
-    `settle_timeout`    INTEGER         NOT NULL,
-    `mtime`             INTEGER         NOT NULL,
-    `ctime`             INTEGER         NOT NULL,
-    `state`             INTEGER         NOT NULL,
-    `confirmed`         BOOL            NOT NULL,
-    PRIMARY KEY (`sender`, `open_block_number`)
-);
-CREATE TABLE `topups` (
-    `channel_rowid`     INTEGER,
-    `txhash`            CHAR(66)        NOT NULL,
-    `deposit`           DECIMAL(78,0)   NOT NULL,
-    PRIMARY KEY (`channel_rowid`, `txhash`),
-    FOREIGN KEY (`channel_rowid`) REFERENCES channels (rowid)
-        ON DELETE CASCADE
-);
-INSERT INTO `metadata` VALUES (
-    NULL,
-    NULL,
-    NULL
-);
-INSERT INTO `syncstate` VALUES (
-    NULL,
-    NULL,
-    NULL,
-    NULL
-);
-"""
-
-UPDATE_METADATA_SQL = """
-UPDATE `metadata` SET
-    `network_id` = ?,
-    `contract_address` = ?,
-    `receiver` = ?;
-"""
-
-UPDATE_SYNCSTATE_SQL = {
-    'confirmed_head_number': 'UPDATE `syncstate` SET `confirmed_head_number` = ?;',
-    'confirmed_head_hash': 'UPDATE `syncstate` SET `confirmed_head_hash` = ?;',
-    'unconfirmed_head_number': 'UPDATE `syncstate` SET `unconfirmed_head_number` = ?;',
-    'unconfirmed_head_hash': 'UPDATE `syncstate` SET `unconfirmed_head_hash` = ?;'
-}
-
-ADD_CHANNEL_SQL = """
-INSERT OR REPLACE INTO `channels` VALUES (
-    ?,
-    ?,
-    ?,
-    ?,
-    ?,
-    ?,
-    ?,
-    ?,
-    ?,
-    ?
-)
-"""
+class ChannelStats(object):
+    """Running totals over the confirmed channels of the state.
 
-UPDATE_CHANNEL_SQL = """
-UPDATE `channels` SET
-    `deposit` = ?,
-    `balance` = ?,
-    `last_signature` = ?,
-    `settle_timeout` = ?,
-    `mtime` = ?,
-    `state` = ?
-WHERE `sender` = ? AND `open_block_number` = ?;
-"""
+    The totals are updated whenever a channel is stored, so reading them doesn't iterate the
+    channels. Channels are mutated in place before they are stored, so the contribution of each
+    channel is remembered to be able to subtract it again.
+    """
 
-DEL_CHANNEL_SQL = """
-DELETE FROM `channels` WHERE `sender` = ? AND `open_block_number` = ?"""
+    def __init__(self):
+        self.deposit_sum = 0
+        self.balance_sum = 0
+        self.open_channels = 0
+        self.pending_channels = 0
+        # sender => number of channels
+        self.senders = Counter()
+        # (sender, open_block_number) => (deposit, balance, is_closed)
+        self._contributions = dict()
 
+    @property
+    def unique_senders(self):
+        return len(self.senders)
+
+    def _add(self, key, deposit, balance, is_closed, sign=1):
+        self.deposit_sum += sign * deposit
+        self.balance_sum += sign * balance
+        if is_closed:
+            self.pending_channels += sign
+        else:
+            self.open_channels += sign
+        self.senders[key[0]] += sign
+        if self.senders[key[0]] == 0:
+            del self.senders[key[0]]
+
+    def update(self, key, channel: Channel):
+        """Replace the contribution of the channel `key` by the current values of `channel`."""
+        self.remove(key)
+        if not channel.confirmed:
+            return
+        contribution = channel.deposit, channel.balance, channel.is_closed
+        self._contributions[key] = contribution
+        self._add(key, *contribution)
+
+    def remove(self, key):
+        """Remove the contribution of the channel `key`, if any."""
+        contribution = self._contributions.pop(key, None)
+        if contribution is not None:
+            self._add(key, *contribution, sign=-1)
 
-class ChannelManagerState(object):
-    """The part of the channel manager state that needs to persist."""
 
-    def __init__(self, filename):
+class ChannelManagerState(object):
+    """The part of the channel manager state that needs to persist.
+
+    All channels are kept in an in-memory index keyed by (sender, open_block_number). The index
+    is loaded once when the state is loaded and every change is written through to the storage
+    backend, which is only used for durability. Metadata and sync state are cached as well.
+
+    By default, every payment is committed before it is acknowledged. If `payment_flush_interval`
+    or `payment_flush_size` is set, payments are queued in memory instead and committed in a
+    single transaction once the queue holds `payment_flush_size` payments or when
+    `flush_payments()` is called, which the channel manager does every
+    `payment_flush_interval` seconds.
+
+    Args:
+        filename (str): path to the state file
+        payment_flush_interval (float, optional): max. number of seconds a payment is
+            kept in memory before it is committed
+        payment_flush_size (int, optional): max. number of payments kept in memory
+        backend (str, optional): name of the storage backend, one of STORAGE_BACKENDS.
+            Default is 'sqlite'.
+        **storage_kwargs: passed to the storage backend, e.g. `wal`, `synchronous`,
+            `threaded` and `balance_log` of SQLiteStorage
+    """
+
+    def __init__(
+            self,
+            filename,
+            payment_flush_interval: float = None,
+            payment_flush_size: int = None,
+            backend: str = 'sqlite',
+            **storage_kwargs
+    ):
+        assert payment_flush_interval is None or payment_flush_interval > 0
+        assert payment_flush_size is None or payment_flush_size > 0
+        assert backend in STORAGE_BACKENDS
         self.filename = filename
-        self.conn = sqlite3.connect(self.filename, isolation_level="EXCLUSIVE")
-        self.conn.row_factory = dict_factory
-        if filename not in (None, ':memory:'):
-            os.chmod(filename, 0o600)
+        self.payment_flush_interval = payment_flush_interval
+        self.payment_flush_size = payment_flush_size
+        self.storage = STORAGE_BACKENDS[backend](filename, **storage_kwargs)
+        # cached `metadata` and `syncstate`
+        self._metadata = None
+        self._sync_state = None
+        # (sender, open_block_number) => Channel
+        self._channels = dict()
+        self.stats = ChannelStats()
+        # (sender, open_block_number) => [Channel, number of payments] of a channel with
+        # payments that haven't been committed yet
+        self._pending_payments = dict()
+        self.n_pending_payments = 0
+        self.last_payment_flush = time.time()
+        self.closed = False
 
     def setup_db(self, network_id: int, contract_address: str, receiver: str):
         """Initialize an empty database."""
         assert is_address(receiver)
-        self.conn.executescript(DB_CREATION_SQL)
-        self.conn.execute(UPDATE_METADATA_SQL, [network_id, contract_address, receiver])
-        self.conn.commit()
+        self.storage.setup(network_id, contract_address, receiver)
+        self.reload()
+
+    def reload(self):
+        """Reload metadata and sync state from the storage.
+
+        Both are cached in memory and only read from the storage on the first access and when
+        this method is called.
+        """
+        self._metadata = self.storage.get_metadata()
+        self._sync_state = self.storage.get_sync_state()
+
+    def read_channels(self, confirmed=True, **kwargs):
+        """Read confirmed or unconfirmed channels from the storage.
+
+        Unlike `get_channels()`, this returns the committed state of the channels and
+        doesn't include payments that haven't been flushed yet. Additional keyword arguments
+        filter and paginate the channels, see `ChannelStorage.read_channels()`.
+
+        Returns:
+            list: stored channels as dicts with the columns of the `channels` table
+        """
+        return self.storage.read_channels(confirmed, **kwargs)
+
+    def iter_rows(self, confirmed=True, batch_size: int = 1000):
+        """Iterate over stored channels like `read_channels()`, reading `batch_size` channels
+        at once. Queued payments are committed before, payments in the balance log of the
+        sqlite backend are included.
+        """
+        self.flush_payments()
+        return self.storage.iter_rows(confirmed, batch_size)
+
+    def compact(self):
+        """Commit queued payments and compact the storage, see `ChannelStorage.compact()`."""
+        self.flush_payments()
+        self.storage.compact()
+
+    def close(self):
+        """Commit queued payments and close the storage. Does nothing if already closed."""
+        if self.closed:
+            return
+        self.flush_payments()
+        self.storage.close()
+        self.closed = True
+
+    def _get_metadata(self):
+        if self._metadata is None:
+            self.reload()
+        return self._metadata
+
+    def _get_sync_state(self):
+        if self._sync_state is None:
+            self.reload()
+        return self._sync_state
 
     @property
     def contract_address(self):
         """The address of the channel manager contract."""
-        c = self.conn.cursor()
-        c.execute('SELECT `contract_address` FROM `metadata`;')
-        contract_address = c.fetchone()['contract_address']
-        assert c.fetchone() is None
-        return contract_address
+        return self._get_metadata()['contract_address']
 
     @property
     def receiver(self):
         """The receiver address."""
-        c = self.conn.cursor()
-        c.execute('SELECT `receiver` FROM `metadata`;')
-        receiver = c.fetchone()['receiver']
-        assert c.fetchone() is None
-        return receiver
+        return self._get_metadata()['receiver']
 
     @property
     def network_id(self):
         """Network the state uses."""
-        c = self.conn.cursor()
-        c.execute('SELECT `network_id` FROM `metadata`;')
-        network_id = c.fetchone()['network_id']
-        assert c.fetchone() is None
-        return network_id
-
-    @property
-    def _sync_state(self):
-        c = self.conn.cursor()
-        c.execute('SELECT * FROM `syncstate`;')
-        state = c.fetchone()
-        assert c.fetchone() is None
-        assert len(state) == 4
-        return state
+        return self._get_metadata()['network_id']
 
     @property
     def confirmed_head_number(self):
         """The number of the highest processed block considered to be final."""
-        return self._sync_state['confirmed_head_number']
+        return self._get_sync_state()['confirmed_head_number']
 
     @confirmed_head_number.setter
     def confirmed_head_number(self, value):
@@ -180,7 +205,7 @@ class ChannelManagerState(object):
     @property
     def confirmed_head_hash(self):
         """The hash of the highest processed block considered to be final."""
-        return self._sync_state['confirmed_head_hash']
+        return self._get_sync_state()['confirmed_head_hash']
 
     @confirmed_head_hash.setter
     def confirmed_head_hash(self, value):
@@ -189,7 +214,7 @@ class ChannelManagerState(object):
     @property
     def unconfirmed_head_number(self):
         """The number of the highest processed block considered to be not yet final."""
-        return self._sync_state['unconfirmed_head_number']
+        return self._get_sync_state()['unconfirmed_head_number']
 
     @unconfirmed_head_number.setter
     def unconfirmed_head_number(self, value: int):
@@ -198,7 +223,7 @@ class ChannelManagerState(object):
     @property
     def unconfirmed_head_hash(self):
         """The hash of the highest processed block considered to be not yet final."""
-        return self._sync_state['unconfirmed_head_hash']
+        return self._get_sync_state()['unconfirmed_head_hash']
 
     @unconfirmed_head_hash.setter
     def unconfirmed_head_hash(self, value: int):
@@ -211,29 +236,28 @@ class ChannelManagerState(object):
         unconfirmed_head_number=None,
         unconfirmed_head_hash=None
     ):
-        """Update block numbers and hashes of confirmed and unconfirmed head."""
-        if confirmed_head_number is not None:
-            sql = UPDATE_SYNCSTATE_SQL['confirmed_head_number']
-            self.conn.execute(sql, [confirmed_head_number])
-        if confirmed_head_hash is not None:
-            sql = UPDATE_SYNCSTATE_SQL['confirmed_head_hash']
-            self.conn.execute(sql, [confirmed_head_hash])
-        if unconfirmed_head_number is not None:
-            sql = UPDATE_SYNCSTATE_SQL['unconfirmed_head_number']
-            self.conn.execute(sql, [unconfirmed_head_number])
-        if unconfirmed_head_hash is not None:
-            sql = UPDATE_SYNCSTATE_SQL['unconfirmed_head_hash']
-            self.conn.execute(sql, [unconfirmed_head_hash])
-        self.conn.commit()
+        """Update block numbers and hashes of confirmed and unconfirmed head.
+
+        All given values are written in a single statement.
+        """
+        values = [
+            ('confirmed_head_number', confirmed_head_number),
+            ('confirmed_head_hash', confirmed_head_hash),
+            ('unconfirmed_head_number', unconfirmed_head_number),
+            ('unconfirmed_head_hash', unconfirmed_head_hash)
+        ]
+        values = [(column, value) for column, value in values if value is not None]
+        if not values:
+            return
+        self._get_sync_state().update(values)
+        self.storage.set_sync_state(values)
 
     @property
     def n_channels(self):
         """Returns:
             int: count of all channels, regardless of their state
         """
-        c = self.conn.cursor()
-        c.execute('SELECT COUNT(*) as count FROM `channels`')
-        return c.fetchone()['count']
+        return len(self._channels)
 
     @property
     def n_open_channels(self):
@@ -241,10 +265,7 @@ class ChannelManagerState(object):
         Returns:
             int: count of open channels
         """
-        c = self.conn.cursor()
-        c.execute('SELECT COUNT(*) as count FROM `channels` WHERE `state` = ?',
-                  [ChannelState.OPEN.value])
-        return c.fetchone()['count']
+        return sum(1 for c in self._channels.values() if c.state == ChannelState.OPEN)
 
     def get_channels(self, confirmed=True):
         """
@@ -253,13 +274,10 @@ class ChannelManagerState(object):
         Returns:
             dict: map of channels, (sender, open_block_number) => Channel
         """
-        ret = dict()
-        c = self.conn.cursor()
-        c.execute('SELECT rowid, * FROM `channels` WHERE `confirmed` = ?', [confirmed])
-        for result in c.fetchall():
-            channel = self.result_to_channel(result)
-            ret[result['sender'], result['open_block_number']] = channel
-        return ret
+        return {
+            key: channel for key, channel in self._channels.items()
+            if bool(channel.confirmed) == bool(confirmed)
+        }
 
     @property
     def channels(self):
@@ -272,19 +290,20 @@ class ChannelManagerState(object):
     @property
     def pending_channels(self):
         """Get list of channels in a CLOSE_PENDING state"""
-        ret = dict()
-        c = self.conn.cursor()
-        c.execute('SELECT rowid, * FROM `channels` WHERE `state` = ?',
-                  [ChannelState.CLOSE_PENDING.value])
-        for result in c.fetchall():
-            channel = self.result_to_channel(result)
-            ret[result['sender'], result['open_block_number']] = channel
-        return ret
+        return {
+            key: channel for key, channel in self._channels.items()
+            if channel.state == ChannelState.CLOSE_PENDING
+        }
+
+    def result_to_channel(self, result: dict, receiver: str, topups: dict):
+        """Helper function to serialize one stored channel into a channel object
 
-    def result_to_channel(self, result: dict):
-        """Helper function to serialize one row of `channels` table into a channel object
+        Args:
+            result (dict): row of the `channels` table
+            receiver (str): receiver address
+            topups (dict): unconfirmed topups of the channel
         """
-        channel = Channel(self.receiver, result['sender'],
+        channel = Channel(receiver, result['sender'],
                           int(result['deposit']),
                           result['open_block_number'])
         channel.balance = int(result['balance'])
@@ -293,90 +312,136 @@ class ChannelManagerState(object):
         channel.settle_timeout = result['settle_timeout']
         channel.mtime = result['mtime']
         channel.ctime = result['ctime']
-        channel.unconfirmed_topups = self.get_unconfirmed_topups(result['rowid'])
+        channel.unconfirmed_topups = topups
         channel.confirmed = result['confirmed']
         return channel
 
-    def get_channel_rowid(self, sender: str, open_block_number: int):
-        sender = sender
-        c = self.conn.cursor()
-        result = c.execute(
-            'SELECT rowid from `channels` WHERE sender = ? AND open_block_number = ?',
-            [sender, open_block_number]
-        )
-        return result.fetchone()['rowid']
-
-    def get_unconfirmed_topups(self, channel_rowid: int):
-        c = self.conn.cursor()
-        c.execute('SELECT * FROM topups WHERE channel_rowid = ?', [channel_rowid])
-        return {result['txhash']: result['deposit'] for result in c.fetchall()}
-
     def set_channel(self, channel: Channel):
         """Update channel state"""
         self.add_channel(channel)
 
     def channel_exists(self, sender: str, open_block_number: int):
         """Return true if channel(sender, open_block_number) exists"""
-        c = self.conn.cursor()
-        sql = 'SELECT 1 FROM `channels` WHERE `sender` = ? AND `open_block_number` == ?'
-        c.execute(sql, [sender, open_block_number])
-        result = c.fetchone()
-        if result is None:
-            return False
-        elif result['1']:
-            return True
-        assert False
-
-    def set_unconfirmed_topups(self, channel_rowid: int, topups: dict):
-        assert channel_rowid is not None and isinstance(channel_rowid, int)
-        self.conn.execute('DELETE FROM topups WHERE channel_rowid = ?', [channel_rowid])
-        for txhash, deposit in topups.items():
-            self.conn.execute('INSERT OR REPLACE INTO topups VALUES (?, ?, ?)',
-                              [channel_rowid, txhash, str(deposit)])
+        return (sender, open_block_number) in self._channels
 
     def add_channel(self, channel: Channel):
-        """Add or update channel state"""
+        """Add or update channel state.
+
+        The in-memory index is updated before the channel is written to the storage, so that
+        concurrent greenlets see changes in the order they are written.
+        """
         assert channel.open_block_number > 0
         assert channel.state is not ChannelState.UNDEFINED
         assert is_address(channel.sender)
-        params = [
-            channel.sender,
-            channel.open_block_number,
-            str(channel.deposit),
-            str(channel.balance),
-            channel.last_signature,
-            channel.settle_timeout,
-            channel.mtime,
-            channel.ctime,
-            channel.state.value,
-            channel.confirmed
+        key = channel.sender, channel.open_block_number
+        self._channels[key] = channel
+        self.stats.update(key, channel)
+        self._drop_pending_payments(key)
+        self.storage.put_channel(channel)
+
+    @property
+    def batch_payments(self):
+        """Returns:
+            bool: True if payments are committed in batches
+        """
+        return self.payment_flush_interval is not None or self.payment_flush_size is not None
+
+    def set_channel_balance(self, channel: Channel):
+        """Store a payment, i.e. a new balance, balance signature and mtime of the channel.
+
+        In synchronous mode the payment is committed immediately, otherwise it is queued.
+        """
+        key = channel.sender, channel.open_block_number
+        assert self._channels.get(key) is channel
+        self.stats.update(key, channel)
+        if not self.batch_payments:
+            self.storage.put_payments([channel])
+            return
+        pending = self._pending_payments.setdefault(key, [channel, 0])
+        pending[1] += 1
+        self.n_pending_payments += 1
+        if (self.payment_flush_size is not None and
+                self.n_pending_payments >= self.payment_flush_size):
+            self.flush_payments()
+
+    def _drop_pending_payments(self, key):
+        """Remove queued payments of a channel, e.g. because the whole channel is written."""
+        pending = self._pending_payments.pop(key, None)
+        if pending is not None:
+            self.n_pending_payments -= pending[1]
+
+    def flush_payments(self):
+        """Commit all queued payments in a single transaction.
+
+        Only the latest payment of each channel is written. Payments are removed from the
+        queue once they have been committed, so they are kept if the storage fails. Payments
+        queued while the transaction is being committed stay in the queue.
+        """
+        self.last_payment_flush = time.time()
+        if not self._pending_payments:
+            return
+        # the number of payments of each channel at the time they are written
+        pending = [
+            (key, entry, entry[1]) for key, entry in self._pending_payments.items()
         ]
-        self.conn.execute(ADD_CHANNEL_SQL, params)
-        rowid = self.get_channel_rowid(channel.sender, channel.open_block_number)
-        self.set_unconfirmed_topups(rowid, channel.unconfirmed_topups)
-        self.conn.commit()
+        self.storage.put_payments([entry[0] for _, entry, _ in pending])
+        n_committed = 0
+        for key, entry, n_payments in pending:
+            if self._pending_payments.get(key) is not entry:
+                # dropped while the transaction was being committed
+                continue
+            n_payments = min(n_payments, entry[1])
+            entry[1] -= n_payments
+            if entry[1] == 0:
+                del self._pending_payments[key]
+            self.n_pending_payments -= n_payments
+            n_committed += n_payments
+        log.debug('committed %d queued payments (%d channels)', n_committed, len(pending))
+
+    def get_durable_balance(self, sender: str, open_block_number: int):
+        """
+        Returns:
+            int: the last balance of the channel that has been committed to the storage or
+                None if the channel doesn't exist
+        """
+        return self.storage.get_balance(sender, open_block_number)
 
     def get_channel(self, sender: str, open_block_number: int):
-        assert is_address(sender)
-        assert open_block_number > 0
-        # TODO unconfirmed topups
-        c = self.conn.cursor()
-        sql = 'SELECT rowid,* FROM `channels` WHERE `sender` = ? AND `open_block_number` = ?'
-        c.execute(sql, [sender, open_block_number])
-        result = c.fetchone()
-        assert c.fetchone() is None
-        return self.result_to_channel(result)
+        """
+        Returns:
+            Channel: the channel (sender, open_block_number) or None if it doesn't exist
+        """
+        return self._channels.get((sender, open_block_number))
 
     def del_channel(self, sender: str, open_block_number: int):
         assert is_address(sender)
         assert open_block_number > 0
         assert self.channel_exists(sender, open_block_number)
-        self.conn.execute(DEL_CHANNEL_SQL, [sender, open_block_number])
-        self.conn.commit()
+        key = sender, open_block_number
+        del self._channels[key]
+        self.stats.remove(key)
+        self._drop_pending_payments(key)
+        self.storage.delete_channel(sender, open_block_number)
+
+    def load_channels(self):
+        """(Re)build the in-memory channel index from the storage."""
+        self._channels = dict()
+        self.stats = ChannelStats()
+        self._pending_payments = dict()
+        self.n_pending_payments = 0
+        receiver = self.receiver
+        for result, topups in self.storage.iter_channels():
+            channel = self.result_to_channel(result, receiver, topups)
+            key = result['sender'], result['open_block_number']
+            self._channels[key] = channel
+            self.stats.update(key, channel)
 
     @classmethod
-    def load(cls, filename: str, check_permissions=True):
-        """Load a previously stored state."""
+    def load(cls, filename: str, check_permissions=True, **kwargs):
+        """Load a previously stored state.
+
+        Additional keyword arguments are passed to the constructor.
+        """
         assert filename and isinstance(filename, str)
         if filename != ':memory:':
             if os.path.isfile(filename) is False:
@@ -384,21 +449,29 @@ class ChannelManagerState(object):
                 return None
             if check_permissions and not check_permission_safety(filename):
                 raise InsecureStateFile(filename)
-        ret = cls(filename)
-        log.debug("loaded saved state. head_number=%s receiver=%s" %
-                  (ret.confirmed_head_number, ret.receiver))
-        # for sender, block in ret.channels.keys():
-        #     log.debug("loaded channel info from the saved state sender=%s open_block=%s" %
-        #               (sender, block))
+        ret = cls(filename, **kwargs)
+        version = ret.storage.schema_version
+        if version != ret.storage.current_schema_version:
+            ret.storage.close()
+            raise StateFileVersionMismatch(
+                'state file %s has schema version %s, expected %s. Migrate it with '
+                '`python -m microraiden.channel_manager.migrate --state-file %s`' %
+                (filename, version, ret.storage.current_schema_version, filename)
+            )
+        ret.load_channels()
+        log.debug("loaded saved state. head_number=%s receiver=%s channels=%d" %
+                  (ret.confirmed_head_number, ret.receiver, ret.n_channels))
         return ret
 
     def del_unconfirmed_channels(self):
-        self.conn.execute('DELETE FROM `channels` WHERE `confirmed` = 0')
-        self.conn.commit()
+        self._channels = {
+            key: channel for key, channel in self._channels.items()
+            if channel.confirmed
+        }
+        self.storage.delete_unconfirmed_channels()
 
     def set_channel_state(self, sender: str, open_block_number: int, state: ChannelState):
         assert is_address(sender)
-        sender = sender
-        self.conn.execute('UPDATE `channels` SET `state` = ?'
-                          'WHERE `sender` = ? AND `open_block_number` = ?',
-                          [state, sender, open_block_number])
+        channel = self._channels[sender, open_block_number]
+        channel.state = state
+        self.add_channel(channel)
@@ -0,0 +1,1115 @@
+"""Storage backends that persist the state of the channel manager.
+
+A backend stores metadata, sync state and channels. Channels are passed around as rows:
+a dict with the `sender` and `open_block_number` of the channel and the CHANNEL_COLUMNS
+values as returned by `channel_to_row()`, and a dict of the unconfirmed topups.
+"""
+import abc
+import sqlite3
+import os
+import json
+import logging
+import functools
+import mmap
+import struct
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from eth_utils import decode_hex, encode_hex, to_checksum_address
+from gevent.event import AsyncResult
+from gevent.lock import RLock
+from gevent.threadpool import ThreadPool
+
+from microraiden.exceptions import BalanceLogFull
+from .channel import Channel
+
+log = logging.getLogger(__name__)
+
+
+def dict_factory(cursor, row):
+    """make sqlite result a dict with keys being column names"""
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+# version of the sqlite schema, stored as `PRAGMA user_version`
+SCHEMA_VERSION = 2
+
+# Addresses and signatures are stored as binary, amounts as 32 byte big-endian unsigned
+# integers, which sort like the numbers they represent.
+DB_CREATION_SQL = """
+PRAGMA user_version = 2;
+CREATE TABLE `metadata` (
+    `network_id`       INTEGER,
+    `contract_address` CHAR(42),
+    `receiver`         CHAR(42)
+);
+CREATE TABLE `syncstate` (
+    `confirmed_head_number`   INTEGER,
+    `confirmed_head_hash`     CHAR(66),
+    `unconfirmed_head_number` INTEGER,
+    `unconfirmed_head_hash`   CHAR(66)
+);
+CREATE TABLE `channels` (
+    `sender`            BLOB(20)        NOT NULL,
+    `open_block_number` INTEGER         NOT NULL,
+    `deposit`           BLOB(32)        NOT NULL,
+    `balance`           BLOB(32)        NOT NULL,
+    `last_signature`    BLOB(65),
+    `settle_timeout`    INTEGER         NOT NULL,
+    `mtime`             REAL            NOT NULL,
+    `ctime`             REAL            NOT NULL,
+    `state`             INTEGER         NOT NULL,
+    `confirmed`         BOOL            NOT NULL,
+    PRIMARY KEY (`sender`, `open_block_number`)
+);
+CREATE INDEX `channels_state` ON `channels` (`state`);
+CREATE INDEX `channels_confirmed` ON `channels` (`confirmed`);
+CREATE TABLE `topups` (
+    `channel_rowid`     INTEGER,
+    `txhash`            CHAR(66)        NOT NULL,
+    `deposit`           BLOB(32)        NOT NULL,
+    PRIMARY KEY (`channel_rowid`, `txhash`),
+    FOREIGN KEY (`channel_rowid`) REFERENCES channels (rowid)
+        ON DELETE CASCADE
+);
+INSERT INTO `metadata` VALUES (
+    NULL,
+    NULL,
+    NULL
+);
+INSERT INTO `syncstate` VALUES (
+    NULL,
+    NULL,
+    NULL,
+    NULL
+);
+"""
+
+UPDATE_METADATA_SQL = """
+UPDATE `metadata` SET
+    `network_id` = ?,
+    `contract_address` = ?,
+    `receiver` = ?;
+"""
+
+ADD_CHANNEL_SQL = """
+INSERT OR REPLACE INTO `channels` VALUES (
+    ?,
+    ?,
+    ?,
+    ?,
+    ?,
+    ?,
+    ?,
+    ?,
+    ?,
+    ?
+)
+"""
+
+# columns of the `metadata` and `syncstate` tables
+METADATA_COLUMNS = ('network_id', 'contract_address', 'receiver')
+SYNC_STATE_COLUMNS = (
+    'confirmed_head_number',
+    'confirmed_head_hash',
+    'unconfirmed_head_number',
+    'unconfirmed_head_hash'
+)
+
+# columns of the `channels` table that may change after a channel has been added
+CHANNEL_COLUMNS = (
+    'deposit',
+    'balance',
+    'last_signature',
+    'settle_timeout',
+    'mtime',
+    'ctime',
+    'state',
+    'confirmed'
+)
+
+# columns of the `channels` table changed by a payment
+PAYMENT_COLUMNS = ('balance', 'last_signature', 'mtime')
+
+
+@functools.lru_cache(maxsize=None)
+def update_channel_sql(columns: tuple):
+    """Return a statement that updates only `columns` of a single channel."""
+    assert columns and set(columns) <= set(CHANNEL_COLUMNS)
+    return 'UPDATE `channels` SET %s WHERE `sender` = ? AND `open_block_number` = ?;' % (
+        ', '.join('`%s` = ?' % column for column in columns)
+    )
+
+
+def channel_to_row(channel: Channel):
+    """Return values of CHANNEL_COLUMNS for a channel."""
+    return (
+        channel.deposit,
+        channel.balance,
+        channel.last_signature,
+        channel.settle_timeout,
+        channel.mtime,
+        channel.ctime,
+        int(channel.state),
+        bool(channel.confirmed)
+    )
+
+
+def payment_to_row(channel: Channel):
+    """Return values of PAYMENT_COLUMNS for a channel."""
+    return channel.balance, channel.last_signature, channel.mtime
+
+
+def encode_uint(value: int) -> bytes:
+    """Encode an uint256 as it is stored in the sqlite database."""
+    return int(value).to_bytes(32, 'big')
+
+
+def decode_uint(value: bytes) -> int:
+    return int.from_bytes(value, 'big')
+
+
+def encode_signature(signature: str) -> bytes:
+    if signature is None:
+        return None
+    return decode_hex(signature)
+
+
+def decode_signature(value: bytes) -> str:
+    if value is None:
+        return None
+    return encode_hex(value)
+
+
+def encode_key(key: tuple) -> tuple:
+    """Encode a (sender, open_block_number) channel key for the sqlite database."""
+    return decode_hex(key[0]), key[1]
+
+
+# column => function that encodes a value of channel_to_row() for the sqlite database
+COLUMN_ENCODERS = {
+    'deposit': encode_uint,
+    'balance': encode_uint,
+    'last_signature': encode_signature
+}
+
+
+def encode_values(columns: tuple, values: tuple) -> tuple:
+    """Encode values of CHANNEL_COLUMNS `columns` for the sqlite database."""
+    return tuple(
+        COLUMN_ENCODERS[column](value) if column in COLUMN_ENCODERS else value
+        for column, value in zip(columns, values)
+    )
+
+
+def decode_channel(result: dict) -> dict:
+    """Decode a row of the sqlite `channels` table. Addresses are checksum encoded."""
+    result = dict(result)
+    result['sender'] = to_checksum_address(encode_hex(result['sender']))
+    result['deposit'] = decode_uint(result['deposit'])
+    result['balance'] = decode_uint(result['balance'])
+    result['last_signature'] = decode_signature(result['last_signature'])
+    result['confirmed'] = bool(result['confirmed'])
+    return result
+
+
+def payment_to_row_update(row: tuple, payment: tuple):
+    """Return a copy of a channel row with PAYMENT_COLUMNS replaced by `payment`."""
+    row = list(row)
+    for column, value in zip(PAYMENT_COLUMNS, payment):
+        row[CHANNEL_COLUMNS.index(column)] = value
+    return tuple(row)
+
+
+def sort_key(key: tuple) -> tuple:
+    """Order of a channel key in the sqlite backend, which compares senders as blobs."""
+    return key[0].lower(), key[1]
+
+
+def row_to_dict(key: tuple, row: tuple):
+    """Return a channel row as a dict, like it is returned by the sqlite backend."""
+    ret = dict(zip(CHANNEL_COLUMNS, row))
+    ret['sender'], ret['open_block_number'] = key
+    return ret
+
+
+# accepted values of `PRAGMA synchronous`
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+DEL_CHANNEL_SQL = """
+DELETE FROM `channels` WHERE `sender` = ? AND `open_block_number` = ?"""
+
+
+class ChannelStorage(abc.ABC):
+    """Interface of a channel manager state storage.
+
+    Every method returns once the change is durable. A backend has to implement all
+    abstract methods to be instantiated.
+    """
+    filename = None
+    # version of the storage format, None if it isn't versioned
+    schema_version = None
+    current_schema_version = None
+
+    @abc.abstractmethod
+    def setup(self, network_id: int, contract_address: str, receiver: str):
+        """Initialize empty storage."""
+
+    @abc.abstractmethod
+    def get_metadata(self) -> dict:
+        """Returns:
+            dict: METADATA_COLUMNS => value
+        """
+
+    @abc.abstractmethod
+    def get_sync_state(self) -> dict:
+        """Returns:
+            dict: SYNC_STATE_COLUMNS => value
+        """
+
+    @abc.abstractmethod
+    def set_sync_state(self, values: list):
+        """Update the sync state with a list of (column, value) pairs."""
+
+    @abc.abstractmethod
+    def iter_channels(self):
+        """Iterate over all stored channels.
+
+        Yields:
+            tuple: (row, topups) of a channel
+        """
+
+    @abc.abstractmethod
+    def put_channel(self, channel: Channel):
+        """Add or update a channel."""
+
+    @abc.abstractmethod
+    def put_payments(self, channels: list):
+        """Store balance, balance signature and mtime of already stored channels."""
+
+    @abc.abstractmethod
+    def delete_channel(self, sender: str, open_block_number: int):
+        """Delete a channel and its topups."""
+
+    @abc.abstractmethod
+    def delete_unconfirmed_channels(self):
+        """Delete all unconfirmed channels."""
+
+    @abc.abstractmethod
+    def get_balance(self, sender: str, open_block_number: int):
+        """Returns:
+            int: the stored balance of a channel or None if the channel isn't stored
+        """
+
+    @abc.abstractmethod
+    def read_channels(
+            self,
+            confirmed=True,
+            states: tuple = None,
+            sender: str = None,
+            after: tuple = None,
+            limit: int = None
+    ) -> list:
+        """Read stored channels for the admin/stats endpoints.
+
+        Channels are ordered by (sender, open_block_number), senders are compared by their
+        binary value. This allows keyset pagination: pass the key of the last channel of a page
+        as `after` to get the next page.
+
+        Args:
+            confirmed (bool, optional): read confirmed (default) or unconfirmed channels
+            states (tuple, optional): read only channels in one of these ChannelStates
+            sender (str, optional): read only channels of this sender
+            after (tuple, optional): read only channels with a key greater than this
+                (sender, open_block_number)
+            limit (int, optional): max. number of channels to read
+        Returns:
+            list: rows of the channels
+        """
+
+    def iter_rows(self, confirmed=True, batch_size: int = 1000):
+        """Iterate over stored channels in the order of `read_channels()`.
+
+        Channels are read in pages of `batch_size`, so memory use doesn't depend on the number
+        of channels.
+
+        Yields:
+            dict: row of a channel
+        """
+        after = None
+        while True:
+            rows = self.read_channels(confirmed, after=after, limit=batch_size)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = rows[-1]['sender'], rows[-1]['open_block_number']
+
+    def compact(self):
+        """Reorganize the storage, e.g. merge logged changes. Called periodically and on stop."""
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryStorage(ChannelStorage):
+    """Storage that keeps the state in memory only, for tests and ephemeral proxies."""
+
+    def __init__(self, filename=None):
+        self.metadata = None
+        self.sync_state = None
+        # (sender, open_block_number) => (channel_to_row(), topups)
+        self.channels = dict()
+
+    def setup(self, network_id: int, contract_address: str, receiver: str):
+        self.metadata = dict(zip(METADATA_COLUMNS, (network_id, contract_address, receiver)))
+        self.sync_state = dict.fromkeys(SYNC_STATE_COLUMNS)
+
+    def get_metadata(self):
+        return dict(self.metadata)
+
+    def get_sync_state(self):
+        return dict(self.sync_state)
+
+    def set_sync_state(self, values: list):
+        self.sync_state.update(values)
+
+    def iter_channels(self):
+        for key, (row, topups) in self.channels.items():
+            yield row_to_dict(key, row), dict(topups)
+
+    def put_channel(self, channel: Channel):
+        key = channel.sender, channel.open_block_number
+        self.channels[key] = channel_to_row(channel), tuple(channel.unconfirmed_topups_items())
+
+    def _put_payment(self, key: tuple, payment: tuple):
+        row, topups = self.channels[key]
+        self.channels[key] = payment_to_row_update(row, payment), topups
+
+    def put_payments(self, channels: list):
+        for channel in channels:
+            key = channel.sender, channel.open_block_number
+            self._put_payment(key, payment_to_row(channel))
+
+    def delete_channel(self, sender: str, open_block_number: int):
+        del self.channels[sender, open_block_number]
+
+    def delete_unconfirmed_channels(self):
+        confirmed = CHANNEL_COLUMNS.index('confirmed')
+        self.channels = {
+            key: (row, topups) for key, (row, topups) in self.channels.items()
+            if row[confirmed]
+        }
+
+    def get_balance(self, sender: str, open_block_number: int):
+        stored = self.channels.get((sender, open_block_number))
+        if stored is None:
+            return None
+        return int(stored[0][CHANNEL_COLUMNS.index('balance')])
+
+    def read_channels(self, confirmed=True, states=None, sender=None, after=None, limit=None):
+        confirmed_index = CHANNEL_COLUMNS.index('confirmed')
+        state_index = CHANNEL_COLUMNS.index('state')
+        if states is not None:
+            states = {state.value for state in states}
+        if sender is not None:
+            sender = sender.lower()
+        if after is not None:
+            after = sort_key(after)
+        rows = sorted(
+            (sort_key(key), key, row) for key, (row, _) in self.channels.items()
+            if row[confirmed_index] == bool(confirmed) and
+            (states is None or row[state_index] in states) and
+            (sender is None or key[0].lower() == sender)
+        )
+        rows = [(key, row) for order, key, row in rows if after is None or order > after]
+        return [row_to_dict(key, row) for key, row in rows[:limit]]
+
+    def iter_rows(self, confirmed=True, batch_size: int = 1000):
+        # sort once instead of once per page
+        yield from self.read_channels(confirmed)
+
+
+class AppendLogStorage(MemoryStorage):
+    """Storage that appends every change as a JSON record to a log file.
+
+    The state is kept in memory and rebuilt by replaying the log on startup. A payment is a
+    single short record, so committing it is a sequential append and an fsync. Once the log
+    contains many superseded records, it is compacted, i.e. rewritten with the current state.
+
+    Args:
+        filename (str): path to the log file
+        fsync (bool, optional): fsync after every change. Default is True.
+        compact_ratio (int, optional): compact the log on startup if it has more than
+            `compact_ratio` records per stored channel
+    """
+
+    def __init__(self, filename: str, fsync: bool = True, compact_ratio: int = 4):
+        super().__init__()
+        assert filename and filename != ':memory:'
+        self.filename = filename
+        self.fsync = fsync
+        self.compact_ratio = compact_ratio
+        self.n_records = 0
+        if os.path.isfile(filename):
+            self._replay()
+        self.log = open(filename, 'a')
+        os.chmod(filename, 0o600)
+        if self.n_records > self.compact_ratio * (len(self.channels) + 1):
+            self.compact()
+
+    def _replay(self):
+        size = 0
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # a record that has been written only partially before a crash
+                    log.warning('dropping incomplete record at the end of %s', self.filename)
+                    break
+                self._apply(json.loads(line.decode()))
+                self.n_records += 1
+                size += len(line)
+        os.truncate(self.filename, size)
+
+    def _apply(self, record: list):
+        op = record[0]
+        if op == 'setup':
+            MemoryStorage.setup(self, *record[1:])
+        elif op == 'sync':
+            MemoryStorage.set_sync_state(self, record[1])
+        elif op == 'channel':
+            self.channels[tuple(record[1])] = tuple(record[2]), tuple(map(tuple, record[3]))
+        elif op == 'payment':
+            self._put_payment(tuple(record[1]), tuple(record[2]))
+        elif op == 'delete':
+            MemoryStorage.delete_channel(self, *record[1])
+        elif op == 'delete_unconfirmed':
+            MemoryStorage.delete_unconfirmed_channels(self)
+        else:
+            raise ValueError('unknown record %r in %s' % (op, self.filename))
+
+    def _append(self, records: list):
+        self.log.write(''.join(json.dumps(record) + '\n' for record in records))
+        self.log.flush()
+        if self.fsync:
+            os.fsync(self.log.fileno())
+        self.n_records += len(records)
+
+    def _channel_record(self, key: tuple):
+        row, topups = self.channels[key]
+        return ['channel', key, row, topups]
+
+    def setup(self, network_id: int, contract_address: str, receiver: str):
+        super().setup(network_id, contract_address, receiver)
+        self._append([['setup', network_id, contract_address, receiver]])
+
+    def set_sync_state(self, values: list):
+        super().set_sync_state(values)
+        self._append([['sync', values]])
+
+    def put_channel(self, channel: Channel):
+        super().put_channel(channel)
+        self._append([self._channel_record((channel.sender, channel.open_block_number))])
+
+    def put_payments(self, channels: list):
+        super().put_payments(channels)
+        self._append([
+            ['payment', (c.sender, c.open_block_number), payment_to_row(c)] for c in channels
+        ])
+
+    def delete_channel(self, sender: str, open_block_number: int):
+        super().delete_channel(sender, open_block_number)
+        self._append([['delete', (sender, open_block_number)]])
+
+    def delete_unconfirmed_channels(self):
+        super().delete_unconfirmed_channels()
+        self._append([['delete_unconfirmed']])
+
+    def compact(self):
+        """Rewrite the log so that it only contains the current state."""
+        records = [
+            ['setup'] + [self.metadata[column] for column in METADATA_COLUMNS],
+            ['sync', list(self.sync_state.items())]
+        ]
+        records.extend(self._channel_record(key) for key in self.channels)
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_filename, 0o600)
+        self.log.close()
+        os.replace(tmp_filename, self.filename)
+        self.log = open(self.filename, 'a')
+        log.debug('compacted %s from %d to %d records',
+                  self.filename, self.n_records, len(records))
+        self.n_records = len(records)
+
+    def close(self):
+        self.log.close()
+
+
+class BalanceLog(object):
+    """Memory-mapped log of payments with fixed-size records.
+
+    A record holds sender, open block number, balance, balance signature and mtime of a channel
+    and a crc32 checksum. Appending a payment copies the record into the mapped file (and
+    flushes the pages of the record if `sync` is set). The log has room for `capacity` records,
+    or more if an existing file is larger, and is expected to be compacted, i.e. merged into the
+    database and cleared by `clear()`, before it is full.
+
+    Args:
+        filename (str): path to the log file
+        capacity (int): number of records the log can hold
+        sync (bool, optional): flush the mapped pages after every append. Default is True.
+    """
+    # sender, open_block_number, balance, signature, mtime, crc32 of the preceding fields.
+    # The sender is kept as it is used in the channel key, including its checksum encoding.
+    RECORD = struct.Struct('>42sQ32s65sdI')
+
+    def __init__(self, filename: str, capacity: int, sync: bool = True):
+        assert capacity > 0
+        self.filename = filename
+        self.sync = sync
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # records of a log created with a larger capacity must not be cut off
+            self.capacity = max(capacity, os.fstat(fd).st_size // self.RECORD.size)
+            size = self.capacity * self.RECORD.size
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.n_records = 0
+
+    def __len__(self):
+        return self.n_records
+
+    @property
+    def is_full(self):
+        return self.n_records >= self.capacity
+
+    def append(self, key: tuple, payment: tuple):
+        """Append a payment, i.e. PAYMENT_COLUMNS values, of channel `key`.
+
+        Raises:
+            BalanceLogFull: if the log has no room for another record
+        """
+        if self.is_full:
+            raise BalanceLogFull('balance log %s is full' % self.filename)
+        sender, open_block_number = key
+        balance, signature, mtime = payment
+        data = self.RECORD.pack(
+            sender.encode(),
+            open_block_number,
+            int(balance).to_bytes(32, 'big'),
+            decode_hex(signature),
+            mtime,
+            0
+        )[:-4]
+        offset = self.n_records * self.RECORD.size
+        self.mmap[offset:offset + self.RECORD.size] = data + struct.pack(
+            '>I', zlib.crc32(data)
+        )
+        if self.sync:
+            # only the pages of the record, not the whole mapping
+            start = offset - offset % mmap.PAGESIZE
+            self.mmap.flush(start, offset + self.RECORD.size - start)
+        self.n_records += 1
+
+    def replay(self):
+        """Read the valid records at the start of the log.
+
+        Reading stops at the first record with an invalid checksum, i.e. at the end of the log
+        or at a record that has been written only partially before a crash.
+
+        Returns:
+            dict: (sender, open_block_number) => payment of the newest record of each channel
+        """
+        payments = dict()
+        self.n_records = 0
+        for offset in range(0, self.capacity * self.RECORD.size, self.RECORD.size):
+            record = self.mmap[offset:offset + self.RECORD.size]
+            if struct.unpack('>I', record[-4:])[0] != zlib.crc32(record[:-4]):
+                break
+            sender, open_block_number, balance, signature, mtime, _ = self.RECORD.unpack(record)
+            key = sender.decode(), open_block_number
+            payments[key] = (
+                int.from_bytes(balance, 'big'),
+                encode_hex(signature),
+                mtime
+            )
+            self.n_records += 1
+        return payments
+
+    def clear(self):
+        """Remove all records."""
+        self.mmap[:self.n_records * self.RECORD.size] = bytes(self.n_records * self.RECORD.size)
+        self.mmap.flush()
+        self.n_records = 0
+
+    def close(self):
+        self.mmap.close()
+
+
+class SQLiteStorage(ChannelStorage):
+    """Storage in a sqlite database.
+
+    If `wal` is set, the database is run in write-ahead log mode. All changes are written
+    through `conn`, while queries from the admin/stats endpoints use a separate read-only
+    connection (see `snapshot()`), so they neither wait for nor block commits.
+
+    If `threaded` is set, all database I/O runs on a dedicated writer thread (and reads of the
+    reader connection on a separate reader thread), so commits don't block the gevent hub.
+    Bookkeeping of the committed rows is updated as soon as a write has been submitted; the
+    calling greenlet then waits until it has been committed.
+
+    If `balance_log` is set, payments are appended to a BalanceLog next to the database instead
+    of being written to the `channels` table. The newest payment of each channel is merged into
+    the table by `compact()`, when the log is full and when the storage is closed. Payments
+    that are still in the log when the channels are loaded (e.g. after a crash) are merged
+    first. This is done even if `balance_log` isn't set, the log is removed afterwards then.
+
+    Args:
+        filename (str): path to the database file
+        wal (bool, optional): use write-ahead logging
+        synchronous (str, optional): value of `PRAGMA synchronous`, e.g. 'NORMAL'
+        threaded (bool, optional): run database I/O in a separate thread
+        balance_log (bool, optional): log payments in `<filename>.balances`
+        balance_log_capacity (int, optional): number of payments the balance log can hold
+    """
+
+    def __init__(
+            self,
+            filename,
+            wal: bool = False,
+            synchronous: str = None,
+            threaded: bool = False,
+            balance_log: bool = False,
+            balance_log_capacity: int = 64 * 1024
+    ):
+        assert synchronous is None or synchronous.upper() in SYNCHRONOUS_MODES
+        self.filename = filename
+        # single threads that own the connections; None if I/O runs in the calling greenlet
+        self.writer = ThreadPool(1) if threaded else None
+        self.reader_thread = ThreadPool(1) if threaded else None
+        self.conn = sqlite3.connect(
+            self.filename,
+            isolation_level="EXCLUSIVE",
+            check_same_thread=not threaded
+        )
+        self.conn.row_factory = dict_factory
+        if filename not in (None, ':memory:'):
+            os.chmod(filename, 0o600)
+        # in-memory databases can't be shared between connections
+        self.wal = wal and filename not in (None, ':memory:')
+        if self.wal:
+            self.conn.execute('PRAGMA journal_mode=WAL;')
+        if synchronous is not None:
+            self.conn.execute('PRAGMA synchronous=%s;' % synchronous.upper())
+        self._reader = None
+        # (sender, open_block_number) => (rowid, channel_to_row(), topups) as committed to the
+        # database or the balance log. Used to write only the columns that have changed.
+        self._stored = dict()
+        self.balance_log = None
+        # (sender, open_block_number) => newest payment in the balance log
+        self._logged = dict()
+        self._log_lock = RLock()
+        # number of compactions, to detect a compaction while channels are read
+        self._compactions = 0
+        # log payments instead of writing them to the table
+        self.log_payments = balance_log
+        if balance_log:
+            assert filename not in (None, ':memory:')
+        if balance_log or (filename not in (None, ':memory:') and
+                           os.path.isfile(filename + '.balances')):
+            # a log left by a previous run must be merged before the channels are used
+            self.balance_log = BalanceLog(filename + '.balances', balance_log_capacity)
+
+    current_schema_version = SCHEMA_VERSION
+
+    @property
+    def schema_version(self):
+        """Returns:
+            int: schema version of the database, 1 for files created before versioning
+        """
+        version = self._query('PRAGMA user_version;')[0]['user_version']
+        return version or 1
+
+    def _replay_balance_log(self):
+        """Merge payments left in the balance log, e.g. after a crash."""
+        self._logged = self.balance_log.replay()
+        if self._logged:
+            log.info('merging %d logged payments of %d channels into %s',
+                     len(self.balance_log), len(self._logged), self.filename)
+        self.compact()
+        if not self.log_payments:
+            self._remove_balance_log()
+
+    def _remove_balance_log(self):
+        """Remove a merged balance log that isn't used for new payments."""
+        self.balance_log.close()
+        os.remove(self.balance_log.filename)
+        self.balance_log = None
+
+    def _submit(self, func, *args) -> AsyncResult:
+        """Run `func(*args)` on the writer thread.
+
+        Returns:
+            AsyncResult: future with the return value of `func`. If the storage isn't
+                threaded, `func` has already been run.
+        """
+        if self.writer is not None:
+            return self.writer.spawn(func, *args)
+        result = AsyncResult()
+        result.set(func(*args))
+        return result
+
+    def _write(self, sql: str, params=(), many=False):
+        """Execute a statement and commit it on the writer thread.
+
+        Returns:
+            AsyncResult: future with the rowid of the last inserted row
+        """
+        return self._submit(self._do_write, sql, params, many)
+
+    def _do_write(self, sql: str, params, many: bool):
+        if many:
+            cursor = self.conn.executemany(sql, params)
+        else:
+            cursor = self.conn.execute(sql, params)
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def _query(self, sql: str, params=()):
+        """Run a query of the writer connection and wait for its result.
+
+        Returns:
+            list: result rows
+        """
+        return self._submit(lambda: self.conn.execute(sql, params).fetchall()).get()
+
+    def setup(self, network_id: int, contract_address: str, receiver: str):
+        def setup():
+            self.conn.executescript(DB_CREATION_SQL)
+            self.conn.execute(UPDATE_METADATA_SQL, [network_id, contract_address, receiver])
+            self.conn.commit()
+        self._submit(setup).get()
+        if self.balance_log is not None:
+            # records of a previous database of the same name
+            self.balance_log.clear()
+            if not self.log_payments:
+                self._remove_balance_log()
+
+    def get_metadata(self):
+        metadata = self._query('SELECT * FROM `metadata`;')
+        assert len(metadata) == 1
+        return metadata[0]
+
+    def get_sync_state(self):
+        sync_state = self._query('SELECT * FROM `syncstate`;')
+        assert len(sync_state) == 1
+        assert len(sync_state[0]) == 4
+        return sync_state[0]
+
+    def set_sync_state(self, values: list):
+        sql = 'UPDATE `syncstate` SET %s;' % ', '.join('`%s` = ?' % c for c, _ in values)
+        self._write(sql, [value for _, value in values]).get()
+
+    @property
+    def reader(self):
+        """Connection used for read-only queries of the admin/stats endpoints.
+
+        In WAL mode this is a separate read-only connection, otherwise it is `conn`.
+        """
+        if not self.wal:
+            return self.conn
+        if self._reader is None:
+            self._reader = sqlite3.connect(
+                'file:%s?mode=ro' % self.filename,
+                uri=True,
+                isolation_level=None
+            )
+            self._reader.row_factory = dict_factory
+        return self._reader
+
+    @contextmanager
+    def snapshot(self):
+        """Context manager that yields a cursor of the reader connection.
+
+        In WAL mode all queries run in a single read transaction and see a consistent
+        snapshot of the database, unaffected by commits made in the meantime.
+        """
+        cursor = self.reader.cursor()
+        if not self.wal:
+            yield cursor
+            return
+        cursor.execute('BEGIN;')
+        try:
+            yield cursor
+        finally:
+            cursor.execute('COMMIT;')
+
+    def _submit_read(self, func, *args) -> AsyncResult:
+        """Run `func(*args)` on the thread that owns the reader connection."""
+        if not self.wal or self.reader_thread is None:
+            return self._submit(func, *args)
+        return self.reader_thread.spawn(func, *args)
+
+    def read_channels(self, confirmed=True, states=None, sender=None, after=None, limit=None):
+        """See `ChannelStorage.read_channels()`.
+
+        The state filter uses the `channels_state` index, sender lookups and pagination use the
+        primary key. Payments in the balance log replace the values read from the table.
+        """
+        conditions = ['`confirmed` = ?']
+        params = [bool(confirmed)]
+        if states is not None:
+            conditions.append('`state` IN (%s)' % ', '.join('?' * len(states)))
+            params.extend(state.value for state in states)
+        if sender is not None:
+            conditions.append('`sender` = ?')
+            params.append(decode_hex(sender))
+        if after is not None:
+            conditions.append('(`sender`, `open_block_number`) > (?, ?)')
+            params.extend(encode_key(after))
+        sql = 'SELECT * FROM `channels` WHERE %s ORDER BY `sender`, `open_block_number`' % (
+            ' AND '.join(conditions))
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        def read():
+            with self.snapshot() as c:
+                c.execute(sql, params)
+                return c.fetchall()
+        while True:
+            compactions = self._compactions
+            results = [decode_channel(result) for result in self._submit_read(read).get()]
+            # payments logged since the last compaction are newer than the rows read; if the
+            # log has been compacted meanwhile, they may be neither in the rows nor in the log
+            if compactions == self._compactions:
+                break
+        for result in results:
+            payment = self._logged.get((result['sender'], result['open_block_number']))
+            if payment is not None:
+                result.update(zip(PAYMENT_COLUMNS, payment))
+        return results
+
+    def close(self):
+        """Close the database connections and stop the I/O threads."""
+        if self.balance_log is not None:
+            self.compact()
+            self.balance_log.close()
+        if self._reader is not None:
+            self._submit_read(self._reader.close).get()
+            self._reader = None
+        self._submit(self.conn.close).get()
+        for pool in (self.writer, self.reader_thread):
+            if pool is not None:
+                pool.kill()
+
+    def get_channel_rowid(self, sender: str, open_block_number: int):
+        result = self._query(
+            'SELECT rowid from `channels` WHERE sender = ? AND open_block_number = ?',
+            encode_key((sender, open_block_number))
+        )
+        return result[0]['rowid']
+
+    def get_unconfirmed_topups(self, channel_rowid: int):
+        results = self._query('SELECT * FROM topups WHERE channel_rowid = ?', [channel_rowid])
+        return {result['txhash']: decode_uint(result['deposit']) for result in results}
+
+    def iter_channels(self):
+        """Iterate over all channels.
+
+        All topups are read once, channels are read in a single pass. Payments left in the
+        balance log are merged before.
+        """
+        if self.balance_log is not None:
+            self._replay_balance_log()
+        self._stored = dict()
+        topups = defaultdict(dict)
+        for result in self._query('SELECT * FROM `topups`'):
+            topups[result['channel_rowid']][result['txhash']] = decode_uint(result['deposit'])
+        for result in self._query('SELECT rowid, * FROM `channels`'):
+            result = decode_channel(result)
+            key = result['sender'], result['open_block_number']
+            channel_topups = topups.pop(result['rowid'], {})
+            # the row as channel_to_row() returns it for the loaded channel
+            row = tuple(result[column] for column in CHANNEL_COLUMNS)
+            self._stored[key] = (
+                result['rowid'],
+                row,
+                tuple(sorted(channel_topups.items()))
+            )
+            yield result, channel_topups
+
+    def _set_unconfirmed_topups(self, channel_rowid: int, topups: tuple):
+        """Replace topups of a channel. Must be run on the writer thread."""
+        assert channel_rowid is not None and isinstance(channel_rowid, int)
+        self.conn.execute('DELETE FROM topups WHERE channel_rowid = ?', [channel_rowid])
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO topups VALUES (?, ?, ?)',
+            [(channel_rowid, txhash, encode_uint(deposit)) for txhash, deposit in topups]
+        )
+
+    def _insert_channel(self, key: tuple, row: tuple, topups: tuple):
+        """Insert a new channel and its topups. Must be run on the writer thread.
+
+        Returns:
+            int: rowid of the channel
+        """
+        rowid = self.conn.execute(
+            ADD_CHANNEL_SQL,
+            encode_key(key) + encode_values(CHANNEL_COLUMNS, row)
+        ).lastrowid
+        if topups:
+            self._set_unconfirmed_topups(rowid, topups)
+        self.conn.commit()
+        return rowid
+
+    def _update_channel(self, key: tuple, rowid: int, columns: tuple, values: tuple, topups):
+        """Update changed columns and topups of a channel. Must be run on the writer thread.
+
+        `rowid` is None if the channel has been updated before its insert has returned. The
+        insert has been committed by then, as the writer thread runs writes in order.
+        """
+        if columns:
+            self.conn.execute(
+                update_channel_sql(columns),
+                encode_values(columns, values) + encode_key(key)
+            )
+        if topups is not None:
+            if rowid is None:
+                rowid = self.conn.execute(
+                    'SELECT rowid from `channels` WHERE sender = ? AND open_block_number = ?',
+                    encode_key(key)
+                ).fetchone()['rowid']
+            self._set_unconfirmed_topups(rowid, topups)
+        self.conn.commit()
+
+    def put_channel(self, channel: Channel):
+        """Add or update a channel.
+
+        A new channel is inserted. For a known channel, only the columns that differ from the
+        committed row are updated and topups are rewritten only if they have changed.
+
+        The row of a new channel is recorded before the insert has returned, with a rowid of
+        None, so that payments and updates of the channel made in the meantime (by other
+        greenlets in threaded mode) are written after the insert instead of inserting it again.
+        """
+        key = channel.sender, channel.open_block_number
+        row = channel_to_row(channel)
+        topups = tuple(sorted(channel.unconfirmed_topups_items()))
+        stored = self._stored.get(key)
+        result = None
+        if stored is None:
+            self._stored[key] = None, row, topups
+            try:
+                rowid = self._submit(self._insert_channel, key, row, topups).get()
+            except Exception:
+                self._stored.pop(key, None)
+                raise
+            stored = self._stored.get(key)
+            if stored is not None and stored[0] is None:
+                # the row may have been updated while the insert was running
+                self._stored[key] = (rowid,) + stored[1:]
+        else:
+            rowid, stored_row, stored_topups = stored
+            changed = [
+                (column, value)
+                for column, value, stored_value in zip(CHANNEL_COLUMNS, row, stored_row)
+                if value != stored_value
+            ]
+            columns, values = zip(*changed) if changed else ((), ())
+            if changed or topups != stored_topups:
+                result = self._submit(
+                    self._update_channel, key, rowid, columns, values,
+                    topups if topups != stored_topups else None
+                )
+            self._stored[key] = rowid, row, topups
+        if key in self._logged:
+            # make sure that a replay of the log doesn't revert the update
+            self._log_payments([(key, payment_to_row(channel))])
+        if result is not None:
+            result.get()
+
+    def _log_payments(self, payments: list):
+        """Append payments to the balance log."""
+        with self._log_lock:
+            for key, values in payments:
+                if self.balance_log.is_full:
+                    self.compact()
+                self.balance_log.append(key, values)
+                self._logged[key] = values
+
+    def compact(self):
+        """Merge the newest logged payment of each channel into the `channels` table."""
+        if self.balance_log is None:
+            return
+        with self._log_lock:
+            if self._logged:
+                self._write(
+                    update_channel_sql(PAYMENT_COLUMNS),
+                    [
+                        encode_values(PAYMENT_COLUMNS, values) + encode_key(key)
+                        for key, values in self._logged.items()
+                    ],
+                    many=True
+                ).get()
+            self.balance_log.clear()
+            self._logged = dict()
+            self._compactions += 1
+
+    def put_payments(self, channels: list):
+        payments = [
+            ((c.sender, c.open_block_number), payment_to_row(c)) for c in channels
+        ]
+        if self.log_payments:
+            self._log_payments(payments)
+            for key, values in payments:
+                rowid, row, topups = self._stored[key]
+                self._stored[key] = rowid, payment_to_row_update(row, values), topups
+            return
+        result = self._write(
+            update_channel_sql(PAYMENT_COLUMNS),
+            [encode_values(PAYMENT_COLUMNS, values) + encode_key(key) for key, values in payments],
+            many=True
+        )
+        for key, values in payments:
+            rowid, row, topups = self._stored[key]
+            self._stored[key] = rowid, payment_to_row_update(row, values), topups
+        result.get()
+
+    def delete_channel(self, sender: str, open_block_number: int):
+        result = self._write(DEL_CHANNEL_SQL, encode_key((sender, open_block_number)))
+        del self._stored[sender, open_block_number]
+        result.get()
+
+    def delete_unconfirmed_channels(self):
+        result = self._write('DELETE FROM `channels` WHERE `confirmed` = 0')
+        confirmed = CHANNEL_COLUMNS.index('confirmed')
+        self._stored = {
+            key: stored for key, stored in self._stored.items()
+            if stored[1][confirmed]
+        }
+        result.get()
+
+    def get_balance(self, sender: str, open_block_number: int):
+        stored = self._stored.get((sender, open_block_number))
+        if stored is None:
+            return None
+        return int(stored[1][CHANNEL_COLUMNS.index('balance')])
+
+
+# name => storage class
+STORAGE_BACKENDS = {
+    'sqlite': SQLiteStorage,
+    'memory': MemoryStorage,
+    'log': AppendLogStorage
+}
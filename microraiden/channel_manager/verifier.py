@@ -0,0 +1,114 @@
+"""Balance proof signature verification off the gevent hub."""
+import time
+import logging
+
+from gevent.lock import BoundedSemaphore
+from gevent.threadpool import ThreadPool
+
+from microraiden.utils import addr_from_sig, get_balance_proof_context
+
+log = logging.getLogger(__name__)
+
+
+class StageTimer(object):
+    """Number of calls, total and max. duration of a processing stage."""
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class SignatureVerifier(object):
+    """Recovers signers of balance proofs on a pool of worker threads.
+
+    Hashing and EC recovery don't hold the GIL, so proofs are verified in parallel on multiple
+    cores while the gevent hub keeps serving requests. At most `max_pending` proofs are queued
+    or being verified; further callers wait for a free slot.
+
+    Time spent in each stage is recorded in `timers`: 'queue' (waiting for a slot and a
+    worker), 'hash' (balance proof message) and 'recover' (EC recovery).
+
+    Args:
+        n_workers (int): number of worker threads
+        max_pending (int, optional): max. number of proofs queued or in verification
+    """
+    STAGES = ('queue', 'hash', 'recover')
+
+    def __init__(self, n_workers: int, max_pending: int = 1000):
+        assert n_workers > 0
+        assert max_pending >= n_workers
+        self.pool = ThreadPool(n_workers)
+        self.slots = BoundedSemaphore(max_pending)
+        self.timers = {stage: StageTimer() for stage in self.STAGES}
+
+    def _recover_balance_proof(
+            self,
+            receiver: str,
+            open_block_number: int,
+            balance: int,
+            balance_sig: bytes,
+            contract_address: str,
+            t_submit: float
+    ):
+        """Runs on a worker thread.
+
+        Returns:
+            tuple: (signer, durations of the stages)
+        """
+        t_start = time.time()
+        context = get_balance_proof_context(receiver, open_block_number, contract_address)
+        msg = context.message(balance)
+        t_hashed = time.time()
+        signer = addr_from_sig(balance_sig, msg)
+        t_recovered = time.time()
+        return signer, (t_start - t_submit, t_hashed - t_start, t_recovered - t_hashed)
+
+    def recover_balance_proof(
+            self,
+            receiver: str,
+            open_block_number: int,
+            balance: int,
+            balance_sig: bytes,
+            contract_address: str
+    ) -> str:
+        """Recover the signer of a balance proof, see `utils.verify_balance_proof()`.
+
+        Blocks the calling greenlet, but not the hub, until the proof has been verified.
+        """
+        t_submit = time.time()
+        with self.slots:
+            signer, durations = self.pool.spawn(
+                self._recover_balance_proof,
+                receiver,
+                open_block_number,
+                balance,
+                balance_sig,
+                contract_address,
+                t_submit
+            ).get()
+        for stage, duration in zip(self.STAGES, durations):
+            self.timers[stage].add(duration)
+        return signer
+
+    def stats(self) -> dict:
+        """Returns:
+            dict: stage => {'count', 'mean', 'max'} with durations in seconds
+        """
+        return {
+            stage: {'count': timer.count, 'mean': timer.mean, 'max': timer.max}
+            for stage, timer in self.timers.items()
+        }
+
+    def close(self):
+        self.pool.kill()
@@ -7,8 +7,7 @@ from typing import Callable
 from microraiden.client.context import Context
 from microraiden.utils import (
     get_event_blocking,
-    create_signed_contract_transaction,
-    sign_balance_proof,
+    BalanceProofContext,
     verify_closing_sig,
     keccak256
 )
@@ -35,6 +34,7 @@ class Channel:
     ):
         self._balance = 0
         self._balance_sig = None
+        self._proof_context = None
 
         self.core = core
         self.sender = sender
@@ -65,13 +65,14 @@ class Channel:
         return self._balance_sig
 
     def sign(self):
-        return sign_balance_proof(
-            self.core.private_key,
-            self.receiver,
-            self.block,
-            self.balance,
-            self.core.channel_manager.address
-        )
+        # everything but the balance is packed and hashed once per channel
+        if self._proof_context is None:
+            self._proof_context = BalanceProofContext(
+                self.receiver,
+                self.block,
+                self.core.channel_manager.address
+            )
+        return self._proof_context.sign(self.core.signer, self.balance)
 
     def topup(self, deposit):
         """
@@ -97,9 +98,7 @@ class Channel:
         data = (decode_hex(self.sender) +
                 decode_hex(self.receiver) +
                 self.block.to_bytes(4, byteorder='big'))
-        tx = create_signed_contract_transaction(
-            self.core.private_key,
-            self.core.token,
+        self.core.token_transactions.transact(
             'transfer',
             [
                 self.core.channel_manager.address,
@@ -107,7 +106,6 @@ class Channel:
                 data
             ]
         )
-        self.core.web3.eth.sendRawTransaction(tx)
 
         log.debug('Waiting for topup confirmation event...')
         event = get_event_blocking(
@@ -145,9 +143,7 @@ class Channel:
         if balance is not None:
             self.update_balance(balance)
 
-        tx = create_signed_contract_transaction(
-            self.core.private_key,
-            self.core.channel_manager,
+        self.core.channel_manager_transactions.transact(
             'uncooperativeClose',
             [
                 self.receiver,
@@ -155,7 +151,6 @@ class Channel:
                 self.balance
             ]
         )
-        self.core.web3.eth.sendRawTransaction(tx)
 
         log.debug('Waiting for close confirmation event...')
         event = get_event_blocking(
@@ -203,9 +198,7 @@ class Channel:
             log.error('Invalid closing signature.')
             return None
 
-        tx = create_signed_contract_transaction(
-            self.core.private_key,
-            self.core.channel_manager,
+        self.core.channel_manager_transactions.transact(
             'cooperativeClose',
             [
                 self.receiver,
@@ -215,7 +208,6 @@ class Channel:
                 closing_sig
             ]
         )
-        self.core.web3.eth.sendRawTransaction(tx)
 
         log.debug('Waiting for settle confirmation event...')
         event = get_event_blocking(
@@ -262,16 +254,13 @@ class Channel:
             ))
             return None
 
-        tx = create_signed_contract_transaction(
-            self.core.private_key,
-            self.core.channel_manager,
+        self.core.channel_manager_transactions.transact(
             'settle',
             [
                 self.receiver,
                 self.block
             ]
         )
-        self.core.web3.eth.sendRawTransaction(tx)
 
         log.debug('Waiting for settle confirmation event...')
         event = get_event_blocking(
@@ -9,8 +9,7 @@ from web3.providers.rpc import HTTPProvider
 from microraiden.utils import (
     get_private_key,
     get_logs,
-    get_event_blocking,
-    create_signed_contract_transaction
+    get_event_blocking
 )
 
 from microraiden.config import NETWORK_CFG
@@ -172,9 +171,7 @@ class Client:
         ))
 
         data = decode_hex(self.context.address) + decode_hex(receiver_address)
-        tx = create_signed_contract_transaction(
-            self.context.private_key,
-            self.context.token,
+        self.context.token_transactions.transact(
             'transfer',
             [
                 self.context.channel_manager.address,
@@ -182,7 +179,6 @@ class Client:
                 data
             ]
         )
-        self.context.web3.eth.sendRawTransaction(tx)
 
         log.debug('Waiting for channel creation event on the blockchain...')
         filters = {
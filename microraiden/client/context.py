@@ -1,7 +1,7 @@
 from web3 import Web3
 
 from microraiden.constants import CONTRACT_METADATA, TOKEN_ABI_NAME, CHANNEL_MANAGER_ABI_NAME
-from microraiden.utils import privkey_to_addr
+from microraiden.utils import Signer, NonceCounter, TransactionBuilder
 
 
 class Context(object):
@@ -12,7 +12,8 @@ class Context(object):
             channel_manager_address: str
     ):
         self.private_key = private_key
-        self.address = privkey_to_addr(private_key)
+        self.signer = Signer(private_key)
+        self.address = self.signer.address
         self.web3 = web3
 
         self.channel_manager = web3.eth.contract(
@@ -25,3 +26,12 @@ class Context(object):
             address=token_address,
             abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
         )
+
+        self.nonces = NonceCounter(web3, self.address)
+        network_id = int(web3.version.network)
+        self.channel_manager_transactions = TransactionBuilder(
+            self.signer, self.channel_manager, self.nonces, network_id
+        )
+        self.token_transactions = TransactionBuilder(
+            self.signer, self.token, self.nonces, network_id
+        )
@@ -154,9 +154,22 @@ def close_open_channels(
     """
     web3 = channel_manager_contract.web3
     pending_txs = {}
+    transactions = utils.TransactionBuilder(private_key, channel_manager_contract)
 
-    for channel in state.channels.values():
-        if not channel.last_signature:
+    channels = [channel for channel in state.channels.values() if channel.last_signature]
+    # closing with a balance proof that wasn't signed by the sender would fail on-chain
+    signers = utils.verify_balance_proofs(
+        (channel.receiver, channel.open_block_number, channel.balance,
+         decode_hex(channel.last_signature), channel_manager_contract.address)
+        for channel in channels
+    )
+    for channel, signer in zip(channels, signers):
+        if signer is None or not is_same_address(signer, channel.sender):
+            log.info(
+                'Invalid balance proof of channel (sender %s, block number %d)',
+                channel.sender,
+                channel.open_block_number
+            )
             continue
 
         channel_id = (channel.sender, channel.receiver, channel.open_block_number)
@@ -175,16 +188,14 @@ def close_open_channels(
             )
             continue
         closing_sig = utils.sign_close(
-            private_key,
+            transactions.signer,
             channel.sender,
             channel.open_block_number,
             channel.balance,
             channel_manager_contract.address
         )
 
-        raw_tx = utils.create_signed_contract_transaction(
-            private_key,
-            channel_manager_contract,
+        tx_hash = transactions.transact(
             'cooperativeClose',
             [
                 channel.receiver,
@@ -195,7 +206,6 @@ def close_open_channels(
             ],
             gas_price=gas_price,
         )
-        tx_hash = web3.eth.sendRawTransaction(raw_tx)
         log.info(
             'Sending cooperative close tx (hash: %s): %d from %r',
             encode_hex(tx_hash),
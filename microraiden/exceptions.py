@@ -61,3 +61,13 @@ class InsecureStateFile(StateFileException):
 class NetworkIdMismatch(StateFileException):
     """RPC endpoint and database have different network id."""
     pass
+
+
+class StateFileVersionMismatch(StateFileException):
+    """State file has been created with a different schema version and must be migrated."""
+    pass
+
+
+class BalanceLogFull(StateFileException):
+    """The balance log of the state has no room for another payment and must be compacted."""
+    pass
@@ -13,12 +13,14 @@ from microraiden.proxy.resources import (
     Expensive,
     ChannelManagementAdmin,
     ChannelManagementAdminChannels,
+    ChannelManagementAdminExport,
     ChannelManagementListChannels,
     ChannelManagementChannelInfo,
     ChannelManagementLogin,
     ChannelManagementLogout,
     ChannelManagementRoot,
     ChannelManagementStats,
+    ChannelManagementAbi,
 )
 
 from microraiden.proxy.resources.expensive import LightClientProxy
@@ -81,6 +83,9 @@ class PaywalledProxy:
                               API_PATH +
                               "/admin/channels/<string:sender_address>/<int:opening_block>",
                               resource_class_kwargs={'channel_manager': self.channel_manager})
+        self.api.add_resource(ChannelManagementAdminExport,
+                              API_PATH + "/admin/export",
+                              resource_class_kwargs={'channel_manager': self.channel_manager})
         self.api.add_resource(ChannelManagementListChannels,
                               API_PATH + "/channels/",
                               API_PATH + "/channels/<string:sender_address>",
@@ -88,6 +93,9 @@ class PaywalledProxy:
         self.api.add_resource(ChannelManagementStats,
                               API_PATH + "/stats",
                               resource_class_kwargs={'channel_manager': self.channel_manager})
+        self.api.add_resource(ChannelManagementAbi,
+                              API_PATH + "/abi",
+                              resource_class_kwargs={'channel_manager': self.channel_manager})
         self.api.add_resource(ChannelManagementRoot, "/cm")
 
     def run(self,
@@ -3,8 +3,10 @@ from .management import (
     ChannelManagementRoot,
     ChannelManagementAdmin,
     ChannelManagementAdminChannels,
+    ChannelManagementAdminExport,
     ChannelManagementListChannels,
     ChannelManagementStats,
+    ChannelManagementAbi,
     ChannelManagementChannelInfo,
 )
 from .login import (
@@ -20,7 +22,9 @@ __all__ = (
     ChannelManagementChannelInfo,
     ChannelManagementAdmin,
     ChannelManagementAdminChannels,
+    ChannelManagementAdminExport,
     ChannelManagementStats,
+    ChannelManagementAbi,
     ChannelManagementLogin,
     ChannelManagementLogout,
     PaywalledProxyUrl
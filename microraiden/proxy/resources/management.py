@@ -1,14 +1,25 @@
+from itertools import groupby
+from operator import itemgetter
+from urllib.parse import urlencode
+
+from flask import Response, request, stream_with_context
 from flask_restful import Resource, reqparse
-from collections import defaultdict
 
 from microraiden.utils import sign_close
 from microraiden.proxy.resources.login import auth
 from eth_utils import encode_hex, is_address, to_checksum_address
 
-from microraiden.channel_manager import Channel, ChannelManager
+from microraiden.channel_manager import ChannelManager, ChannelState
 from microraiden.exceptions import NoOpenChannel, InvalidBalanceProof
 
 
+def is_closed(row: dict) -> bool:
+    """Returns:
+        bool: True if the channel in a row of the `channels` table is closed
+    """
+    return row['state'] in (ChannelState.CLOSED, ChannelState.CLOSE_PENDING)
+
+
 class ChannelManagementRoot(Resource):
     @staticmethod
     def get():
@@ -21,92 +32,119 @@ class ChannelManagementStats(Resource):
         self.channel_manager = channel_manager
 
     def get(self):
-        deposit_sum = sum([c.deposit for c in self.channel_manager.channels.values()])
-        unique_senders = {}
-        open_channels = []
-        pending_channels = []
-        for k, v in self.channel_manager.channels.items():
-            unique_senders[k[0]] = 1
-            if v.is_closed is True:
-                pending_channels.append(v)
-            else:
-                open_channels.append(v)
+        # aggregates are maintained by the state, the liquid balance is refreshed in the
+        # background, so this doesn't touch the channels, the database or the node
+        stats = self.channel_manager.state.stats
         contract_address = self.channel_manager.channel_manager_contract.address
-        return {'balance_sum': self.channel_manager.get_locked_balance(),
-                'deposit_sum': deposit_sum,
-                'open_channels': len(open_channels),
-                'pending_channels': len(pending_channels),
-                'unique_senders': len(unique_senders),
-                'liquid_balance': self.channel_manager.get_liquid_balance(),
+        return {'balance_sum': stats.balance_sum,
+                'deposit_sum': stats.deposit_sum,
+                'open_channels': stats.open_channels,
+                'pending_channels': stats.pending_channels,
+                'unique_senders': stats.unique_senders,
+                'liquid_balance': self.channel_manager.get_cached_liquid_balance(),
                 'token_address': self.channel_manager.token_contract.address,
                 'contract_address': contract_address,
                 'receiver_address': self.channel_manager.receiver,
-                'manager_abi': self.channel_manager.channel_manager_contract.abi,
-                'token_abi': self.channel_manager.token_contract.abi,
                 'sync_block': self.channel_manager.blockchain.sync_start_block
                 }
 
 
+class ChannelManagementAbi(Resource):
+    """ABIs of the channel manager and token contracts. They don't change while the proxy runs,
+    so clients may cache the response."""
+    CACHE_MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, channel_manager: ChannelManager):
+        super(ChannelManagementAbi, self).__init__()
+        self.channel_manager = channel_manager
+
+    def get(self):
+        headers = {'Cache-Control': 'public, max-age=%d' % self.CACHE_MAX_AGE}
+        return {'manager_abi': self.channel_manager.channel_manager_contract.abi,
+                'token_abi': self.channel_manager.token_contract.abi}, 200, headers
+
+
 class ChannelManagementListChannels(Resource):
+    """List channels, optionally filtered by sender and status.
+
+    Channels are ordered by (sender, open block). If `limit` is given, the `Link` header of a
+    full page points to the next one, which starts after the last channel of the page.
+    """
+    # channel status => ChannelStates to filter for, None to not filter
+    STATUS_STATES = {
+        'open': (ChannelState.OPEN,),
+        'opened': (ChannelState.OPEN,),
+        'closed': (ChannelState.CLOSED, ChannelState.CLOSE_PENDING),
+        'all': None
+    }
+
     def __init__(self, channel_manager: ChannelManager):
         super(ChannelManagementListChannels, self).__init__()
         self.channel_manager = channel_manager
 
-    def get_all_channels(self, channel_status='all', condition=lambda k, v: True):
-        return [
-            {'sender_address': k[0],
-             'open_block': k[1],
-             'state': self.get_channel_status(v),
-             'deposit': v.deposit,
-             'balance': v.balance} for k, v in
-            self.channel_manager.channels.items()
-            if (condition(k, v))]
-
-    def get_channel_filter(self, channel_status='all'):
-        if channel_status == 'open' or channel_status == 'opened':
-            return lambda c: c.is_closed is False
-        elif channel_status == 'closed':
-            return lambda c: c.is_closed is True
-        else:
-            return lambda c: True
-
-    def get_channel_status(self, channel: Channel):
-        if channel.is_closed is True:
+    def get_channel_status(self, row: dict):
+        if is_closed(row) is True:
             return "closed"
-        elif channel.is_closed is False:
-            return "open"
         else:
-            return "unknown"
+            return "open"
+
+    def get_page_headers(self, rows: list, limit: int):
+        """Returns:
+            dict: `Link` header to the next page if the page is full, otherwise no headers
+        """
+        if limit is None or len(rows) < limit:
+            return {}
+        after = '%s,%d' % (rows[-1]['sender'], rows[-1]['open_block_number'])
+        args = dict(request.args, after=after)
+        return {'Link': '<%s?%s>; rel="next"' % (request.base_url, urlencode(args))}
 
     def get(self, sender_address=None):
         parser = reqparse.RequestParser()
         parser.add_argument('status', help='filter channels by a status', default='open',
-                            choices=('closed', 'opened', 'open', 'all'))
+                            choices=tuple(self.STATUS_STATES))
+        parser.add_argument('limit', type=int, help='max. number of channels returned')
+        parser.add_argument('after', help='return channels after this sender,open_block')
         args = parser.parse_args()
-        channel_filter = self.get_channel_filter(args['status'])
-
-        # if sender exists, return all open blocks
+        if args.limit is not None and args.limit <= 0:
+            return "Invalid limit", 400
+        after = None
+        if args.after is not None:
+            try:
+                after_sender, after_block = args.after.split(',')
+                after = to_checksum_address(after_sender), int(after_block)
+            except ValueError:
+                return "Invalid cursor, expected sender,open_block", 400
+
+        # if sender exists, return all its channels
         if sender_address is not None and is_address(sender_address):
-            ret = self.get_all_channels(
-                condition=lambda k, v:
-                (k[0] == to_checksum_address(sender_address) and
-                 channel_filter(v))
-            )
-
-        # if sender is not specified, return all open channels
+            sender_address = to_checksum_address(sender_address)
         else:
-            channels = self.get_all_channels(condition=lambda k, v:
-                                             channel_filter(v))
-            joined_channels = defaultdict(list)
-            for c in channels:
-                joined_channels[c['sender_address']].append(c['open_block'])
+            sender_address = None
+        rows = self.channel_manager.state.read_channels(
+            states=self.STATUS_STATES[args.status],
+            sender=sender_address,
+            after=after,
+            limit=args.limit
+        )
+        headers = self.get_page_headers(rows, args.limit)
+
+        if sender_address is not None:
             ret = [
-                {'sender_address': k,
-                 'blocks': v
-                 } for k, v in joined_channels.items()
+                {'sender_address': row['sender'],
+                 'open_block': row['open_block_number'],
+                 'state': self.get_channel_status(row),
+                 'deposit': row['deposit'],
+                 'balance': row['balance']} for row in rows
+            ]
+        # if sender is not specified, return blocks of the channels grouped by sender
+        else:
+            ret = [
+                {'sender_address': sender,
+                 'blocks': [row['open_block_number'] for row in sender_rows]
+                 } for sender, sender_rows in groupby(rows, itemgetter('sender'))
             ]
 
-        return ret, 200
+        return ret, 200, headers
 
     def delete(self, sender_address):
         parser = reqparse.RequestParser()
@@ -122,7 +160,7 @@ class ChannelManagementListChannels(Resource):
         channel = self.channel_manager.channels[sender_address, args.block]
         if channel.last_signature != args.signature:
             return "Invalid or outdated balance signature", 400
-        ret = sign_close(self.channel_manager.private_key, args.signature)
+        ret = sign_close(self.channel_manager.signer, args.signature)
         return ret, 200
 
 
@@ -134,10 +172,8 @@ class ChannelManagementChannelInfo(Resource):
     def get(self, sender_address, opening_block):
         if sender_address and is_address(sender_address):
             sender_address = to_checksum_address(sender_address)
-        try:
-            key = (sender_address, opening_block)
-            sender_channel = self.channel_manager.channels[key]
-        except KeyError:
+        sender_channel = self.channel_manager.get_channel(sender_address, opening_block)
+        if sender_channel is None:
             return "Sender address not found", 404
 
         return sender_channel.to_dict(), 200
@@ -186,3 +222,20 @@ class ChannelManagementAdmin(Resource):
     @auth.login_required
     def get(self):
         return "NOTHING TO SEE HERE, GO AWAY", 200
+
+
+class ChannelManagementAdminExport(Resource):
+    """Stream channels as newline delimited JSON with chunked transfer encoding."""
+
+    def __init__(self, channel_manager):
+        super(ChannelManagementAdminExport, self).__init__()
+        self.channel_manager = channel_manager
+
+    @auth.login_required
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('status', help='export confirmed or unconfirmed channels',
+                            default='confirmed', choices=('confirmed', 'unconfirmed'))
+        args = parser.parse_args()
+        lines = self.channel_manager.export_channels(confirmed=args.status == 'confirmed')
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
@@ -37,8 +37,12 @@ class Paywall(object):
     def access(self, resource, method, *args, **kwargs):
         if self.channel_manager.node_online() is False:
             return "Ethereum node is not responding", 502
-        if self.channel_manager.get_eth_balance() < constants.PROXY_BALANCE_LIMIT:
-            return "Channel manager ETH balance is below limit", 502
+        # refreshed in the background, so requests don't wait for the node. A balance below
+        # the limit is fetched again every few seconds, so a refilled receiver is served soon.
+        if self.channel_manager.get_cached_eth_balance() < constants.PROXY_BALANCE_LIMIT:
+            self.channel_manager.recheck_balances()
+            if self.channel_manager.eth_balance < constants.PROXY_BALANCE_LIMIT:
+                return "Channel manager ETH balance is below limit", 502
         try:
             data = RequestData(request.headers, request.cookies)
         except ValueError as e:
@@ -92,11 +96,12 @@ class Paywall(object):
         if not data.balance_signature:
             return True, headers
 
-        # try to get an existing channel
+        # try to get an existing channel. The signature is verified last, when the
+        # payment is registered or the channel state is sent back, so that stale and
+        # over-deposit proofs don't cost a signature recovery.
         try:
-            channel = self.channel_manager.verify_balance_proof(
-                data.sender_address, data.open_block_number,
-                data.balance, data.balance_signature)
+            channel = self.channel_manager.get_open_channel(
+                data.sender_address, data.open_block_number)
         except InsufficientConfirmations as e:
             log.debug('Refused payment: Insufficient confirmations (sender=%s, block=%d)' %
                       (data.sender_address, data.open_block_number))
@@ -107,49 +112,77 @@ class Paywall(object):
                       (data.sender_address, data.open_block_number))
             headers.update({header.NONEXISTING_CHANNEL: "1"})
             return True, headers
-        except InvalidBalanceAmount as e:
-            log.debug('Refused payment: Invalid balance amount: %s (sender=%s, block=%d)' %
-                      (str(e), data.sender_address, data.open_block_number))
-            headers.update({header.INVALID_PROOF: 1})
-            return True, headers
-        except InvalidBalanceProof as e:
-            log.debug('Refused payment: Invalid balance proof: %s (sender=%s, block=%d)' %
-                      (str(e), data.sender_address, data.open_block_number))
+
+        # stale and over-deposit proofs can't be registered, reject them before any recovery
+        if data.balance < channel.balance or data.balance > channel.deposit:
+            log.debug('Refused payment: Invalid balance %d (sender=%s, block=%d)' %
+                      (data.balance, data.sender_address, data.open_block_number))
             headers.update({header.INVALID_PROOF: 1})
             return True, headers
 
-        # set headers to reflect channel state
+        # headers to reflect channel state, only sent for proofs signed by the sender
         assert channel.sender is not None
         assert channel.balance >= 0
-        headers.update(
-            {
-                header.SENDER_ADDRESS: channel.sender,
-                header.SENDER_BALANCE: channel.balance
-            })
+        channel_headers = {
+            header.SENDER_ADDRESS: channel.sender,
+            header.SENDER_BALANCE: channel.balance
+        }
         if channel.last_signature is not None:
-            headers.update({header.BALANCE_SIGNATURE: channel.last_signature})
+            channel_headers[header.BALANCE_SIGNATURE] = channel.last_signature
 
         amount_sent = data.balance - channel.balance
 
-        if amount_sent != 0 and amount_sent != price:
-            headers[header.INVALID_AMOUNT] = 1
-            #  if difference is 0, it will be handled by channel manager
-            return True, headers
-
-        # set the headers to reflect actual state of a channel
         try:
-            self.channel_manager.register_payment(
-                channel.sender,
-                data.open_block_number,
-                data.balance,
-                data.balance_signature)
-        except (InvalidBalanceAmount, InvalidBalanceProof):
-            # balance sent to the proxy is less than in the previous proof
+            if amount_sent != 0 and amount_sent != price:
+                # the client needs the channel state to resync its balance, so the proof
+                # has to be authenticated
+                self.verify_sender(channel, data)
+                headers.update(channel_headers)
+                headers[header.INVALID_AMOUNT] = 1
+                return True, headers
+            #  if difference is 0, it will be handled by channel manager
+            try:
+                self.channel_manager.register_payment(
+                    channel.sender,
+                    data.open_block_number,
+                    data.balance,
+                    data.balance_signature)
+            except InvalidBalanceAmount as e:
+                # balance sent to the proxy is the same as in the previous proof
+                log.debug('Refused payment: Invalid balance amount: %s (sender=%s, block=%d)' %
+                          (str(e), data.sender_address, data.open_block_number))
+                self.verify_sender(channel, data)
+                headers.update(channel_headers)
+                return True, headers
+        except InvalidBalanceProof as e:
+            log.debug('Refused payment: Invalid balance proof: %s (sender=%s, block=%d)' %
+                      (str(e), data.sender_address, data.open_block_number))
+            headers.update({header.INVALID_PROOF: 1})
             return True, headers
+        headers.update(channel_headers)
 
         # all ok, return premium content
         return False, headers
 
+    def verify_sender(self, channel, data):
+        """Verify that the balance proof of a request has been signed by the channel's sender.
+
+        This is needed only before the channel state is sent back. The channel's last balance
+        proof is accepted without recovering the signer.
+
+        Raises:
+            InvalidBalanceProof: the balance proof isn't signed by the sender
+        """
+        if (data.balance == channel.balance and
+                data.balance_signature == channel.last_signature):
+            return
+        self.channel_manager.verify_signature(
+            channel.sender,
+            data.open_block_number,
+            data.balance,
+            data.balance_signature
+        )
+
     # when are these generated?
     def generate_headers(self, price: int):
         assert price > 0
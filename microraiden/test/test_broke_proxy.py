@@ -25,6 +25,8 @@ def test_cheating_client(
     )
     tx_hash = web3.eth.sendRawTransaction(tx)
     wait_for_transaction(tx_hash)
+    # the proxy caches the receiver balance and doesn't notice transactions sent elsewhere
+    doggo_proxy.channel_manager.update_balances()
     response = session.get(http_doggo_url)
     # proxy is expected to return 502 - it has no funds
     assert response.status_code == 502
@@ -36,6 +38,8 @@ def test_cheating_client(
     )
     tx_hash = web3.eth.sendRawTransaction(tx)
     wait_for_transaction(tx_hash)
+    # a low balance is fetched again at most every `balance_recheck_interval` seconds
+    doggo_proxy.channel_manager.balances_mtime = 0
     response = session.get(http_doggo_url)
     # now it should proceed normally
     assert response.status_code == 200
@@ -1,3 +1,4 @@
+import json
 import logging
 from itertools import count
 from typing import List
@@ -12,6 +13,7 @@ from microraiden.utils import get_logs, sign_balance_proof, privkey_to_addr
 from microraiden.exceptions import InvalidBalanceProof, NoOpenChannel, InvalidBalanceAmount
 from microraiden.test.fixtures.channel_manager import start_channel_manager
 from microraiden.channel_manager import ChannelManager
+from microraiden.channel_manager.verifier import SignatureVerifier
 from microraiden.test.config import (
     RECEIVER_ETH_ALLOWANCE,
     RECEIVER_TOKEN_ALLOWANCE
@@ -91,6 +93,11 @@ def test_channel_opening(
     assert (channel.sender, channel.block) not in channel_manager1.channels
     assert (channel.sender, channel.block) in channel_manager1.unconfirmed_channels
     channel_rec = channel_manager1.unconfirmed_channels[channel.sender, channel.block]
+    assert channel_manager1.get_channel(channel.sender, channel.block) is None
+    for confirmed in (False, None):
+        assert channel_manager1.get_channel(
+            channel.sender, channel.block, confirmed=confirmed
+        ) is channel_rec
     assert is_same_address(channel_rec.receiver, receiver_address)
     assert is_same_address(channel_rec.sender, channel.sender)
     assert channel_rec.mtime == channel_rec.ctime
@@ -100,6 +107,8 @@ def test_channel_opening(
     gevent.sleep(blockchain.poll_interval)
     assert (channel.sender, channel.block) in channel_manager1.channels
     channel_rec = channel_manager1.channels[channel.sender, channel.block]
+    assert channel_manager1.get_channel(channel.sender, channel.block) is channel_rec
+    assert channel_manager1.get_channel(channel.sender, channel.block, confirmed=False) is None
     assert is_same_address(channel_rec.receiver, receiver_address)
     assert is_same_address(channel_rec.sender, channel.sender)
     assert channel_rec.balance == 0
@@ -344,6 +353,71 @@ def test_payment(
     assert channel_rec.last_signature == sig3
 
 
+def test_payment_checks_before_signature(
+        channel_manager: ChannelManager,
+        confirmed_open_channel: Channel,
+        sender_address: str,
+        monkeypatch
+):
+    sig = encode_hex(confirmed_open_channel.create_transfer(2))
+    channel_manager.register_payment(sender_address, confirmed_open_channel.block, 2, sig)
+
+    def verify_signature(*args):
+        raise AssertionError('signature verified')
+    monkeypatch.setattr(channel_manager, 'verify_signature', verify_signature)
+
+    # replayed, stale and over-deposit balance proofs are rejected without recovering the signer
+    for balance, exception in ((2, InvalidBalanceAmount), (1, InvalidBalanceAmount),
+                               (11, InvalidBalanceProof)):
+        with pytest.raises(exception):
+            channel_manager.register_payment(
+                sender_address, confirmed_open_channel.block, balance, sig)
+    with pytest.raises(NoOpenChannel):
+        channel_manager.register_payment(
+            sender_address, confirmed_open_channel.block + 1, 4, sig)
+
+
+def test_concurrent_payments(
+        channel_manager: ChannelManager,
+        confirmed_open_channel: Channel,
+        sender_address: str,
+        monkeypatch
+):
+    channel_manager.verifier = SignatureVerifier(2)
+    block = confirmed_open_channel.block
+    sig = encode_hex(confirmed_open_channel.create_transfer(2))
+
+    # the same proof is registered once
+    payments = [
+        gevent.spawn(channel_manager.register_payment, sender_address, block, 2, sig)
+        for _ in range(2)
+    ]
+    gevent.joinall(payments)
+    assert [payment.value for payment in payments if payment.successful()] == [
+        (sender_address, 2)]
+    assert isinstance([payment.exception for payment in payments
+                       if not payment.successful()][0], InvalidBalanceAmount)
+
+    # a payment verified before an older one isn't reverted
+    verify_signature = channel_manager.verify_signature
+
+    def slow_verify_signature(sender, open_block_number, balance, signature):
+        verify_signature(sender, open_block_number, balance, signature)
+        gevent.sleep(0.1 if balance == 3 else 0)
+
+    monkeypatch.setattr(channel_manager, 'verify_signature', slow_verify_signature)
+    sigs = {balance: encode_hex(confirmed_open_channel.create_transfer(1)) for balance in (3, 4)}
+    older = gevent.spawn(channel_manager.register_payment, sender_address, block, 3, sigs[3])
+    gevent.sleep(0)
+    assert channel_manager.register_payment(sender_address, block, 4, sigs[4]) == (
+        sender_address, 2)
+    with pytest.raises(InvalidBalanceAmount):
+        older.get()
+    channel = channel_manager.channels[sender_address, block]
+    assert channel.balance == 4
+    assert channel.last_signature == sigs[4]
+
+
 def test_challenge(
         channel_manager: ChannelManager,
         confirmed_open_channel: Channel,
@@ -551,6 +625,68 @@ def test_balances(
     assert channel_manager.get_locked_balance() == initial_locked_balance
 
 
+def test_cached_balances(channel_manager: ChannelManager, monkeypatch):
+    eth_balance = channel_manager.get_eth_balance()
+    assert channel_manager.get_cached_eth_balance() == eth_balance
+    assert channel_manager.get_cached_liquid_balance() == channel_manager.get_liquid_balance()
+
+    # fresh balances are served from the cache
+    monkeypatch.setattr(channel_manager, 'get_eth_balance', lambda: eth_balance + 1)
+    assert channel_manager.get_cached_eth_balance() == eth_balance
+
+    # the background refresh can be triggered by events
+    channel_manager.refresh_balances()
+    gevent.sleep(0.1)
+    assert channel_manager.eth_balance == eth_balance + 1
+
+    # stale balances are fetched on access
+    monkeypatch.setattr(channel_manager, 'get_eth_balance', lambda: eth_balance + 2)
+    channel_manager.balances_mtime -= channel_manager.balance_max_age + 1
+    assert channel_manager.get_cached_eth_balance() == eth_balance + 2
+
+    # rechecks fetch the balances only every `balance_recheck_interval` seconds
+    monkeypatch.setattr(channel_manager, 'get_eth_balance', lambda: eth_balance + 3)
+    channel_manager.recheck_balances()
+    assert channel_manager.eth_balance == eth_balance + 2
+    channel_manager.balances_mtime -= channel_manager.balance_recheck_interval
+    channel_manager.recheck_balances()
+    assert channel_manager.eth_balance == eth_balance + 3
+
+    # errors don't stop the background refresh
+    def get_eth_balance_failing():
+        raise ValueError('RPC error')
+
+    monkeypatch.setattr(channel_manager, 'get_eth_balance', get_eth_balance_failing)
+    channel_manager.refresh_balances()
+    gevent.sleep(0.1)
+    assert not channel_manager.balance_refresher.dead
+    monkeypatch.setattr(channel_manager, 'get_eth_balance', lambda: eth_balance + 4)
+    channel_manager.refresh_balances()
+    gevent.sleep(0.1)
+    assert channel_manager.eth_balance == eth_balance + 4
+
+
+def test_export(
+        channel_manager: ChannelManager,
+        confirmed_open_channel: Channel,
+        sender_address: str
+):
+    sig = encode_hex(confirmed_open_channel.create_transfer(5))
+    channel_manager.register_payment(sender_address, confirmed_open_channel.block, 5, sig)
+
+    lines = list(channel_manager.export_channels(batch_size=1))
+    assert len(lines) == len(channel_manager.channels)
+    rows = [json.loads(line) for line in lines]
+    row = next(row for row in rows if row['sender'] == sender_address)
+    assert row['open_block_number'] == confirmed_open_channel.block
+    assert row['balance'] == 5
+    assert row['last_signature'] == sig
+    assert list(channel_manager.export_channels(confirmed=False)) == []
+
+    channels = channel_manager.channels_to_dict()
+    assert channels[sender_address][confirmed_open_channel.block]['balance'] == 5
+
+
 def test_different_receivers(
         web3: Web3,
         make_account,
@@ -1,14 +1,29 @@
+import os
+import time
+import sqlite3
+
+import gevent
 import pytest
+from eth_utils import to_checksum_address
 from microraiden.channel_manager import (
     Channel,
     ChannelState,
     ChannelManagerState
 )
+from microraiden.channel_manager.storage import (
+    BalanceLog,
+    ChannelStorage,
+    MemoryStorage,
+    encode_uint,
+    decode_uint
+)
+from microraiden.channel_manager.migrate import DB_CREATION_SQL_V1, migrate_state
+from microraiden.exceptions import BalanceLogFull, StateFileVersionMismatch
 
 
 CONTRACT_ADDRESS = '0xaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'
 RECEIVER_ADDRESS = '0xbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb'
-SENDER_ADDRESS = '0xcccccccccccccccccccccccccccccccccccccccc'
+SENDER_ADDRESS = '0xCcCCccccCCCCcCCCCCCcCcCccCcCCCcCcccccccC'
 NETWORK_ID = 123
 BLOCK_HASH = '0xaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'
 SIG = '0x' + 'bb' * 130
@@ -26,6 +41,22 @@ def state(tmpdir):
     return state
 
 
+def add_channel(state, open_block_number=123, sender=SENDER_ADDRESS, deposit=100,
+                confirmed=True, topups: dict = None):
+    """Add an open channel to the state.
+
+    Returns:
+        Channel: the added channel
+    """
+    channel = Channel(RECEIVER_ADDRESS, sender, deposit, open_block_number)
+    channel.state = ChannelState.OPEN
+    channel.confirmed = confirmed
+    if topups is not None:
+        channel.unconfirmed_topups = dict(topups)
+    state.add_channel(channel)
+    return channel
+
+
 def test_creation(state):
     assert state.receiver == RECEIVER_ADDRESS
     assert state.contract_address == CONTRACT_ADDRESS
@@ -104,3 +135,577 @@ def test_updating_channel(state):
     assert channel_retrieved.is_closed is True
     assert channel_retrieved.ctime == channel.ctime
     assert channel_retrieved.mtime == channel.mtime
+
+
+def test_loading_channels(state):
+    channel = Channel(RECEIVER_ADDRESS, SENDER_ADDRESS, 100, 123)
+    channel.balance = 50
+    channel.state = ChannelState.OPEN
+    channel.confirmed = True
+    channel.unconfirmed_topups['0x01'] = 10
+    state.add_channel(channel)
+    unconfirmed_channel = Channel(RECEIVER_ADDRESS, SENDER_ADDRESS, 20, 124)
+    unconfirmed_channel.state = ChannelState.OPEN
+    state.add_channel(unconfirmed_channel)
+    assert state.n_channels == 2
+    assert set(state.channels) == {(SENDER_ADDRESS, 123)}
+    assert set(state.unconfirmed_channels) == {(SENDER_ADDRESS, 124)}
+
+    state_loaded = ChannelManagerState.load(state.filename, check_permissions=False)
+    assert state_loaded.n_channels == 2
+    assert state_loaded.n_open_channels == 2
+    channel_retrieved = state_loaded.channels[SENDER_ADDRESS, 123]
+    assert channel_retrieved.balance == 50
+    assert channel_retrieved.unconfirmed_topups == {'0x01': 10}
+    assert (SENDER_ADDRESS, 124) in state_loaded.unconfirmed_channels
+
+    state_loaded.del_unconfirmed_channels()
+    assert not state_loaded.channel_exists(SENDER_ADDRESS, 124)
+    state_loaded.del_channel(SENDER_ADDRESS, 123)
+    assert state_loaded.get_channel(SENDER_ADDRESS, 123) is None
+    assert state_loaded.n_channels == 0
+    assert ChannelManagerState.load(state.filename, check_permissions=False).n_channels == 0
+
+
+def test_batched_payments(tmpdir):
+    db = tmpdir.join("state.db")
+    state = ChannelManagerState(db.strpath, payment_flush_size=3)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    assert state.batch_payments is True
+    channels = [add_channel(state, open_block_number) for open_block_number in (123, 124)]
+
+    channels[0].balance = 10
+    channels[0].last_signature = SIG
+    state.set_channel_balance(channels[0])
+    channels[0].balance = 20
+    state.set_channel_balance(channels[0])
+    assert state.n_pending_payments == 2
+    assert state.get_durable_balance(SENDER_ADDRESS, 123) == 0
+    state_loaded = ChannelManagerState.load(state.filename, check_permissions=False)
+    assert state_loaded.get_channel(SENDER_ADDRESS, 123).balance == 0
+
+    # third payment fills the queue
+    channels[1].balance = 5
+    state.set_channel_balance(channels[1])
+    assert state.n_pending_payments == 0
+    assert state.get_durable_balance(SENDER_ADDRESS, 123) == 20
+    assert state.get_durable_balance(SENDER_ADDRESS, 124) == 5
+
+    channels[0].balance = 30
+    state.set_channel_balance(channels[0])
+    channels[1].balance = 8
+    state.set_channel_balance(channels[1])
+    assert state.n_pending_payments == 2
+    assert state.get_durable_balance(SENDER_ADDRESS, 124) == 5
+    state.flush_payments()
+    assert state.n_pending_payments == 0
+    assert state.get_durable_balance(SENDER_ADDRESS, 123) == 30
+    assert state.get_durable_balance(SENDER_ADDRESS, 124) == 8
+    state_loaded = ChannelManagerState.load(state.filename, check_permissions=False)
+    assert state_loaded.get_channel(SENDER_ADDRESS, 123).balance == 30
+    assert state_loaded.get_channel(SENDER_ADDRESS, 123).last_signature == SIG
+    assert state_loaded.get_channel(SENDER_ADDRESS, 124).balance == 8
+
+
+def test_failed_payment_flush(tmpdir):
+    state = ChannelManagerState(tmpdir.join("state.db").strpath, payment_flush_size=10)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    channels = [add_channel(state, open_block_number) for open_block_number in (123, 124)]
+    for channel in channels + channels[:1]:
+        channel.balance += 10
+        channel.last_signature = SIG
+        state.set_channel_balance(channel)
+    assert state.n_pending_payments == 3
+
+    put_payments = state.storage.put_payments
+
+    def failing_put_payments(channels):
+        raise sqlite3.OperationalError('database is locked')
+
+    # payments stay queued until they have been committed
+    state.storage.put_payments = failing_put_payments
+    with pytest.raises(sqlite3.OperationalError):
+        state.flush_payments()
+    assert state.n_pending_payments == 3
+    state.storage.put_payments = put_payments
+
+    # writing the whole channel drops its queued payments
+    state.set_channel(channels[0])
+    assert state.n_pending_payments == 1
+    state.del_channel(SENDER_ADDRESS, 123)
+    assert state.n_pending_payments == 1
+    state.flush_payments()
+    assert state.n_pending_payments == 0
+    assert state.get_durable_balance(SENDER_ADDRESS, 124) == 10
+
+
+def test_synchronous_payments(state):
+    assert state.batch_payments is False
+    channel = add_channel(state)
+    channel.balance = 10
+    channel.last_signature = SIG
+    state.set_channel_balance(channel)
+    assert state.n_pending_payments == 0
+    assert state.get_durable_balance(SENDER_ADDRESS, 123) == 10
+    state_loaded = ChannelManagerState.load(state.filename, check_permissions=False)
+    assert state_loaded.get_channel(SENDER_ADDRESS, 123).balance == 10
+
+
+def test_column_level_updates(state):
+    channel = Channel(RECEIVER_ADDRESS, SENDER_ADDRESS, 100, 123)
+    channel.state = ChannelState.OPEN
+    channel.unconfirmed_topups['0x01'] = 10
+    state.add_channel(channel)
+    rowid = state.storage.get_channel_rowid(SENDER_ADDRESS, 123)
+
+    statements = []
+    state.storage.conn.set_trace_callback(statements.append)
+    channel.balance = 10
+    channel.last_signature = SIG
+    channel.mtime += 1
+    state.set_channel_balance(channel)
+    updates = [sql for sql in statements if sql.startswith(('UPDATE', 'INSERT', 'DELETE'))]
+    assert len(updates) == 1
+    assert updates[0].startswith("UPDATE `channels` SET `balance` = x'%s', `last_signature` = x'" %
+                                 encode_uint(10).hex())
+    assert '`deposit`' not in updates[0] and '`state`' not in updates[0]
+
+    # nothing changed, nothing written
+    del statements[:]
+    state.set_channel(channel)
+    assert not [sql for sql in statements if sql.startswith(('UPDATE', 'INSERT', 'DELETE'))]
+
+    # confirming the channel keeps its row
+    confirmed_channel = Channel(RECEIVER_ADDRESS, SENDER_ADDRESS, 100, 123)
+    confirmed_channel.state = ChannelState.OPEN
+    confirmed_channel.confirmed = True
+    state.set_channel(confirmed_channel)
+    state.storage.conn.set_trace_callback(None)
+    assert state.storage.get_channel_rowid(SENDER_ADDRESS, 123) == rowid
+    state_loaded = ChannelManagerState.load(state.filename, check_permissions=False)
+    channel_retrieved = state_loaded.get_channel(SENDER_ADDRESS, 123)
+    assert channel_retrieved.confirmed
+    assert channel_retrieved.balance == 0
+    assert channel_retrieved.unconfirmed_topups == {}
+    assert channel_retrieved.ctime == confirmed_channel.ctime
+
+
+def test_cached_sync_state(state):
+    statements = []
+    state.storage.conn.set_trace_callback(statements.append)
+    state.update_sync_state(
+        confirmed_head_number=1,
+        confirmed_head_hash=BLOCK_HASH,
+        unconfirmed_head_number=2,
+        unconfirmed_head_hash=BLOCK_HASH
+    )
+    assert len([sql for sql in statements if sql.startswith('UPDATE')]) == 1
+    del statements[:]
+    assert state.confirmed_head_number == 1
+    assert state.unconfirmed_head_number == 2
+    assert state.receiver == RECEIVER_ADDRESS
+    assert state.network_id == NETWORK_ID
+    assert statements == []
+    state.storage.conn.set_trace_callback(None)
+
+    # changes by another connection are only visible after a reload
+    state_loaded = ChannelManagerState.load(state.filename, check_permissions=False)
+    state_loaded.update_sync_state(confirmed_head_number=3)
+    assert state.confirmed_head_number == 1
+    state.reload()
+    assert state.confirmed_head_number == 3
+    assert state.unconfirmed_head_hash == BLOCK_HASH
+
+
+def test_wal_reader(tmpdir):
+    db = tmpdir.join("state.db")
+    state = ChannelManagerState(db.strpath, wal=True, synchronous='normal')
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    journal_mode = state.storage.conn.execute('PRAGMA journal_mode;').fetchone()
+    assert journal_mode['journal_mode'] == 'wal'
+    assert state.storage.reader is not state.storage.conn
+    channel = add_channel(state)
+    assert [row['deposit'] for row in state.read_channels()] == [100]
+    assert state.read_channels(confirmed=False) == []
+
+    # a snapshot doesn't see commits made while it is open
+    with state.storage.snapshot() as c:
+        c.execute('SELECT `balance` FROM `channels`')
+        assert decode_uint(c.fetchone()['balance']) == 0
+        channel.balance = 10
+        state.set_channel_balance(channel)
+        c.execute('SELECT `balance` FROM `channels`')
+        assert decode_uint(c.fetchone()['balance']) == 0
+    assert state.read_channels()[0]['balance'] == 10
+
+    # the reader connection is read-only
+    with pytest.raises(Exception):
+        state.storage.reader.execute('DELETE FROM `channels`')
+    state.close()
+
+
+def test_threaded_io(tmpdir):
+    db = tmpdir.join("state.db")
+    state = ChannelManagerState(db.strpath, wal=True, threaded=True, payment_flush_size=2)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    state.update_sync_state(confirmed_head_number=1, unconfirmed_head_number=2)
+    channel = add_channel(state, topups={'0x01': 5})
+    channel.balance = 10
+    channel.last_signature = SIG
+    state.set_channel_balance(channel)
+    assert state.read_channels()[0]['balance'] == 0
+    state.set_channel_balance(channel)
+    assert state.read_channels()[0]['balance'] == 10
+    state.set_channel_state(SENDER_ADDRESS, 123, ChannelState.CLOSE_PENDING)
+    state.close()
+    assert state.closed
+    # closing again, e.g. by a second ChannelManager.stop(), does nothing
+    state.close()
+
+    state_loaded = ChannelManagerState.load(state.filename, check_permissions=False,
+                                            threaded=True)
+    channel_loaded = state_loaded.get_channel(SENDER_ADDRESS, 123)
+    assert channel_loaded.balance == 10
+    assert channel_loaded.state == ChannelState.CLOSE_PENDING
+    assert channel_loaded.unconfirmed_topups == {'0x01': 5}
+    assert state_loaded.confirmed_head_number == 1
+    state_loaded.del_channel(SENDER_ADDRESS, 123)
+    assert state_loaded.read_channels() == []
+    state_loaded.close()
+
+
+def test_threaded_update_during_insert(tmpdir):
+    """Payments and updates of a channel while its insert is running on the writer thread."""
+    state = ChannelManagerState(tmpdir.join("state.db").strpath, threaded=True)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    storage = state.storage
+    insert_channel = storage._insert_channel
+
+    def slow_insert_channel(*args):
+        time.sleep(0.1)
+        return insert_channel(*args)
+
+    storage._insert_channel = slow_insert_channel
+    channel = Channel(RECEIVER_ADDRESS, SENDER_ADDRESS, 100, 123)
+    channel.state = ChannelState.OPEN
+    channel.confirmed = True
+    adding = gevent.spawn(storage.put_channel, channel)
+    gevent.sleep(0)
+    paid = Channel.from_dict(channel.to_dict())
+    paid.balance = 10
+    paid.last_signature = SIG
+    storage.put_payments([paid])
+    paid.unconfirmed_topups = {'0x01': 5}
+    storage.put_channel(paid)
+    adding.get()
+
+    rows = storage.read_channels()
+    assert len(rows) == 1
+    assert rows[0]['balance'] == 10
+    rowid = storage.get_channel_rowid(SENDER_ADDRESS, 123)
+    assert storage._stored[SENDER_ADDRESS, 123][0] == rowid
+    assert storage.get_unconfirmed_topups(rowid) == {'0x01': 5}
+    state.close()
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'memory', 'log'])
+def test_storage_backends(tmpdir, backend):
+    path = tmpdir.join("state").strpath
+    state = ChannelManagerState(path, backend=backend)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    state.update_sync_state(confirmed_head_number=1, confirmed_head_hash=BLOCK_HASH)
+    for open_block_number in (123, 124):
+        add_channel(state, open_block_number, confirmed=open_block_number == 123,
+                    topups={'0x01': 5})
+    channel = state.get_channel(SENDER_ADDRESS, 123)
+    channel.balance = 10
+    channel.last_signature = SIG
+    state.set_channel_balance(channel)
+    assert state.get_durable_balance(SENDER_ADDRESS, 123) == 10
+    assert [row['open_block_number'] for row in state.read_channels()] == [123]
+    state.set_channel_state(SENDER_ADDRESS, 123, ChannelState.CLOSE_PENDING)
+    state.del_unconfirmed_channels()
+    state.close()
+    if backend == 'memory':
+        return
+
+    state_loaded = ChannelManagerState.load(path, check_permissions=False, backend=backend)
+    assert state_loaded.receiver == RECEIVER_ADDRESS
+    assert state_loaded.confirmed_head_number == 1
+    assert state_loaded.confirmed_head_hash == BLOCK_HASH
+    assert state_loaded.n_channels == 1
+    channel_loaded = state_loaded.get_channel(SENDER_ADDRESS, 123)
+    assert channel_loaded.balance == 10
+    assert channel_loaded.last_signature == SIG
+    assert channel_loaded.state == ChannelState.CLOSE_PENDING
+    assert channel_loaded.unconfirmed_topups == {'0x01': 5}
+    state_loaded.del_channel(SENDER_ADDRESS, 123)
+    state_loaded.close()
+    assert ChannelManagerState.load(path, check_permissions=False, backend=backend).n_channels == 0
+
+
+def test_incomplete_storage_backend():
+    class IncompleteStorage(MemoryStorage):
+        read_channels = ChannelStorage.read_channels
+
+    # a backend fails when it is created, not when a missing method is called
+    with pytest.raises(TypeError):
+        IncompleteStorage()
+
+
+def test_append_log_recovery(tmpdir):
+    path = tmpdir.join("state.log").strpath
+    state = ChannelManagerState(path, backend='log', compact_ratio=20)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    channel = add_channel(state)
+    for balance in range(1, 11):
+        channel.balance = balance
+        state.set_channel_balance(channel)
+    state.close()
+    assert state.storage.n_records == 12
+
+    # a record that has been cut off by a crash is ignored
+    with open(path, 'a') as f:
+        f.write('["payment", ["%s", 123], ["11"' % SENDER_ADDRESS)
+    state_loaded = ChannelManagerState.load(path, check_permissions=False, backend='log',
+                                            compact_ratio=20)
+    channel = state_loaded.get_channel(SENDER_ADDRESS, 123)
+    assert channel.balance == 10
+    channel.balance = 11
+    state_loaded.set_channel_balance(channel)
+    state_loaded.close()
+
+    # the log is compacted once it has more than 2 records per channel
+    state_loaded = ChannelManagerState.load(path, check_permissions=False, backend='log',
+                                            compact_ratio=2)
+    assert state_loaded.get_channel(SENDER_ADDRESS, 123).balance == 11
+    assert state_loaded.storage.n_records == 3
+    with open(path) as f:
+        assert len(f.readlines()) == 3
+    state_loaded.close()
+
+
+def test_balance_log(tmpdir):
+    path = tmpdir.join("state.db").strpath
+    signature = '0x' + 'dd' * 65
+    state = ChannelManagerState(path, balance_log=True, balance_log_capacity=4)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    channel = add_channel(state, deposit=2 ** 200)
+
+    def set_balance(balance):
+        channel.balance = balance
+        channel.last_signature = signature
+        state.set_channel_balance(channel)
+
+    for balance in (1, 2, 3):
+        set_balance(balance)
+    # payments are logged, but not written to the `channels` table yet
+    assert len(state.storage.balance_log) == 3
+    assert state.get_durable_balance(SENDER_ADDRESS, 123) == 3
+
+    def table_balance():
+        row = state.storage.conn.execute('SELECT `balance` FROM `channels`').fetchone()
+        return decode_uint(row['balance'])
+
+    assert table_balance() == 0
+    # reads include the logged payments
+    assert state.read_channels()[0]['balance'] == 3
+    assert state.read_channels()[0]['last_signature'] == signature
+    # a full log is compacted
+    set_balance(4)
+    set_balance(2 ** 199)
+    assert len(state.storage.balance_log) == 1
+    assert table_balance() == 4
+    assert state.read_channels()[0]['balance'] == 2 ** 199
+    state.set_channel_state(SENDER_ADDRESS, 123, ChannelState.CLOSE_PENDING)
+
+    # crash: the newest logged payment is replayed when the state is loaded
+    state_loaded = ChannelManagerState.load(path, check_permissions=False, balance_log=True)
+    channel_loaded = state_loaded.get_channel(SENDER_ADDRESS, 123)
+    assert channel_loaded.balance == 2 ** 199
+    assert channel_loaded.last_signature == signature
+    assert channel_loaded.state == ChannelState.CLOSE_PENDING
+    assert len(state_loaded.storage.balance_log) == 0
+    state_loaded.close()
+
+
+def test_balance_log_without_flag(tmpdir):
+    path = tmpdir.join("state.db").strpath
+    signature = '0x' + 'dd' * 65
+    state = ChannelManagerState(path, balance_log=True)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    channel = add_channel(state)
+    channel.balance = 50
+    channel.last_signature = signature
+    state.set_channel_balance(channel)
+
+    # crash: the log is merged even if the state is loaded without the balance log
+    state_loaded = ChannelManagerState.load(path, check_permissions=False)
+    channel_loaded = state_loaded.get_channel(SENDER_ADDRESS, 123)
+    assert channel_loaded.balance == 50
+    assert channel_loaded.last_signature == signature
+    assert not os.path.exists(path + '.balances')
+    channel_loaded.balance = 70
+    state_loaded.set_channel_balance(channel_loaded)
+    state_loaded.close()
+
+    # ...and isn't replayed over later payments
+    state_loaded = ChannelManagerState.load(path, check_permissions=False, balance_log=True)
+    assert state_loaded.get_channel(SENDER_ADDRESS, 123).balance == 70
+    state_loaded.close()
+
+
+def test_full_balance_log(tmpdir):
+    path = tmpdir.join("state.balances").strpath
+    signature = '0x' + 'dd' * 65
+    balance_log = BalanceLog(path, 2)
+    for balance in (1, 2):
+        balance_log.append((SENDER_ADDRESS, 123), (balance, signature, 1.0))
+    assert balance_log.is_full
+    with pytest.raises(BalanceLogFull):
+        balance_log.append((SENDER_ADDRESS, 123), (3, signature, 1.0))
+    balance_log.close()
+
+    # a log opened with a smaller capacity keeps all records
+    balance_log = BalanceLog(path, 1)
+    assert balance_log.capacity == 2
+    assert balance_log.replay() == {(SENDER_ADDRESS, 123): (2, signature, 1.0)}
+    balance_log.close()
+
+
+def test_compact_channel():
+    channel = Channel(RECEIVER_ADDRESS, SENDER_ADDRESS, 100, 123)
+    assert not hasattr(channel, '__dict__')
+    assert channel.last_signature is None
+    channel.last_signature = SIG
+    assert channel.last_signature == SIG
+    assert channel.unconfirmed_deposit == 100
+    assert channel.unconfirmed_topups_items() == ()
+    channel.unconfirmed_topups['0x01'] = 5
+    assert channel.unconfirmed_deposit == 105
+
+    channel_loaded = Channel.from_dict(channel.to_dict())
+    assert channel_loaded.to_dict() == channel.to_dict()
+    assert channel_loaded.receiver is channel.receiver
+
+
+def test_migrate_v1(tmpdir):
+    path = tmpdir.join("state.db").strpath
+    conn = sqlite3.connect(path)
+    conn.executescript(DB_CREATION_SQL_V1)
+    conn.execute('INSERT INTO `metadata` VALUES (?, ?, ?)',
+                 (NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS))
+    conn.execute('INSERT INTO `syncstate` VALUES (?, ?, ?, ?)', (1, BLOCK_HASH, 2, BLOCK_HASH))
+    conn.executemany(
+        'INSERT INTO `channels` VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [(SENDER_ADDRESS.lower(), block, str(2 ** 255), block, SIG, -1, 1, 1,
+          ChannelState.OPEN.value, block % 2) for block in range(1, 6)]
+    )
+    conn.execute('INSERT INTO `topups` VALUES (?, ?, ?)', (3, BLOCK_HASH, '5'))
+    conn.commit()
+    conn.close()
+
+    with pytest.raises(StateFileVersionMismatch):
+        ChannelManagerState.load(path, check_permissions=False)
+    assert migrate_state(path, batch_size=2) == 5
+    assert os.path.isfile(path + '.v1')
+    # migrating again is a no-op
+    assert migrate_state(path) == 0
+
+    state = ChannelManagerState.load(path, check_permissions=False)
+    assert state.receiver == RECEIVER_ADDRESS
+    assert state.unconfirmed_head_number == 2
+    assert state.n_channels == 5
+    assert len(state.channels) == 3
+    channel = state.get_channel(SENDER_ADDRESS, 3)
+    assert channel.deposit == 2 ** 255
+    assert channel.balance == 3
+    assert channel.last_signature == SIG
+    assert channel.confirmed
+    assert channel.unconfirmed_topups == {BLOCK_HASH: 5}
+    state.close()
+
+
+def test_channel_stats(state):
+    other_sender = RECEIVER_ADDRESS
+    channel = add_channel(state, 1)
+    add_channel(state, 2, deposit=10)
+    add_channel(state, 3, sender=other_sender, deposit=5)
+    add_channel(state, 4, sender=other_sender, deposit=1000, confirmed=False)
+    channel.balance = 30
+    state.set_channel_balance(channel)
+    state.set_channel_state(other_sender, 3, ChannelState.CLOSE_PENDING)
+
+    def check(state, expected):
+        stats = state.stats
+        assert (stats.deposit_sum, stats.balance_sum, stats.open_channels,
+                stats.pending_channels, stats.unique_senders) == expected
+
+    check(state, (115, 30, 2, 1, 2))
+    check(ChannelManagerState.load(state.filename, check_permissions=False), (115, 30, 2, 1, 2))
+    state.del_channel(other_sender, 3)
+    check(state, (110, 30, 2, 0, 1))
+    state.del_channel(SENDER_ADDRESS, 1)
+    state.del_channel(SENDER_ADDRESS, 2)
+    check(state, (0, 0, 0, 0, 0))
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'memory'])
+def test_read_channels_page(tmpdir, backend):
+    state = ChannelManagerState(tmpdir.join("state").strpath, backend=backend)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    senders = sorted((to_checksum_address('0x%040x' % (i * 11)) for i in range(1, 4)),
+                     key=lambda sender: sender.lower())
+    for sender in senders:
+        for open_block_number in (1, 2, 3):
+            channel = Channel(RECEIVER_ADDRESS, sender, 100, open_block_number)
+            channel.state = ChannelState.OPEN if open_block_number < 3 else ChannelState.CLOSED
+            channel.confirmed = True
+            state.add_channel(channel)
+
+    def keys(**kwargs):
+        return [(row['sender'], row['open_block_number'])
+                for row in state.read_channels(**kwargs)]
+
+    all_keys = [(sender, block) for sender in senders for block in (1, 2, 3)]
+    assert keys() == all_keys
+    assert keys(limit=4) == all_keys[:4]
+    assert keys(after=all_keys[3], limit=4) == all_keys[4:8]
+    assert keys(after=all_keys[-1]) == []
+    assert keys(states=(ChannelState.CLOSED,)) == [(sender, 3) for sender in senders]
+    assert keys(sender=senders[1], states=(ChannelState.OPEN,)) == [
+        (senders[1], 1), (senders[1], 2)]
+    assert keys(confirmed=False) == []
+
+    if backend == 'sqlite':
+        # sender lookups and status filters don't scan the table
+        for sql in ('SELECT * FROM `channels` WHERE `sender` = ?',
+                    'SELECT * FROM `channels` WHERE `state` IN (?)'):
+            plan = state.storage.conn.execute('EXPLAIN QUERY PLAN ' + sql, [0]).fetchall()
+            assert all(row['detail'].startswith('SEARCH') for row in plan)
+    state.close()
+
+
+@pytest.mark.parametrize('backend, storage_kwargs', [
+    ('sqlite', {}),
+    ('sqlite', {'balance_log': True}),
+    ('memory', {})
+])
+def test_iter_rows(tmpdir, backend, storage_kwargs):
+    state = ChannelManagerState(tmpdir.join("state").strpath, backend=backend,
+                                payment_flush_size=100, **storage_kwargs)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    for open_block_number in range(1, 6):
+        channel = add_channel(state, open_block_number)
+    channel.balance = 10
+    channel.last_signature = SIG
+    state.set_channel_balance(channel)
+
+    rows = list(state.iter_rows(batch_size=2))
+    assert [row['open_block_number'] for row in rows] == [1, 2, 3, 4, 5]
+    # queued and logged payments are exported
+    assert rows[-1]['balance'] == 10
+    assert rows[-1]['last_signature'] == SIG
+    assert state.get_durable_balance(SENDER_ADDRESS, 5) == 10
+    assert list(state.iter_rows(confirmed=False)) == []
+    state.close()
@@ -1,8 +1,18 @@
-from eth_utils import denoms
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+from eth_utils import denoms, decode_hex, event_signature_to_log_topic, encode_hex, keccak
 from web3 import Web3
+from web3.contract import Contract
 from web3.utils.empty import empty as web3_empty
 
-from microraiden.utils import create_signed_transaction, wait_for_transaction
+from microraiden.utils import (
+    create_signed_transaction,
+    wait_for_transaction,
+    TransactionBuilder,
+    get_event_logs,
+    address_to_topic
+)
+import microraiden.utils.contract
 
 
 def test_create_signed_transaction():
@@ -52,6 +62,90 @@ def test_create_signed_transaction():
     assert tx == tx_expected
 
 
+def test_transaction_builder():
+    class Web3Mock:
+        class VersionMock:
+            network = 1
+
+        class EthMock:
+            transaction_counts = 0
+            sent = 0
+            errors = []
+
+            def getTransactionCount(self, *args, **kwargs):
+                self.transaction_counts += 1
+                return 9
+
+            def sendRawTransaction(self, raw_tx):
+                self.sent += 1
+                if self.errors:
+                    raise self.errors.pop(0)
+                return raw_tx
+
+        version = VersionMock()
+        eth = EthMock()
+
+    def transfer_abi(*types):
+        return {
+            'type': 'function',
+            'name': 'transfer',
+            'inputs': [{'name': '', 'type': type_} for type_ in types]
+        }
+
+    class ContractMock:
+        address = '0x3535353535353535353535353535353535353535'
+        abi = [transfer_abi('address', 'uint256'), transfer_abi('address', 'uint256', 'bytes')]
+        web3 = Web3Mock()
+
+    contract = ContractMock()
+    transactions = TransactionBuilder('0x' + '46' * 32, contract)
+    address = '0x' + '12' * 20
+    assert transactions.encode('transfer', [address, 1])[:4] == decode_hex('0xa9059cbb')
+    assert transactions.encode('transfer', [address, 1, b''])[:4] == decode_hex('0xbe45fd62')
+
+    raw_txs = [transactions.create('transfer', [address, 1]) for _ in range(3)]
+    assert len(set(raw_txs)) == 3
+    assert transactions.nonces.nonce == 12
+    assert contract.web3.eth.transaction_counts == 1
+
+    eth = contract.web3.eth
+    # a used nonce is resynced and the transaction is sent once more
+    eth.errors = [ValueError({'code': -32000, 'message': 'nonce too low'})]
+    assert transactions.transact('transfer', [address, 1]) == raw_txs[0]
+    assert eth.sent == 2
+    assert eth.transaction_counts == 2
+    assert transactions.nonces.nonce == 10
+
+    # a transaction the node already has is not sent again
+    eth.errors = [ValueError('known transaction: 12')]
+    assert transactions.transact('transfer', [address, 1]) == encode_hex(
+        keccak(decode_hex(raw_txs[1])))
+    assert eth.sent == 3
+    assert transactions.nonces.nonce == 11
+
+    # a used nonce is retried only once
+    eth.errors = [ValueError('replacement transaction underpriced'), ValueError('nonce too low')]
+    with pytest.raises(ValueError):
+        transactions.transact('transfer', [address, 1])
+    assert eth.sent == 5
+    assert transactions.nonces.nonce is None
+
+    # other errors are not retried
+    eth.errors = [ValueError('insufficient funds for gas * price + value')]
+    with pytest.raises(ValueError):
+        transactions.transact('transfer', [address, 1])
+    assert eth.sent == 6
+    assert transactions.nonces.nonce is None
+
+    # a created transaction is only retried with a way to create it again
+    eth.errors = [ValueError('nonce too low')]
+    with pytest.raises(ValueError):
+        transactions.send(transactions.create('transfer', [address, 1]))
+    assert eth.sent == 7
+    assert transactions.transact('transfer', [address, 1]) == raw_txs[0]
+    assert eth.transaction_counts == 6
+
+
 def test_wait_for_transaction(
         web3: Web3,
         patched_contract,
@@ -66,3 +160,33 @@ def test_wait_for_transaction(
     tx_hash = web3.eth.sendRawTransaction(tx)
     tx_receipt = wait_for_transaction(web3, tx_hash)
     assert tx_receipt
+
+
+def test_get_event_logs(channel_manager_contract: Contract, monkeypatch: MonkeyPatch):
+    requests = []
+
+    def get_logs_raw(contract: Contract, filter_params):
+        requests.append(filter_params)
+        return []
+
+    monkeypatch.setattr(microraiden.utils.contract, '_get_logs_raw', get_logs_raw)
+    receiver_topic = address_to_topic('0x' + 'Ab' * 20)
+    assert receiver_topic == '0x' + '00' * 12 + 'ab' * 20
+    logs = get_event_logs(
+        channel_manager_contract,
+        ['ChannelCreated', 'ChannelSettled'],
+        from_block=10,
+        to_block=20,
+        topics=[None, receiver_topic]
+    )
+    assert logs == []
+    assert len(requests) == 1
+    assert requests[0]['fromBlock'] == 10
+    assert requests[0]['toBlock'] == 20
+    assert sorted(requests[0]['topics'][0]) == sorted([
+        encode_hex(event_signature_to_log_topic('ChannelCreated(address,address,uint192)')),
+        encode_hex(event_signature_to_log_topic(
+            'ChannelSettled(address,address,uint32,uint192,uint192)'
+        ))
+    ])
+    assert requests[0]['topics'][1:] == [None, receiver_topic]
@@ -10,13 +10,19 @@ from microraiden.utils import (
     pubkey_to_addr,
     sign_balance_proof,
     verify_balance_proof,
+    verify_balance_proofs,
     eth_sign,
     keccak256,
     addr_from_sig,
     eth_verify,
+    eth_sign_typed_data_message,
     eth_sign_typed_data_message_eip,
+    BalanceProofContext,
     eth_sign_typed_data_eip,
     pack,
+    Packer,
+    Signer,
+    get_signer,
     sign_close,
     verify_closing_sig
 )
@@ -37,6 +43,14 @@ def test_pack():
     assert pack(True) == b'\x01'
 
 
+def test_packer():
+    addr = '0x1212121212121212121212121212121212121212'
+    pack_message = Packer('string', 'address', 'uint32', 'uint192', 'bool', 'int', 'bytes')
+    assert pack_message('a', addr, 15, 2 ** 100, True, -5, b'\x01') == pack(
+        'a', addr, (15, 32), (2 ** 100, 192), True, -5, b'\x01'
+    )
+
+
 def test_keccak256():
     addr1 = '0x1212121212121212121212121212121212121212'
     addr2 = '0x3434343434343434343434343434343434343434'
@@ -79,6 +93,23 @@ def test_sign():
     assert is_same_address(pubkey_to_addr(pubkey), SENDER_ADDR)
 
 
+def test_signer():
+    signer = Signer(SENDER_PRIVATE_KEY)
+    assert signer.address == SENDER_ADDR
+    assert privkey_to_addr(signer) == SENDER_ADDR
+    assert get_signer(signer) is signer
+    assert get_signer(SENDER_PRIVATE_KEY).address == SENDER_ADDR
+
+    msg = keccak256('signer message')
+    assert signer.sign(msg, v=27) == sign(SENDER_PRIVATE_KEY, msg, v=27)
+    assert sign(signer, msg) == sign(SENDER_PRIVATE_KEY, msg)
+    contract_address = '0x' + 'cc' * 20
+    assert sign_balance_proof(signer, RECEIVER_ADDR, 315123, 8, contract_address) == \
+        sign_balance_proof(SENDER_PRIVATE_KEY, RECEIVER_ADDR, 315123, 8, contract_address)
+    assert sign_close(signer, RECEIVER_ADDR, 315123, 8, contract_address) == \
+        sign_close(SENDER_PRIVATE_KEY, RECEIVER_ADDR, 315123, 8, contract_address)
+
+
 def test_eth_sign():
     # Generated using https://www.myetherwallet.com/signmsg.html
     msg = 'is it wednesday, my dudes?'
@@ -154,6 +185,53 @@ def test_verify_balance_proof(channel_manager_address: str):
     ), SENDER_ADDR)
 
 
+def test_balance_proof_context():
+    contract_address = '0x' + 'cc' * 20
+    context = BalanceProofContext(RECEIVER_ADDR, 315123, contract_address)
+    for balance in (0, 8, 2 ** 192 - 1):
+        assert context.message(balance) == eth_sign_typed_data_message([
+            ('string', 'message_id', 'Sender balance proof signature'),
+            ('address', 'receiver', RECEIVER_ADDR),
+            ('uint32', 'block_created', (315123, 32)),
+            ('uint192', 'balance', (balance, 192)),
+            ('address', 'contract', contract_address)
+        ])
+    sig = context.sign(SENDER_PRIVATE_KEY, 8)
+    assert sig == sign_balance_proof(SENDER_PRIVATE_KEY, RECEIVER_ADDR, 315123, 8,
+                                     contract_address)
+    assert is_same_address(context.recover(8, sig), SENDER_ADDR)
+
+
+def test_addr_from_sig_cache():
+    msg = keccak256('cached message')
+    sig = sign(SENDER_PRIVATE_KEY, msg)
+    addr_from_sig.cache_clear()
+    for _ in range(3):
+        assert is_same_address(addr_from_sig(sig, msg), SENDER_ADDR)
+    cache_info = addr_from_sig.cache_info()
+    assert (cache_info.hits, cache_info.misses) == (2, 1)
+
+
+def test_verify_balance_proofs():
+    contract_address = '0x' + 'cc' * 20
+    proofs = [
+        (RECEIVER_ADDR, 315123, balance, sign_balance_proof(
+            SENDER_PRIVATE_KEY, RECEIVER_ADDR, 315123, balance, contract_address
+        ), contract_address)
+        for balance in range(5)
+    ]
+    # signature of another balance, invalid signature, invalid balance
+    proofs.append(proofs[0][:2] + (7,) + proofs[0][3:])
+    proofs.append(proofs[0][:3] + (b'\x00' * 65,) + proofs[0][4:])
+    proofs.append(proofs[0][:2] + (-1,) + proofs[0][3:])
+
+    signers = verify_balance_proofs(iter(proofs), chunk_size=2)
+    assert len(signers) == len(proofs)
+    assert all(is_same_address(signer, SENDER_ADDR) for signer in signers[:5])
+    assert not is_same_address(signers[5], SENDER_ADDR)
+    assert signers[6:] == [None, None]
+
+
 def test_sign_close_contract(channel_manager_contract: Contract):
     sig = sign_close(
         RECEIVER_PRIVATE_KEY, SENDER_ADDR, 315832, 13, channel_manager_contract.address
@@ -1,11 +1,27 @@
+import os
 import time
 import logging
 import datetime
+import tracemalloc
 
 import gevent
-from eth_utils import encode_hex
+import pytest
+from eth_utils import decode_hex, encode_hex, is_0x_prefixed, is_same_address
 
 from microraiden import Session
+from microraiden.utils import (
+    pack,
+    Packer,
+    Signer,
+    addr_from_sig,
+    privkey_to_addr,
+    sign_balance_proof,
+    verify_balance_proof,
+    verify_balance_proofs
+)
+from microraiden.channel_manager import Channel, ChannelManagerState, ChannelState
+from microraiden.channel_manager.storage import STORAGE_BACKENDS, encode_uint
+from microraiden.channel_manager.verifier import SignatureVerifier
 
 log = logging.getLogger(__name__)
 
@@ -60,3 +76,281 @@ def test_receiver_validation(channel_manager, client, wait_for_blocks):
     t_diff = time.time() - t_start
     log.info("%d balance proofs verified in %s (%f / s)",
              n, datetime.timedelta(seconds=t_diff), n / t_diff)
+
+
+def make_state_file(path: str, n_channels: int, n_topups: int = 0) -> str:
+    """Create a state file with `n_channels` open channels and return its path."""
+    receiver = '0x' + 'bb' * 20
+    state = ChannelManagerState(path)
+    state.setup_db(123, '0x' + 'aa' * 20, receiver)
+    now = time.time()
+    state.storage.conn.executemany(
+        'INSERT INTO `channels` VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        ([i.to_bytes(20, 'big'), i + 1, encode_uint(100), encode_uint(10), None, -1, now, now,
+          ChannelState.OPEN.value, True]
+         for i in range(n_channels))
+    )
+    state.storage.conn.executemany(
+        'INSERT INTO `topups` VALUES (?, ?, ?)',
+        ([i + 1, '0x%064x' % i, encode_uint(5)] for i in range(n_topups))
+    )
+    state.storage.conn.commit()
+    return path
+
+
+@pytest.mark.parametrize('n_channels', [1000, 10000, 50000])
+def test_state_load(tmpdir, n_channels: int):
+    path = make_state_file(tmpdir.join('state.db').strpath, n_channels, n_channels // 10)
+
+    t_start = time.time()
+    state = ChannelManagerState.load(path, check_permissions=False)
+    t_diff = time.time() - t_start
+    assert state.n_channels == n_channels
+    assert sum(len(c.unconfirmed_topups) for c in state.channels.values()) == n_channels // 10
+    log.info("%d channels loaded in %s (%f / s)",
+             n_channels, datetime.timedelta(seconds=t_diff), n_channels / t_diff)
+
+
+@pytest.mark.parametrize('backend, storage_kwargs', (
+    [(backend, {}) for backend in sorted(STORAGE_BACKENDS)] +
+    [('sqlite', {'balance_log': True})]
+))
+def test_storage_backend(tmpdir, backend: str, storage_kwargs: dict):
+    """Measure payment commit latency, startup load time and memory per channel."""
+    n_channels = 2000
+    n_payments = 2000
+    path = tmpdir.join('state').strpath
+    receiver = '0x' + 'bb' * 20
+    storage_kwargs = dict(storage_kwargs, backend=backend)
+    state = ChannelManagerState(path, **storage_kwargs)
+    name = ' '.join([backend] + sorted(set(storage_kwargs) - {'backend'}))
+    state.setup_db(123, '0x' + 'aa' * 20, receiver)
+
+    tracemalloc.start()
+    memory_start = tracemalloc.get_traced_memory()[0]
+    for i in range(n_channels):
+        channel = Channel(receiver, '0x%040x' % i, 100, i + 1)
+        channel.state = ChannelState.OPEN
+        channel.confirmed = True
+        state.add_channel(channel)
+    memory = tracemalloc.get_traced_memory()[0] - memory_start
+    tracemalloc.stop()
+    log.info("%s: %d bytes / channel", name, memory / n_channels)
+
+    channels = list(state.channels.values())
+    latencies = []
+    for i in range(n_payments):
+        channel = channels[i % n_channels]
+        channel.balance += 1
+        channel.last_signature = '0x' + 'cc' * 65
+        t_start = time.time()
+        state.set_channel_balance(channel)
+        latencies.append(time.time() - t_start)
+    latencies.sort()
+    log.info("%s: payment commit latency mean %fms p99 %fms", name,
+             1000 * sum(latencies) / n_payments, 1000 * latencies[int(n_payments * 0.99)])
+    state.close()
+    if backend == 'memory':
+        return
+
+    t_start = time.time()
+    state = ChannelManagerState.load(path, check_permissions=False, **storage_kwargs)
+    t_diff = time.time() - t_start
+    assert state.n_channels == n_channels
+    assert state.get_channel('0x%040x' % 0, 1).balance == n_payments // n_channels
+    log.info("%s: %d channels loaded in %s (%f / s)",
+             name, n_channels, datetime.timedelta(seconds=t_diff), n_channels / t_diff)
+    state.close()
+
+
+def test_channel_memory():
+    """Measure memory used by channels of the channel manager."""
+    n_channels = 10000
+    receiver = '0x' + 'bb' * 20
+    tracemalloc.start()
+    memory_start = tracemalloc.get_traced_memory()[0]
+    channels = []
+    for i in range(n_channels):
+        channel = Channel(receiver, '0x%040x' % i, 100, i + 1)
+        channel.balance = 10
+        channel.last_signature = '0x%0130x' % i
+        channels.append(channel)
+    memory = tracemalloc.get_traced_memory()[0] - memory_start
+    tracemalloc.stop()
+    log.info("%d bytes / channel", memory / n_channels)
+
+
+def pack_reference(*args) -> bytes:
+    """`utils.crypto.pack()` before it was optimized, for comparison."""
+    def format_int(value, size):
+        assert isinstance(value, int)
+        assert isinstance(size, int)
+        if value >= 0:
+            return decode_hex('{:x}'.format(value).zfill(size // 4))
+        else:
+            return decode_hex('{:x}'.format((1 << size) + value))
+
+    msg = b''
+    for arg in args:
+        assert arg is not None
+        if isinstance(arg, bytes):
+            msg += arg
+        elif isinstance(arg, str):
+            if is_0x_prefixed(arg):
+                msg += decode_hex(arg)
+            else:
+                msg += arg.encode()
+        elif isinstance(arg, bool):
+            msg += format_int(int(arg), 8)
+        elif isinstance(arg, int):
+            msg += format_int(arg, 256)
+        elif isinstance(arg, tuple):
+            msg += format_int(arg[0], arg[1])
+        else:
+            raise ValueError('Unsupported type: {}.'.format(type(arg)))
+
+    return msg
+
+
+PACK_ADDRESS = '0x' + '12' * 20
+# messages packed in utils.crypto: arguments of pack() and, for a known schema, Packer types
+PACK_MESSAGES = {
+    'balance proof': (
+        ('Sender balance proof signature', PACK_ADDRESS, (315123, 32), (10 ** 18, 192),
+         PACK_ADDRESS),
+        ('string', 'address', 'uint32', 'uint192', 'address')
+    ),
+    'typed data schema': (
+        ('string message_id', 'address receiver', 'uint32 block_created', 'uint192 balance',
+         'address contract'),
+        None
+    ),
+    'eth message': (('\x19Ethereum Signed Message:\n5hello',), None),
+    'channel key': ((PACK_ADDRESS, PACK_ADDRESS, (315123, 32)), None),
+    'uint256': ((2 ** 255, -5), ('uint256', 'int256')),
+}
+
+
+@pytest.mark.parametrize('message', sorted(PACK_MESSAGES))
+def test_pack(message: str):
+    """Compare pack() and Packer with the reference implementation."""
+    n = 20000
+    args, types = PACK_MESSAGES[message]
+    values = [arg[0] if isinstance(arg, tuple) else arg for arg in args]
+    packer = Packer(*types) if types is not None else None
+    assert pack(*args) == pack_reference(*args)
+    if packer is not None:
+        assert packer(*values) == pack(*args)
+
+    implementations = [('reference', lambda: pack_reference(*args)), ('pack', lambda: pack(*args))]
+    if packer is not None:
+        implementations.append(('Packer', lambda: packer(*values)))
+    for name, implementation in implementations:
+        t_start = time.time()
+        for _ in range(n):
+            implementation()
+        t_diff = time.time() - t_start
+        log.info("%s, %s: %.3fus / message", message, name, 1e6 * t_diff / n)
+
+
+@pytest.mark.parametrize('n_workers', [None, 1, 4])
+def test_verify_workers(n_workers: int):
+    """Verify balance proofs concurrently, inline on the hub or on a worker pool, and measure
+    how long the hub is blocked."""
+    n = 400
+    privkey = '0x' + 'a0' * 32
+    sender = privkey_to_addr(privkey)
+    receiver = '0x' + 'bb' * 20
+    contract_address = '0x' + 'cc' * 20
+    proofs = [(balance, sign_balance_proof(privkey, receiver, 1, balance, contract_address))
+              for balance in range(1, n + 1)]
+    addr_from_sig.cache_clear()
+    verifier = SignatureVerifier(n_workers) if n_workers is not None else None
+    recover = verifier.recover_balance_proof if verifier is not None else verify_balance_proof
+
+    def verify(balance, sig):
+        assert is_same_address(recover(receiver, 1, balance, sig, contract_address), sender)
+
+    hub_latencies = []
+
+    def ticker():
+        while True:
+            t_start = time.time()
+            gevent.sleep(0)
+            hub_latencies.append(time.time() - t_start)
+
+    ticker_greenlet = gevent.spawn(ticker)
+    t_start = time.time()
+    gevent.joinall([gevent.spawn(verify, balance, sig) for balance, sig in proofs],
+                   raise_error=True)
+    t_diff = time.time() - t_start
+    ticker_greenlet.kill()
+    log.info("%s workers: %d proofs verified in %s (%f / s), max hub latency %fms",
+             n_workers, n, datetime.timedelta(seconds=t_diff), n / t_diff,
+             1000 * max(hub_latencies))
+    if verifier is not None:
+        stats = verifier.stats()
+        assert stats['recover']['count'] == n
+        log.info("%s workers: %s", n_workers, ', '.join(
+            '%s mean %fms max %fms' % (stage, 1000 * stats[stage]['mean'],
+                                       1000 * stats[stage]['max'])
+            for stage in SignatureVerifier.STAGES
+        ))
+        verifier.close()
+
+
+# large batches take minutes, set TEST_LARGE_BATCHES to run them
+large_batch = pytest.mark.skipif(
+    'TEST_LARGE_BATCHES' not in os.environ,
+    reason='set TEST_LARGE_BATCHES to verify large batches'
+)
+
+
+@pytest.mark.parametrize('n_proofs', [
+    10000,
+    pytest.param(100000, marks=large_batch),
+    pytest.param(1000000, marks=large_batch)
+])
+def test_verify_balance_proofs(n_proofs: int):
+    """Verify balance proofs in a batch. Proofs of 1000 channels of two senders are repeated,
+    proofs of every 100th channel have an invalid signature."""
+    n_channels = 1000
+    privkeys = ['0x' + 'a0' * 32, '0x' + 'a1' * 32]
+    receiver = '0x' + 'bb' * 20
+    contract_address = '0x' + 'cc' * 20
+    channel_proofs = []
+    channel_signers = []
+    for block in range(1, n_channels + 1):
+        privkey = privkeys[block % 2]
+        if block % 100 == 0:
+            sig, signer = b'\x00' * 65, None
+        else:
+            sig = sign_balance_proof(privkey, receiver, block, 10, contract_address)
+            signer = privkey_to_addr(privkey).lower()
+        channel_proofs.append((receiver, block, 10, sig, contract_address))
+        channel_signers.append(signer)
+    proofs = (channel_proofs[i % n_channels] for i in range(n_proofs))
+
+    t_start = time.time()
+    signers = verify_balance_proofs(proofs)
+    t_diff = time.time() - t_start
+    assert [signer and signer.lower() for signer in signers] == [
+        channel_signers[i % n_channels] for i in range(n_proofs)
+    ]
+    log.info("%d balance proofs verified in a batch in %s (%f / s)",
+             n_proofs, datetime.timedelta(seconds=t_diff), n_proofs / t_diff)
+
+
+def test_signer():
+    """Sign balance proofs with a hex private key and with a Signer."""
+    n = 5000
+    privkey = '0x' + 'a0' * 32
+    receiver = '0x' + 'bb' * 20
+    contract_address = '0x' + 'cc' * 20
+    for name, key in (('hex key', privkey), ('Signer', Signer(privkey))):
+        t_start = time.time()
+        for balance in range(n):
+            sign_balance_proof(key, receiver, 1, balance, contract_address)
+        t_diff = time.time() - t_start
+        log.info("%s: %d balance proofs signed in %s (%f / s)",
+                 name, n, datetime.timedelta(seconds=t_diff), n / t_diff)
@@ -5,8 +5,10 @@ from eth_utils import encode_hex
 from munch import Munch
 
 from microraiden import HTTPHeaders, Client
+from microraiden.utils import sign_balance_proof
 from microraiden.proxy.resources import Expensive
 from microraiden.proxy.paywalled_proxy import PaywalledProxy
+from microraiden.channel_manager import ChannelManager
 from flask import request, jsonify
 
 import logging
@@ -116,6 +118,82 @@ def test_static_price(
     assert_method(requests.delete, endpoint_url + '/resource', headers, channel, 'DEL')
 
 
+def test_forged_balance_proof(
+        empty_proxy: PaywalledProxy,
+        api_endpoint_address: str,
+        client: Client,
+        receiver_privkey: str,
+        wait_for_blocks,
+        monkeypatch
+):
+    proxy = empty_proxy
+    endpoint_url = "http://" + api_endpoint_address
+    proxy.add_paywalled_resource(StaticPriceResource, '/resource', 3)
+    channel_manager = proxy.channel_manager
+    verified = []
+
+    def verify_signature(*args):
+        verified.append(args)
+        return ChannelManager.verify_signature(channel_manager, *args)
+
+    monkeypatch.setattr(channel_manager, 'verify_signature', verify_signature)
+
+    response = requests.get(endpoint_url + '/resource')
+    headers = HTTPHeaders.deserialize(response.headers)
+    channel = client.get_suitable_channel(headers.receiver_address, 12)
+    wait_for_blocks(6)
+    channel.update_balance(3)
+    headers = Munch()
+    headers.balance = str(channel.balance)
+    headers.balance_signature = encode_hex(channel.balance_sig)
+    headers.sender_address = channel.sender
+    headers.open_block = str(channel.block)
+    response = requests.get(endpoint_url + '/resource', headers=HTTPHeaders.serialize(headers))
+    assert response.status_code == 200
+
+    # stale (2) and over-deposit (13) proofs are rejected without recovering the signer
+    del verified[:]
+    for balance in (2, 13):
+        headers.balance = str(balance)
+        headers.balance_signature = encode_hex(channel.balance_sig)
+        response = requests.get(endpoint_url + '/resource',
+                                headers=HTTPHeaders.serialize(headers))
+        assert response.status_code == 402
+        assert HTTPHeaders.INVALID_PROOF in response.headers
+        assert HTTPHeaders.SENDER_BALANCE not in response.headers
+        assert HTTPHeaders.BALANCE_SIGNATURE not in response.headers
+    assert verified == []
+
+    # the channel state isn't revealed for proofs that aren't signed by the sender, with a
+    # valid (6) or an invalid (5) amount
+    for balance in (6, 5):
+        headers.balance = str(balance)
+        headers.balance_signature = encode_hex(sign_balance_proof(
+            receiver_privkey,
+            channel.receiver,
+            channel.block,
+            balance,
+            client.context.channel_manager.address
+        ))
+        response = requests.get(endpoint_url + '/resource',
+                                headers=HTTPHeaders.serialize(headers))
+        assert response.status_code == 402
+        assert HTTPHeaders.INVALID_PROOF in response.headers
+        assert HTTPHeaders.SENDER_BALANCE not in response.headers
+        assert HTTPHeaders.BALANCE_SIGNATURE not in response.headers
+
+    # the sender gets the channel state to resync its balance
+    channel.update_balance(5)
+    headers.balance = str(channel.balance)
+    headers.balance_signature = encode_hex(channel.balance_sig)
+    response = requests.get(endpoint_url + '/resource', headers=HTTPHeaders.serialize(headers))
+    assert response.status_code == 402
+    assert HTTPHeaders.INVALID_AMOUNT in response.headers
+    assert int(response.headers[HTTPHeaders.SENDER_BALANCE]) == 3
+    # ...after its proof has been verified
+    assert len(verified) == 3
+
+
 def test_dynamic_price(
         empty_proxy: PaywalledProxy,
         api_endpoint_address: str,
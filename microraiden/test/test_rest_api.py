@@ -77,3 +77,11 @@ def test_stats(doggo_proxy: PaywalledProxy, api_endpoint_address):
     assert is_same_address(stats['token_address'], token_address)
     contract_address = doggo_proxy.channel_manager.channel_manager_contract.address
     assert is_same_address(stats['contract_address'], contract_address)
+    assert 'manager_abi' not in stats
+
+    rv = requests.get(api_path + "/abi")
+    assert rv.status_code == 200
+    assert 'max-age' in rv.headers['Cache-Control']
+    abi = json.loads(rv.text)
+    assert abi['manager_abi'] == doggo_proxy.channel_manager.channel_manager_contract.abi
+    assert abi['token_abi'] == doggo_proxy.channel_manager.token_contract.abi
@@ -1,9 +1,12 @@
 from .crypto import (
+    Signer,
+    get_signer,
     generate_privkey,
     pubkey_to_addr,
     privkey_to_addr,
     addr_from_sig,
     pack,
+    Packer,
     keccak256,
     keccak256_hex,
     sign,
@@ -15,9 +18,12 @@ from .crypto import (
     eth_sign_typed_data,
     eth_sign_typed_data_message_eip,
     eth_sign_typed_data_eip,
+    BalanceProofContext,
+    get_balance_proof_context,
     get_balance_message,
     sign_balance_proof,
     verify_balance_proof,
+    verify_balance_proofs,
     sign_close,
     verify_closing_sig
 )
@@ -28,7 +34,11 @@ from .contract import (
     create_signed_contract_transaction,
     create_contract_transaction,
     create_transaction_data,
+    NonceCounter,
+    TransactionBuilder,
     get_logs,
+    get_event_logs,
+    address_to_topic,
     get_event_blocking,
     wait_for_transaction
 )
@@ -44,11 +54,14 @@ from .misc import (
 )
 
 __all__ = [
+    Signer,
+    get_signer,
     generate_privkey,
     pubkey_to_addr,
     privkey_to_addr,
     addr_from_sig,
     pack,
+    Packer,
     keccak256,
     keccak256_hex,
     sign,
@@ -60,9 +73,12 @@ __all__ = [
     eth_sign_typed_data,
     eth_sign_typed_data_message_eip,
     eth_sign_typed_data_eip,
+    BalanceProofContext,
+    get_balance_proof_context,
     get_balance_message,
     sign_balance_proof,
     verify_balance_proof,
+    verify_balance_proofs,
     sign_close,
     verify_closing_sig,
 
@@ -71,7 +87,11 @@ __all__ = [
     create_signed_contract_transaction,
     create_contract_transaction,
     create_transaction_data,
+    NonceCounter,
+    TransactionBuilder,
     get_logs,
+    get_event_logs,
+    address_to_topic,
     get_event_blocking,
     wait_for_transaction,
 
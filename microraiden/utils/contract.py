@@ -1,22 +1,36 @@
-from typing import List, Any, Union, Dict
+from typing import List, Any, Union, Dict, Tuple, Callable
 
 import gevent
 import rlp
-from eth_utils import decode_hex, encode_hex
+from eth_abi import encode_abi
+from eth_utils import (
+    decode_hex,
+    encode_hex,
+    keccak,
+    remove_0x_prefix,
+    event_abi_to_log_topic,
+    function_signature_to_4byte_selector
+)
+from gevent.lock import Semaphore
 from ethereum.transactions import Transaction
 from web3 import Web3
 from web3.contract import Contract
+from web3.utils.events import get_event_data
 
 from microraiden.config import NETWORK_CFG
-from microraiden.utils import privkey_to_addr, sign_transaction
+from microraiden.utils import Signer, get_signer, sign_transaction
 from microraiden.utils.populus_compat import LogFilter
 
 DEFAULT_TIMEOUT = 60
 DEFAULT_RETRY_INTERVAL = 3
+# errors of nodes rejecting a transaction because its nonce is already used
+NONCE_ERRORS = ('nonce too low', 'replacement transaction underpriced')
+# errors of nodes rejecting a transaction they already have, i.e. that has been sent
+KNOWN_TRANSACTION_ERRORS = ('known transaction', 'already known')
 
 
 def create_signed_transaction(
-        private_key: str,
+        private_key: Union[str, Signer],
         web3: Web3,
         to: str,
         value: int=0,
@@ -30,9 +44,10 @@ def create_signed_transaction(
     """
     if gas_price is None:
         gas_price = NETWORK_CFG.GAS_PRICE
+    signer = get_signer(private_key)
     tx = create_transaction(
         web3=web3,
-        from_=privkey_to_addr(private_key),
+        from_=signer.address,
         to=to,
         value=value,
         data=data,
@@ -40,7 +55,7 @@ def create_signed_transaction(
         gas_price=gas_price,
         gas_limit=gas_limit
     )
-    sign_transaction(tx, private_key, int(web3.version.network))
+    sign_transaction(tx, signer, int(web3.version.network))
     return encode_hex(rlp.encode(tx))
 
 
@@ -63,7 +78,7 @@ def create_transaction(
 
 
 def create_signed_contract_transaction(
-        private_key: str,
+        private_key: Union[str, Signer],
         contract: Contract,
         func_name: str,
         args: List[Any],
@@ -77,9 +92,10 @@ def create_signed_contract_transaction(
     """
     if gas_price is None:
         gas_price = NETWORK_CFG.GAS_PRICE
+    signer = get_signer(private_key)
     tx = create_contract_transaction(
         contract=contract,
-        from_=privkey_to_addr(private_key),
+        from_=signer.address,
         func_name=func_name,
         args=args,
         value=value,
@@ -87,7 +103,7 @@ def create_signed_contract_transaction(
         gas_price=gas_price,
         gas_limit=gas_limit
     )
-    sign_transaction(tx, private_key, int(contract.web3.version.network))
+    sign_transaction(tx, signer, int(contract.web3.version.network))
     return encode_hex(rlp.encode(tx))
 
 
@@ -121,6 +137,187 @@ def create_transaction_data(contract: Contract, func_name: str, args: List[Any])
     return decode_hex(data)
 
 
+class NonceCounter(object):
+    """Hands out the nonces of an account from a local counter.
+
+    The counter is synced with the pending transaction count of the account on first use and
+    after `resync()`. Share one counter between all `TransactionBuilder`s of an account.
+
+    Args:
+        web3 (Web3): web3 instance
+        address (str): address of the account
+    """
+
+    def __init__(self, web3: Web3, address: str):
+        self.web3 = web3
+        self.address = address
+        self.nonce = None
+        self.lock = Semaphore()
+
+    def next(self) -> int:
+        """Returns:
+            int: nonce of the next transaction
+        """
+        with self.lock:
+            if self.nonce is None:
+                self.nonce = self.web3.eth.getTransactionCount(self.address, 'pending')
+            nonce = self.nonce
+            self.nonce += 1
+        return nonce
+
+    def resync(self):
+        """Fetch the pending transaction count again before handing out the next nonce."""
+        self.nonce = None
+
+
+class TransactionBuilder(object):
+    """Creates and sends signed transactions of an account to a contract.
+
+    The chain id is fetched once, function selectors and argument types are taken from the
+    contract ABI on first use and nonces come from a `NonceCounter`, so transactions can be
+    built back-to-back without RPC round trips. The counter is resynced if sending fails and
+    transactions rejected for a used nonce are created and sent once more. A transaction the
+    node already knows counts as sent.
+
+    Args:
+        private_key (str|Signer): private key of the sender
+        contract (Contract): contract to call
+        nonces (NonceCounter, optional): nonce counter of the sender's account
+        network_id (int, optional): chain id (fetched from the node if not set)
+    """
+
+    def __init__(
+            self,
+            private_key: Union[str, Signer],
+            contract: Contract,
+            nonces: NonceCounter = None,
+            network_id: int = None
+    ):
+        self.signer = get_signer(private_key)
+        self.contract = contract
+        self.web3 = contract.web3
+        if nonces is None:
+            nonces = NonceCounter(self.web3, self.signer.address)
+        assert nonces.address == self.signer.address
+        self.nonces = nonces
+        if network_id is None:
+            network_id = int(self.web3.version.network)
+        self.network_id = network_id
+        self.functions = {}
+
+    def get_function(self, func_name: str, n_args: int) -> Tuple[bytes, List[str]]:
+        """Returns:
+            tuple: (selector, argument types) of the contract function
+        """
+        try:
+            return self.functions[func_name, n_args]
+        except KeyError:
+            pass
+        function_abi = [
+            abi_element for abi_element in self.contract.abi
+            if abi_element['type'] == 'function' and abi_element['name'] == func_name and
+            len(abi_element['inputs']) == n_args
+        ]
+        assert len(function_abi) == 1, 'No function found matching name {} and {} arguments.' \
+            .format(func_name, n_args)
+        types = [argument['type'] for argument in function_abi[0]['inputs']]
+        selector = function_signature_to_4byte_selector(
+            '{}({})'.format(func_name, ','.join(types))
+        )
+        self.functions[func_name, n_args] = selector, types
+        return selector, types
+
+    def encode(self, func_name: str, args: List[Any]) -> bytes:
+        """Returns:
+            bytes: transaction data of a call to the contract function
+        """
+        selector, types = self.get_function(func_name, len(args))
+        return selector + encode_abi(types, args)
+
+    def create(
+            self,
+            func_name: str,
+            args: List[Any],
+            value: int = 0,
+            gas_price: Union[int, None] = None,
+            gas_limit: int = NETWORK_CFG.GAS_LIMIT
+    ) -> str:
+        """Creates a signed contract transaction compliant with EIP155.
+
+        Takes the next nonce, so the transaction must be sent with `send()`.
+        """
+        if gas_price is None:
+            gas_price = NETWORK_CFG.GAS_PRICE
+        data = self.encode(func_name, args)
+        tx = Transaction(
+            self.nonces.next(),
+            gas_price,
+            gas_limit,
+            self.contract.address,
+            value,
+            data
+        )
+        tx.sender = decode_hex(self.signer.address)
+        sign_transaction(tx, self.signer, self.network_id)
+        return encode_hex(rlp.encode(tx))
+
+    def send(self, raw_tx: str, retry: Callable[[], str] = None) -> str:
+        """Sends a transaction created by `create()`.
+
+        The nonce counter is resynced if sending fails. If the node rejects the transaction
+        for a used nonce, it is created again by `retry` (if set) and sent once more. If the
+        node already knows the transaction, it isn't sent again.
+
+        Returns:
+            str: transaction hash
+        """
+        try:
+            return self._send(raw_tx)
+        except Exception as e:
+            self.nonces.resync()
+            if retry is None or not is_nonce_error(e):
+                raise
+        try:
+            return self._send(retry())
+        except Exception:
+            self.nonces.resync()
+            raise
+
+    def _send(self, raw_tx: str) -> str:
+        try:
+            return self.web3.eth.sendRawTransaction(raw_tx)
+        except Exception as e:
+            if not is_known_transaction_error(e):
+                raise
+        return encode_hex(keccak(decode_hex(raw_tx)))
+
+    def transact(self, func_name: str, args: List[Any], **kwargs) -> str:
+        """Creates and sends a contract transaction, see `create()` and `send()`.
+
+        Returns:
+            str: transaction hash
+        """
+        def create():
+            return self.create(func_name, args, **kwargs)
+        return self.send(create(), retry=create)
+
+
+def is_nonce_error(error: Exception) -> bool:
+    """Returns:
+        bool: True if a node rejected a transaction because its nonce is already used
+    """
+    message = str(error).lower()
+    return any(reason in message for reason in NONCE_ERRORS)
+
+
+def is_known_transaction_error(error: Exception) -> bool:
+    """Returns:
+        bool: True if a node rejected a transaction because it already has it
+    """
+    message = str(error).lower()
+    return any(reason in message for reason in KNOWN_TRANSACTION_ERRORS)
+
+
 def get_logs(
         contract: Contract,
         event_name: str,
@@ -152,6 +349,55 @@ def get_logs(
     return logs
 
 
+def get_event_logs(
+        contract: Contract,
+        event_names: List[str],
+        from_block: Union[int, str] = 0,
+        to_block: Union[int, str] = 'latest',
+        topics: List[Any] = None
+) -> List[Dict[str, Any]]:
+    """Fetch the logs of several events of a contract with a single `eth_getLogs` call.
+
+    Args:
+        contract (Contract): contract that emits the events
+        event_names (list): names of the events
+        from_block (int|str, optional): first block of the range
+        to_block (int|str, optional): last block of the range
+        topics (list, optional): filters of the topics following the event signature
+            (e.g. [None, topic] to filter for the second indexed argument)
+
+    Returns:
+        list: decoded logs in chain order, with 'event' and 'args'
+    """
+    event_abis = {
+        event_abi_to_log_topic(abi_element): abi_element for abi_element in contract.abi
+        if abi_element['type'] == 'event' and abi_element['name'] in event_names
+    }
+    assert len(event_abis) == len(set(event_names)), \
+        'No events found matching names {}.'.format(event_names)
+
+    filter_params = {
+        'fromBlock': from_block,
+        'toBlock': to_block,
+        'address': contract.address,
+        'topics': [[encode_hex(topic) for topic in event_abis]] + (topics or [])
+    }
+    logs = []
+    for log in _get_logs_raw(contract, filter_params):
+        topic = log['topics'][0]
+        if isinstance(topic, str):
+            topic = decode_hex(topic)
+        logs.append(get_event_data(event_abis[bytes(topic)], log))
+    return logs
+
+
+def address_to_topic(address: str) -> str:
+    """Returns:
+        str: topic of an indexed address argument
+    """
+    return '0x' + remove_0x_prefix(address).lower().rjust(64, '0')
+
+
 def _get_logs_raw(contract: Contract, filter_params: Dict[str, Any]):
     """For easy patching."""
     return contract.web3._requestManager.request_blocking('eth_getLogs', [filter_params])
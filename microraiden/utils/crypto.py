@@ -1,12 +1,14 @@
-from typing import List, Tuple, Any
+import os
+import functools
+from concurrent.futures import Executor
+from typing import List, Tuple, Any, Union
 
 from coincurve import PrivateKey, PublicKey
+from gevent.threadpool import ThreadPoolExecutor
 from eth_utils import (
     encode_hex,
-    decode_hex,
     remove_0x_prefix,
     keccak,
-    is_0x_prefixed,
     to_checksum_address
 )
 from ethereum.transactions import Transaction
@@ -18,6 +20,50 @@ Name = str
 TypedData = Tuple[Type, Name, Any]
 
 
+class Signer(object):
+    """A private key that is parsed once, with its address.
+
+    Can be passed instead of a hex private key to all functions that sign something, so that
+    the key isn't parsed and the address isn't derived for every signature.
+
+    Args:
+        private_key (str): hex encoded private key
+    """
+    __slots__ = ('private_key', 'key', '_address')
+
+    def __init__(self, private_key: str):
+        assert isinstance(private_key, str)
+        self.private_key = private_key
+        self.key = PrivateKey.from_hex(remove_0x_prefix(private_key))
+        self._address = None
+
+    @property
+    def address(self) -> str:
+        """Checksum encoded address of the key, derived on first access."""
+        if self._address is None:
+            self._address = to_checksum_address(pubkey_to_addr(self.key.public_key))
+        return self._address
+
+    def sign(self, msg: bytes, v=0) -> bytes:
+        """Sign a 32 byte message hash, see `sign()`."""
+        assert isinstance(msg, bytes)
+        assert len(msg) == 32
+
+        sig = self.key.sign_recoverable(msg, hasher=None)
+        assert len(sig) == 65
+
+        return sig[:-1] + bytes([sig[-1] + v])
+
+
+def get_signer(privkey: Union[str, Signer]) -> Signer:
+    """Returns:
+        Signer: `privkey` if it is a Signer, otherwise a Signer of the hex private key
+    """
+    if isinstance(privkey, Signer):
+        return privkey
+    return Signer(privkey)
+
+
 def generate_privkey() -> bytes:
     return encode_hex(PrivateKey().secret)
 
@@ -29,13 +75,27 @@ def pubkey_to_addr(pubkey) -> str:
     return encode_hex(keccak256(pubkey[1:])[-20:])
 
 
-def privkey_to_addr(privkey: str) -> str:
-    return to_checksum_address(
-        pubkey_to_addr(PrivateKey.from_hex(remove_0x_prefix(privkey)).public_key)
-    )
+def privkey_to_addr(privkey: Union[str, Signer]) -> str:
+    return get_signer(privkey).address
 
 
+# max. number of recovered signers kept by `addr_from_sig()`
+ADDR_FROM_SIG_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=ADDR_FROM_SIG_CACHE_SIZE)
 def addr_from_sig(sig: bytes, msg: bytes):
+    """Recover the address that signed the message hash `msg`.
+
+    Results are kept in a bounded LRU cache keyed by (signature, message hash), so repeated
+    balance proofs don't cost an EC recovery. Hits and misses are counted by
+    `addr_from_sig.cache_info()`.
+    """
+    return recover_addr(sig, msg)
+
+
+def recover_addr(sig: bytes, msg: bytes):
+    """Uncached `addr_from_sig()`."""
     assert len(sig) == 65
     # Support Ethereum's EC v value of 27 and EIP 155 values of > 35.
     if sig[-1] >= 35:
@@ -48,6 +108,21 @@ def addr_from_sig(sig: bytes, msg: bytes):
     return pubkey_to_addr(receiver_pubkey)
 
 
+def encode_int(value: int, size: int = 256) -> bytes:
+    """Encode an integer as a Solidity int/uint of `size` bits, negative values in two's
+    complement."""
+    if value < 0:
+        value += 1 << size
+    return value.to_bytes(size // 8, byteorder='big')
+
+
+def encode_str(value: str) -> bytes:
+    """Encode a string like `pack()`: 0x-prefixed strings as hex, others as utf-8."""
+    if value[:2] in ('0x', '0X'):
+        return bytes.fromhex(value[2:])
+    return value.encode()
+
+
 def pack(*args) -> bytes:
     """
     Simulates Solidity's keccak256 packing. Integers can be passed as tuples where the second tuple
@@ -57,60 +132,91 @@ def pack(*args) -> bytes:
     keccak256(uint32(5))
     Default size is 256.
     """
-    def format_int(value, size):
-        assert isinstance(value, int)
-        assert isinstance(size, int)
-        if value >= 0:
-            return decode_hex('{:x}'.format(value).zfill(size // 4))
-        else:
-            return decode_hex('{:x}'.format((1 << size) + value))
-
-    msg = b''
+    parts = []
     for arg in args:
-        assert arg is not None
-        if isinstance(arg, bytes):
-            msg += arg
-        elif isinstance(arg, str):
-            if is_0x_prefixed(arg):
-                msg += decode_hex(arg)
-            else:
-                msg += arg.encode()
+        # exact type checks first, they are faster than isinstance()
+        arg_type = type(arg)
+        if arg_type is bytes:
+            parts.append(arg)
+        elif arg_type is str:
+            parts.append(encode_str(arg))
+        elif arg_type is int:
+            parts.append(encode_int(arg))
+        elif arg_type is tuple:
+            assert isinstance(arg[0], int) and isinstance(arg[1], int)
+            parts.append(encode_int(arg[0], arg[1]))
+        elif arg is None:
+            raise AssertionError('None can not be packed.')
         elif isinstance(arg, bool):
-            msg += format_int(int(arg), 8)
+            parts.append(encode_int(int(arg), 8))
+        elif isinstance(arg, bytes):
+            parts.append(bytes(arg))
+        elif isinstance(arg, str):
+            parts.append(encode_str(arg))
         elif isinstance(arg, int):
-            msg += format_int(arg, 256)
-        elif isinstance(arg, tuple):
-            msg += format_int(arg[0], arg[1])
+            parts.append(encode_int(arg))
         else:
             raise ValueError('Unsupported type: {}.'.format(type(arg)))
 
-    return msg
+    return b''.join(parts)
 
 
-def keccak256(*args) -> bytes:
-    return keccak(pack(*args))
+def encode_address(value: str) -> bytes:
+    return bytes.fromhex(value[2:])
 
 
-def keccak256_hex(*args) -> bytes:
-    return encode_hex(keccak256(*args))
+# Solidity type => encoder of a value of that type, for `Packer`
+TYPE_ENCODERS = {
+    'address': encode_address,
+    'string': str.encode,
+    'bytes': bytes,
+    'bool': lambda value: b'\x01' if value else b'\x00',
+}
 
 
-def sign(privkey: str, msg: bytes, v=0) -> bytes:
-    assert isinstance(msg, bytes)
-    assert isinstance(privkey, str)
+def get_type_encoder(type_: str):
+    if type_ in TYPE_ENCODERS:
+        return TYPE_ENCODERS[type_]
+    if type_.startswith('uint'):
+        n_bytes = int(type_[4:] or 256) // 8
+        return lambda value: value.to_bytes(n_bytes, 'big')
+    if type_.startswith('int'):
+        n_bytes = int(type_[3:] or 256) // 8
+        return lambda value: value.to_bytes(n_bytes, 'big', signed=True)
+    raise ValueError('Unsupported type: {}.'.format(type_))
 
-    pk = PrivateKey.from_hex(remove_0x_prefix(privkey))
-    assert len(msg) == 32
 
-    sig = pk.sign_recoverable(msg, hasher=None)
-    assert len(sig) == 65
+class Packer(object):
+    """Pack values of a fixed list of Solidity types like `pack()`, e.g.
+    Packer('address', 'uint32')(receiver, open_block_number).
 
-    sig = sig[:-1] + bytes([sig[-1] + v])
+    The encoder of each value is looked up once, so packing values of a known schema doesn't
+    inspect their types. Addresses must be 0x-prefixed, strings are encoded as utf-8.
+    """
+    __slots__ = ('types', 'encoders')
 
-    return sig
+    def __init__(self, *types):
+        self.types = types
+        self.encoders = tuple(get_type_encoder(type_) for type_ in types)
 
+    def __call__(self, *values) -> bytes:
+        assert len(values) == len(self.encoders)
+        return b''.join([encoder(value) for encoder, value in zip(self.encoders, values)])
 
-def sign_transaction(tx: Transaction, privkey: str, network_id: int):
+
+def keccak256(*args) -> bytes:
+    return keccak(pack(*args))
+
+
+def keccak256_hex(*args) -> bytes:
+    return encode_hex(keccak256(*args))
+
+
+def sign(privkey: Union[str, Signer], msg: bytes, v=0) -> bytes:
+    return get_signer(privkey).sign(msg, v)
+
+
+def sign_transaction(tx: Transaction, privkey: Union[str, Signer], network_id: int):
     # Implementing EIP 155.
     tx.v = network_id
     sig = sign(privkey, keccak256(rlp.encode(tx)), v=35 + 2 * network_id)
@@ -125,7 +231,7 @@ def eth_message_hash(msg: str) -> bytes:
     return keccak256(msg)
 
 
-def eth_sign(privkey: str, msg: str) -> bytes:
+def eth_sign(privkey: Union[str, Signer], msg: str) -> bytes:
     assert isinstance(msg, str)
     sig = sign(privkey, eth_message_hash(msg), v=27)
     return sig
@@ -142,7 +248,7 @@ def eth_sign_typed_data_message(typed_data: List[TypedData]) -> bytes:
     return keccak256(keccak256(*schema), keccak256(*data))
 
 
-def eth_sign_typed_data(privkey: str, typed_data: List[TypedData]) -> bytes:
+def eth_sign_typed_data(privkey: Union[str, Signer], typed_data: List[TypedData]) -> bytes:
     msg = eth_sign_typed_data_message(typed_data)
     return sign(privkey, msg, v=27)
 
@@ -154,28 +260,78 @@ def eth_sign_typed_data_message_eip(typed_data: List[TypedData]) -> bytes:
     return keccak256(keccak256(*schema), *data)
 
 
-def eth_sign_typed_data_eip(privkey: str, typed_data: List[TypedData]) -> bytes:
+def eth_sign_typed_data_eip(privkey: Union[str, Signer], typed_data: List[TypedData]) -> bytes:
     msg = eth_sign_typed_data_message_eip(typed_data)
     return sign(privkey, msg, v=27)
 
 
+BALANCE_PROOF_MESSAGE_ID = 'Sender balance proof signature'
+BALANCE_PROOF_SCHEMA_HASH = keccak256(
+    'string message_id',
+    'address receiver',
+    'uint32 block_created',
+    'uint192 balance',
+    'address contract'
+)
+
+
+class BalanceProofContext(object):
+    """Balance proof message of a channel with everything but the balance precomputed.
+
+    The message is the hash of the schema hash and the hash of the packed typed data, see
+    `eth_sign_typed_data_message()`. Only the balance changes between the balance proofs of a
+    channel, so a message costs packing the 24-byte balance and two keccaks.
+    """
+    __slots__ = ('prefix', 'suffix')
+
+    def __init__(self, receiver: str, open_block_number: int, contract_address: str):
+        self.prefix = pack(BALANCE_PROOF_MESSAGE_ID, receiver, (open_block_number, 32))
+        self.suffix = pack(contract_address)
+
+    def message(self, balance: int) -> bytes:
+        assert 0 <= balance < 2 ** 192
+        data = self.prefix + balance.to_bytes(24, byteorder='big') + self.suffix
+        return keccak(BALANCE_PROOF_SCHEMA_HASH + keccak(data))
+
+    def sign(self, privkey: Union[str, Signer], balance: int) -> bytes:
+        return sign(privkey, self.message(balance), v=27)
+
+    def recover(self, balance: int, balance_sig: bytes) -> str:
+        """Returns:
+            str: address of the signer of a balance proof
+        """
+        return addr_from_sig(balance_sig, self.message(balance))
+
+
+@functools.lru_cache(maxsize=4096)
+def get_balance_proof_context(
+        receiver: str, open_block_number: int, contract_address: str
+) -> BalanceProofContext:
+    """Returns:
+        BalanceProofContext: balance proof context of a channel. Contexts of recently used
+            channels are cached.
+    """
+    return BalanceProofContext(receiver, open_block_number, contract_address)
+
+
 def get_balance_message(
         receiver: str, open_block_number: int, balance: int, contract_address: str
 ) -> bytes:
-    return eth_sign_typed_data_message([
-        ('string', 'message_id', 'Sender balance proof signature'),
-        ('address', 'receiver', receiver),
-        ('uint32', 'block_created', (open_block_number, 32)),
-        ('uint192', 'balance', (balance, 192)),
-        ('address', 'contract', contract_address)
-    ])
+    return get_balance_proof_context(receiver, open_block_number, contract_address).message(
+        balance
+    )
 
 
 def sign_balance_proof(
-        privkey: str, receiver: str, open_block_number: int, balance: int, contract_address: str
+        privkey: Union[str, Signer],
+        receiver: str,
+        open_block_number: int,
+        balance: int,
+        contract_address: str
 ) -> bytes:
-    msg = get_balance_message(receiver, open_block_number, balance, contract_address)
-    return sign(privkey, msg, v=27)
+    return get_balance_proof_context(receiver, open_block_number, contract_address).sign(
+        privkey, balance
+    )
 
 
 def verify_balance_proof(
@@ -185,8 +341,80 @@ def verify_balance_proof(
         balance_sig: bytes,
         contract_address: str
 ) -> str:
-    msg = get_balance_message(receiver, open_block_number, balance, contract_address)
-    return addr_from_sig(balance_sig, msg)
+    return get_balance_proof_context(receiver, open_block_number, contract_address).recover(
+        balance, balance_sig
+    )
+
+
+def recover_addrs(sigs_and_msgs: list) -> list:
+    """Recover the signers of a list of (signature, message hash) pairs.
+
+    Returns:
+        list: signer addresses, None for signatures that can't be recovered
+    """
+    addrs = []
+    for sig, msg in sigs_and_msgs:
+        try:
+            addrs.append(recover_addr(sig, msg))
+        except (AssertionError, ValueError, TypeError):
+            addrs.append(None)
+    return addrs
+
+
+def verify_balance_proofs(
+        proofs,
+        executor: Executor = None,
+        chunk_size: int = 1000
+) -> list:
+    """Recover the signers of many balance proofs.
+
+    All messages are built first, reusing the precomputed context of each channel. Recovery
+    then runs in chunks of `chunk_size` proofs on `executor`, by default a gevent thread pool
+    with one native thread per core; secp256k1 recovery doesn't hold the GIL. Unlike the
+    threads of `concurrent.futures`, these stay native threads if the process has been
+    monkey-patched by gevent, e.g. in the proxy, and only block the calling greenlet. The
+    recovery cache of `addr_from_sig()` isn't used, so bulk verification doesn't evict cached
+    proofs.
+
+    Args:
+        proofs (iterable): tuples (receiver, open_block_number, balance, balance_sig,
+            contract_address) like the arguments of `verify_balance_proof()`
+        executor (Executor, optional): executor that runs the recovery, e.g. a
+            ProcessPoolExecutor
+        chunk_size (int, optional): number of proofs recovered per task
+    Returns:
+        list: signer addresses aligned with `proofs`, None for invalid proofs
+    """
+    sigs_and_msgs = []
+    for receiver, open_block_number, balance, balance_sig, contract_address in proofs:
+        context = get_balance_proof_context(receiver, open_block_number, contract_address)
+        try:
+            msg = context.message(balance)
+        except AssertionError:
+            msg = None
+        sigs_and_msgs.append((balance_sig, msg))
+
+    chunks = [
+        sigs_and_msgs[start:start + chunk_size]
+        for start in range(0, len(sigs_and_msgs), chunk_size)
+    ]
+    if executor is None:
+        with ThreadPoolExecutor(os.cpu_count()) as executor:
+            results = list(executor.map(recover_addrs, chunks))
+    else:
+        results = list(executor.map(recover_addrs, chunks))
+    return [addr for chunk in results for addr in chunk]
+
+
+CLOSING_MESSAGE_ID = 'Receiver closing signature'
+CLOSING_MESSAGE_SCHEMA_HASH = keccak256(
+    'string message_id',
+    'address sender',
+    'uint32 block_created',
+    'uint192 balance',
+    'address contract'
+)
+pack_closing_message = Packer('string', 'address', 'uint32', 'uint192', 'address')
 
 
 def get_closing_message(
@@ -195,17 +423,14 @@ def get_closing_message(
         balance: int,
         contract_address: str
 ) -> bytes:
-    return eth_sign_typed_data_message([
-        ('string', 'message_id', 'Receiver closing signature'),
-        ('address', 'sender', sender),
-        ('uint32', 'block_created', (open_block_number, 32)),
-        ('uint192', 'balance', (balance, 192)),
-        ('address', 'contract', contract_address)
-    ])
+    data = pack_closing_message(
+        CLOSING_MESSAGE_ID, sender, open_block_number, balance, contract_address
+    )
+    return keccak(CLOSING_MESSAGE_SCHEMA_HASH + keccak(data))
 
 
 def sign_close(
-        privkey: str,
+        privkey: Union[str, Signer],
         sender: str,
         open_block_number: int,
         balance: int,
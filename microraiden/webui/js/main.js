@@ -351,7 +351,8 @@ function pageReady(contractABI, tokenABI, startBlock) {
 mainSwitch("#channel_loading");
 
 $(function() {
-  $.getJSON("/api/1/stats").done(function(json) {
+  $.when($.getJSON("/api/1/stats"), $.getJSON("/api/1/abi")).done(function(stats, abi) {
+    var json = $.extend({}, stats[0], abi[0]);
     var cnt = 20;
     // wait up to 20*200ms for web3 and call ready()
     var pollingId = setInterval(function() {
@@ -149,6 +149,7 @@ def withdraw_from_channels(
 ):
     web3 = channel_manager_contract.web3
     pending_txs = {}
+    transactions = utils.TransactionBuilder(private_key, channel_manager_contract)
 
     for channel in state.channels.values():
         if not channel.last_signature:
@@ -171,9 +172,7 @@ def withdraw_from_channels(
                 minimum
             )
             continue
-        raw_tx = utils.create_signed_contract_transaction(
-            private_key,
-            channel_manager_contract,
+        tx_hash = transactions.transact(
             'withdraw',
             [
                 channel.open_block_number,
@@ -182,7 +181,6 @@ def withdraw_from_channels(
             ],
             gas_price=gas_price,
         )
-        tx_hash = web3.eth.sendRawTransaction(raw_tx)
         log.info(
             'Sending withdraw tx (hash: %s): %d from %r',
             encode_hex(tx_hash),